@@ -10,7 +10,7 @@ auth_bp = Blueprint('auth', __name__, template_folder='../templates') # Point to
 def login():
     # If user is already logged in, redirect them away from login page
     if current_user.is_authenticated:
-         return redirect(url_for('home')) # Redirect to main dashboard
+         return redirect(url_for('portal.home')) # Redirect to main dashboard
 
     if request.method == 'POST':
         username = request.form.get('username')
@@ -26,12 +26,12 @@ def login():
         # Check if user exists and password is correct
         if user and user.check_password(password):
             login_user(user, remember=remember)
-            logger.info(f"User '{username}' logged in successfully.")
+            logger.info("User '%s' logged in successfully.", username)
             # Redirect to the page user tried to access, or home page
             next_page = request.args.get('next')
-            return redirect(next_page or url_for('home'))
+            return redirect(next_page or url_for('portal.home'))
         else:
-            logger.warning(f"Failed login attempt for username: '{username}'")
+            logger.warning("Failed login attempt for username: '%s'", username)
             flash('Invalid username or password. Please try again.', 'danger')
             return redirect(url_for('auth.login'))
 
@@ -41,7 +41,7 @@ def login():
 @auth_bp.route('/logout')
 @login_required # Must be logged in to log out
 def logout():
-    logger.info(f"User '{current_user.id}' logged out.")
+    logger.info("User '%s' logged out.", current_user.id)
     logout_user()
     flash('You have been successfully logged out.', 'success')
     return redirect(url_for('auth.login')) # Redirect to login page after logout
\ No newline at end of file
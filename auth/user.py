@@ -1,13 +1,14 @@
 import csv
 import os
-from dotenv import load_dotenv
+from utils.env import EnvSettings
 from flask_login import UserMixin
 from werkzeug.security import check_password_hash
 import logging
-load_dotenv()
 
 logger = logging.getLogger(__name__)
-USERS_FILE = os.getenv("OWNER_IDS_RECORD")
+env = EnvSettings(
+    USERS_FILE=(None, str, 'OWNER_IDS_RECORD'),
+)
 
 class User(UserMixin):
     def __init__(self, username, password_hash):
@@ -22,19 +23,19 @@ class User(UserMixin):
     @staticmethod
     def get(user_id):
         """Loads a user by username (user_id) from the CSV file."""
-        if not os.path.exists(USERS_FILE):
-            logger.error(f"Users file not found: {USERS_FILE}")
+        if not os.path.exists(env.USERS_FILE):
+            logger.error("Users file not found: %s", env.USERS_FILE)
             return None
         try:
-            with open(USERS_FILE, 'r', newline='') as f:
+            with open(env.USERS_FILE, 'r', newline='') as f:
                 reader = csv.DictReader(f)
                 for row in reader:
                     if row['username'] == user_id:
                         return User(row['username'], row['password_hash'])
         except FileNotFoundError:
-            logger.error(f"Users file not found during get: {USERS_FILE}")
+            logger.error("Users file not found during get: %s", env.USERS_FILE)
             return None
         except Exception as e:
-             logger.exception(f"Error reading users file {USERS_FILE}: {e}")
+             logger.exception("Error reading users file %s: %s", env.USERS_FILE, e)
              return None
         return None # User not found
\ No newline at end of file
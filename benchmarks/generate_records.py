@@ -0,0 +1,109 @@
+"""
+Synthetic data for the portal's record stores.
+
+records      user_records.csv rows (csv_service.FIELDNAMES) with Zipf-skewed usernames,
+             IPs and operators and strictly increasing timestamps. The sparse
+             timestamp index is rebuilt afterwards.
+known_hosts  OpenSSH known_hosts lines with random ed25519 host keys.
+
+    python benchmarks/generate_records.py records /tmp/user_records.csv --rows 1000000
+    python benchmarks/generate_records.py known_hosts /tmp/known_hosts --rows 50000
+"""
+import os
+import sys
+import csv
+import base64
+import struct
+import random
+import argparse
+import itertools
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+FIELDNAMES = ['Timestamp', 'IP Address', 'Username', 'Action By']
+BATCH_SIZE = 10000
+
+def zipf_cum_weights(count, skew):
+    """Cumulative weights where the item of rank r has weight 1 / r**skew."""
+    return list(itertools.accumulate(1 / (rank ** skew) for rank in range(1, count + 1)))
+
+def host_ips(count):
+    """Deterministic, distinct IPs spread over 10.0.0.0/8 subnets."""
+    return [f"10.{(i // 254) >> 8 & 255}.{(i // 254) & 255}.{i % 254 + 1}" for i in range(count)]
+
+def generate_records(path, rows, users=5000, hosts=2000, operators=20, skew=1.1,
+                     start=None, mean_gap_seconds=30, seed=None):
+    """
+    Writes a user_records.csv style file.
+
+    Args:
+        path: Output file, overwritten.
+        rows: Number of data rows.
+        users, hosts, operators: Sizes of the username, IP and operator populations.
+        skew: Zipf exponent; higher values concentrate rows on the first few users/hosts.
+        start: Timestamp of the first row (default: rows * mean gap before now).
+        mean_gap_seconds: Mean spacing of consecutive timestamps.
+        seed: Random seed for reproducible files.
+    """
+    rng = random.Random(seed)
+    usernames = [f"user{i:06d}" for i in range(users)]
+    ips = host_ips(hosts)
+    operator_names = [f"operator{i:03d}" for i in range(operators)]
+    user_weights = zipf_cum_weights(users, skew)
+    host_weights = zipf_cum_weights(hosts, skew)
+    operator_weights = zipf_cum_weights(operators, skew)
+
+    timestamp = start or (datetime.now() - timedelta(seconds=rows * mean_gap_seconds))
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(FIELDNAMES)
+        written = 0
+        while written < rows:
+            batch = min(BATCH_SIZE, rows - written)
+            batch_users = rng.choices(usernames, cum_weights=user_weights, k=batch)
+            batch_ips = rng.choices(ips, cum_weights=host_weights, k=batch)
+            batch_operators = rng.choices(operator_names, cum_weights=operator_weights, k=batch)
+            out = []
+            for i in range(batch):
+                # At least 1 microsecond apart, so timestamps are strictly increasing
+                timestamp += timedelta(microseconds=1 + int(rng.expovariate(1 / mean_gap_seconds) * 1e6))
+                out.append((timestamp.isoformat(), batch_ips[i], batch_users[i], batch_operators[i]))
+            writer.writerows(out)
+            written += batch
+
+    from service.record_index import rebuild_index
+    rebuild_index(path)
+
+def _ed25519_blob(rng):
+    key_type = b"ssh-ed25519"
+    key = rng.randbytes(32)
+    return struct.pack(">I", len(key_type)) + key_type + struct.pack(">I", len(key)) + key
+
+def generate_known_hosts(path, rows, seed=None):
+    """Writes a known_hosts file with one random ed25519 key per host."""
+    rng = random.Random(seed)
+    with open(path, 'w') as f:
+        for ip in host_ips(rows):
+            f.write(f"{ip} ssh-ed25519 {base64.b64encode(_ed25519_blob(rng)).decode('ascii')}\n")
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic record store files.")
+    parser.add_argument('store', choices=['records', 'known_hosts'], help="Which store to generate")
+    parser.add_argument('path', help="Output file (overwritten)")
+    parser.add_argument('--rows', type=int, default=100000, help="Rows to generate (10k to 10M)")
+    parser.add_argument('--users', type=int, default=5000, help="Distinct usernames")
+    parser.add_argument('--hosts', type=int, default=2000, help="Distinct host IPs")
+    parser.add_argument('--operators', type=int, default=20, help="Distinct operators (Action By)")
+    parser.add_argument('--skew', type=float, default=1.1, help="Zipf exponent of the distributions")
+    parser.add_argument('--seed', type=int, default=None, help="Random seed")
+    args = parser.parse_args()
+
+    if args.store == 'records':
+        generate_records(args.path, args.rows, args.users, args.hosts, args.operators, args.skew, seed=args.seed)
+    else:
+        generate_known_hosts(args.path, args.rows, seed=args.seed)
+    print(f"Wrote {args.rows} {args.store} rows to {args.path} ({os.path.getsize(args.path) / 1e6:.1f} MB)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,266 @@
+"""
+HTTP load test for the portal's web tier.
+
+Drives a weighted mix of requests at a fixed concurrency for a fixed duration and
+reports throughput and latency percentiles per route. Run it against a server started
+with the stub SSH backend, so only the web tier is measured:
+
+    # compare worker/thread settings
+    python benchmarks/loadtest.py --seed-operator --users-file /tmp/loadtest_users.csv --seed-only
+    OWNER_IDS_RECORD=/tmp/loadtest_users.csv GUNICORN_WORKERS=4 GUNICORN_THREADS=8 \
+        gunicorn -c gunicorn.conf.py benchmarks.stub_wsgi:app
+    python benchmarks/loadtest.py --url http://127.0.0.1:5000
+
+    # or let the harness serve the app in-process (threaded werkzeug server)
+    python benchmarks/loadtest.py --serve --seed-operator --concurrency 16 --duration 30
+
+The operator account is taken from --username/--password. --seed-operator writes it
+(scrypt hash, as utils/hash_password.py does) to a users file of its own, --users-file
+or a new temporary file, never to the configured OWNER_IDS_RECORD. With --serve the
+in-process app uses that file.
+"""
+import os
+import sys
+import csv
+import json
+import time
+import random
+import argparse
+import tempfile
+import threading
+import http.cookiejar
+import urllib.error
+import urllib.parse
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+DEFAULT_MIX = "login=1,user_ips=10,logs=2,export=1,giveaccess=2,removeaccess=1"
+PUB_KEY = "ssh-ed25519 AAAAC3NzaC1lZDI1NTE5AAAAIHBvcnRhbC1sb2FkdGVzdC1rZXkuLi4uLi4uLi4uLi4u loadtest@portal"
+
+# Statuses that count as a successful response per scenario
+EXPECTED_STATUS = {
+    'login': {302},
+    'user_ips': {200, 404},
+    'logs': {200},
+    'export': {200},
+    'giveaccess': {200},
+    'removeaccess': {200},
+}
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+def _new_opener():
+    return urllib.request.build_opener(
+        urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()),
+        _NoRedirect()
+    )
+
+def _request(opener, base_url, method, path, form=None, json_body=None):
+    """Sends one request and returns its HTTP status (0 on connection errors)."""
+    data = None
+    headers = {}
+    if form is not None:
+        data = urllib.parse.urlencode(form).encode('utf-8')
+        headers['Content-Type'] = 'application/x-www-form-urlencoded'
+    elif json_body is not None:
+        data = json.dumps(json_body).encode('utf-8')
+        headers['Content-Type'] = 'application/json'
+    req = urllib.request.Request(base_url + path, data=data, headers=headers, method=method)
+    try:
+        with opener.open(req, timeout=60) as response:
+            response.read()
+            return response.status
+    except urllib.error.HTTPError as e:
+        e.read()
+        return e.code
+    except (urllib.error.URLError, OSError):
+        return 0
+
+class Scenario:
+    """One load-test client: an authenticated session and the request mix."""
+
+    def __init__(self, args):
+        self.args = args
+        self.opener = _new_opener()
+
+    def login(self, opener=None):
+        form = {'username': self.args.username, 'password': self.args.password}
+        return _request(opener or self.opener, self.args.url, 'POST', '/login', form=form)
+
+    def _random_user(self):
+        return f"lt_user{random.randrange(self.args.users):05d}"
+
+    def _random_ips(self):
+        return [f"10.{random.randrange(4)}.{random.randrange(256)}.{random.randrange(1, 255)}"
+                for _ in range(self.args.hosts)]
+
+    def run(self, name):
+        if name == 'login':
+            # A fresh session each time, this measures the password hash check
+            return self.login(_new_opener())
+        if name == 'user_ips':
+            return _request(self.opener, self.args.url, 'GET', f"/api/get-user-ips/{self._random_user()}")
+        if name == 'logs':
+            return _request(self.opener, self.args.url, 'GET', '/accesspoint/logs')
+        if name == 'export':
+            return _request(self.opener, self.args.url, 'GET', '/accesspoint/logs/export?format=ndjson')
+        if name == 'giveaccess':
+            payload = {'username': self._random_user(), 'pub_key': PUB_KEY,
+                       'ips': ','.join(self._random_ips()), 'groups': '', 'add_to_sudoers': False}
+            return _request(self.opener, self.args.url, 'POST', '/accesspoint/giveaccess', json_body=payload)
+        if name == 'removeaccess':
+            payload = {'username': self._random_user(), 'ips': self._random_ips()}
+            return _request(self.opener, self.args.url, 'POST', '/accesspoint/removeaccess', json_body=payload)
+        raise ValueError(f"Unknown scenario: {name}")
+
+def parse_mix(mix):
+    """Parses "name=weight,..." into (names, weights)."""
+    names, weights = [], []
+    for part in mix.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in EXPECTED_STATUS:
+            raise ValueError(f"Unknown scenario '{name}', choose from {', '.join(EXPECTED_STATUS)}")
+        names.append(name)
+        weights.append(float(weight or 1))
+    return names, weights
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(int(round(pct / 100 * len(sorted_values))) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+def seed_operator(username, password, users_file=None):
+    """
+    Adds or replaces the operator in a load test users file, a new temporary file if
+    users_file is not given. Returns the path of the file.
+    """
+    from werkzeug.security import generate_password_hash
+
+    if users_file is None:
+        fd, users_file = tempfile.mkstemp(prefix='loadtest_users_', suffix='.csv')
+        os.close(fd)
+    rows = []
+    if os.path.exists(users_file):
+        with open(users_file, 'r', newline='') as f:
+            rows = [row for row in csv.DictReader(f) if row['username'] != username]
+    rows.append({'username': username, 'password_hash': generate_password_hash(password)})
+    with open(users_file, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=['username', 'password_hash'])
+        writer.writeheader()
+        writer.writerows(rows)
+    return users_file
+
+def serve_in_process():
+    """Starts the portal with the stub SSH backend on a free local port. Returns the base URL."""
+    from werkzeug.serving import make_server
+    from benchmarks.stub_wsgi import app
+
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}"
+
+def run_load(args, names, weights):
+    """Runs the workers until the deadline. Returns {route: [latencies]} and {route: errors}."""
+    latencies = {name: [] for name in names}
+    errors = {name: 0 for name in names}
+    lock = threading.Lock()
+    deadline = time.monotonic() + args.duration
+
+    def worker():
+        scenario = Scenario(args)
+        if scenario.login() != 302:
+            with lock:
+                errors.setdefault('setup_login', 0)
+                errors['setup_login'] += 1
+            return
+        while time.monotonic() < deadline:
+            name = random.choices(names, weights)[0]
+            start = time.perf_counter()
+            status = scenario.run(name)
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies[name].append(elapsed)
+                if status not in EXPECTED_STATUS[name]:
+                    errors[name] += 1
+
+    threads = [threading.Thread(target=worker) for _ in range(args.concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors
+
+def build_report(latencies, errors, duration):
+    report = {}
+    for name, values in latencies.items():
+        values.sort()
+        report[name] = {
+            'requests': len(values),
+            'errors': errors.get(name, 0),
+            'rps': round(len(values) / duration, 2),
+            'p50_ms': round(percentile(values, 50) * 1000, 2),
+            'p90_ms': round(percentile(values, 90) * 1000, 2),
+            'p99_ms': round(percentile(values, 99) * 1000, 2),
+            'max_ms': round((values[-1] if values else 0) * 1000, 2),
+        }
+    total = sum(len(values) for values in latencies.values())
+    report['total'] = {'requests': total, 'errors': sum(errors.values()), 'rps': round(total / duration, 2)}
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the portal web tier.")
+    parser.add_argument('--url', default='http://127.0.0.1:5000', help="Base URL of a running portal")
+    parser.add_argument('--serve', action='store_true', help="Serve the app in-process with the stub SSH backend")
+    parser.add_argument('--username', default='loadtest', help="Operator to log in as")
+    parser.add_argument('--password', default='loadtest', help="Operator password")
+    parser.add_argument('--seed-operator', action='store_true', help="Write the operator to a load test users file first")
+    parser.add_argument('--users-file', help="Users file for --seed-operator (default: a new temporary file)")
+    parser.add_argument('--seed-only', action='store_true', help="Exit after --seed-operator, e.g. before starting gunicorn")
+    parser.add_argument('--concurrency', type=int, default=8, help="Concurrent clients")
+    parser.add_argument('--duration', type=float, default=30, help="Test duration in seconds")
+    parser.add_argument('--mix', default=DEFAULT_MIX, help=f"Weighted request mix (default: {DEFAULT_MIX})")
+    parser.add_argument('--users', type=int, default=200, help="Size of the target username pool")
+    parser.add_argument('--hosts', type=int, default=3, help="Hosts per give/remove request")
+    parser.add_argument('--json', action='store_true', help="Print machine readable results")
+    args = parser.parse_args()
+
+    names, weights = parse_mix(args.mix)
+    if args.seed_operator:
+        users_file = seed_operator(args.username, args.password, args.users_file)
+        if args.seed_only:
+            print(users_file)
+            return
+        if args.serve:
+            # load_env() does not override variables that are already set
+            os.environ['OWNER_IDS_RECORD'] = users_file
+        else:
+            print(f"Seeded {args.username} into {users_file}; the server must run with OWNER_IDS_RECORD={users_file}",
+                  file=sys.stderr)
+    if args.serve:
+        args.url = serve_in_process()
+
+    latencies, errors = run_load(args, names, weights)
+    report = build_report(latencies, errors, args.duration)
+
+    if args.json:
+        print(json.dumps({'url': args.url, 'concurrency': args.concurrency, 'duration': args.duration,
+                          'mix': args.mix, 'routes': report}, indent=2))
+        return
+
+    print(f"{args.url}  concurrency={args.concurrency}  duration={args.duration}s")
+    print(f"{'route':<14}{'requests':>10}{'errors':>8}{'rps':>9}{'p50 ms':>9}{'p90 ms':>9}{'p99 ms':>9}{'max ms':>9}")
+    for name in names:
+        row = report[name]
+        print(f"{name:<14}{row['requests']:>10}{row['errors']:>8}{row['rps']:>9}"
+              f"{row['p50_ms']:>9}{row['p90_ms']:>9}{row['p99_ms']:>9}{row['max_ms']:>9}")
+    total = report['total']
+    print(f"{'total':<14}{total['requests']:>10}{total['errors']:>8}{total['rps']:>9}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""
+Scaling benchmarks for service/csv_service.py.
+
+For every size, a synthetic user_records.csv is generated (benchmarks/generate_records.py)
+and each operation is timed in a fresh interpreter, on its own copy of the file, so the
+reported peak memory (growth of max RSS during the operation) is not polluted by
+earlier runs.
+
+    python benchmarks/record_store.py --sizes 10000,100000,1000000
+    python benchmarks/record_store.py --sizes 10000,1000000,10000000 --json > record_store.json
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import resource
+import tempfile
+import subprocess
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+OPERATIONS = [
+    'get_all_servers_for_user',
+    'get_all_log_records',
+    'iter_log_records_last_1pct',
+    'write_to_csv',
+    'remove_user_records_from_csv',
+    'record_snapshot_build',
+    'record_snapshot_query',
+]
+WRITES_PER_RUN = 100
+
+def _max_rss_bytes():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+def run_operation(operation, data_file):
+    """Runs one operation against data_file in this process. Returns (seconds, peak_bytes)."""
+    import logging
+    logging.disable(logging.WARNING)
+    from service import csv_service
+    csv_service.DATA_FILE = data_file
+    csv_service.LOCK_FILE = f"{data_file}.lock"
+
+    # Busiest user/host of the Zipf distribution, see generate_records.py
+    username, ip = 'user000000', '10.0.0.1'
+    if operation == 'record_snapshot_query':
+        # Built before the clock starts, only the lookup on a warm snapshot is measured
+        from service.record_snapshot import get_snapshot
+        snapshot = get_snapshot()
+    baseline = _max_rss_bytes()
+    start = time.perf_counter()
+    if operation == 'get_all_servers_for_user':
+        csv_service.get_all_servers_for_user(username)
+    elif operation == 'get_all_log_records':
+        csv_service.get_all_log_records()
+    elif operation == 'iter_log_records_last_1pct':
+        from datetime import datetime
+        with open(data_file, 'rb') as f:
+            size = os.path.getsize(data_file)
+            f.seek(max(size - size // 100, 0))
+            f.readline()
+            line = f.readline().decode('utf-8')
+        range_start = datetime.fromisoformat(line.split(',', 1)[0]) if line else None
+        for _ in csv_service.iter_log_records(start=range_start):
+            pass
+    elif operation == 'write_to_csv':
+        for i in range(WRITES_PER_RUN):
+            csv_service.write_to_csv(f"bench{i}", ip, 'benchmark')
+    elif operation == 'remove_user_records_from_csv':
+        csv_service.remove_user_records_from_csv(username, ip, 'benchmark')
+    elif operation == 'record_snapshot_build':
+        from service.record_snapshot import get_snapshot
+        get_snapshot()
+    elif operation == 'record_snapshot_query':
+        snapshot.query(username=username).ips()
+    else:
+        raise ValueError(f"Unknown operation: {operation}")
+    elapsed = time.perf_counter() - start
+    return elapsed, max(_max_rss_bytes() - baseline, 0)
+
+def measure(operation, source_file, work_dir):
+    """Times operation in a child process on a private copy of source_file."""
+    data_file = os.path.join(work_dir, f"{operation}.csv")
+    shutil.copyfile(source_file, data_file)
+    index_file = f"{source_file}.idx"
+    if os.path.exists(index_file):
+        shutil.copyfile(index_file, f"{data_file}.idx")
+    try:
+        result = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--run', operation, data_file],
+            cwd=REPO_ROOT, capture_output=True, text=True, check=True
+        )
+        return json.loads(result.stdout.strip().splitlines()[-1])
+    finally:
+        for path in (data_file, f"{data_file}.idx", f"{data_file}.lock"):
+            if os.path.exists(path):
+                os.remove(path)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark csv_service operations at several record counts.")
+    parser.add_argument('--sizes', default='10000,100000,1000000', help="Comma separated row counts")
+    parser.add_argument('--operations', default=','.join(OPERATIONS), help="Comma separated operations")
+    parser.add_argument('--seed', type=int, default=1, help="Random seed of the generated data")
+    parser.add_argument('--json', action='store_true', help="Print machine readable results")
+    parser.add_argument('--run', nargs=2, metavar=('OPERATION', 'DATA_FILE'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        seconds, peak_bytes = run_operation(*args.run)
+        print(json.dumps({'seconds': seconds, 'peak_bytes': peak_bytes}))
+        return
+
+    from benchmarks.generate_records import generate_records
+    sizes = [int(size) for size in args.sizes.split(',')]
+    operations = [operation.strip() for operation in args.operations.split(',')]
+    results = []
+    with tempfile.TemporaryDirectory(prefix='record_store_bench_') as work_dir:
+        for size in sizes:
+            source_file = os.path.join(work_dir, f"records_{size}.csv")
+            generate_records(source_file, size, seed=args.seed)
+            for operation in operations:
+                result = measure(operation, source_file, work_dir)
+                results.append({'rows': size, 'operation': operation, **result})
+                if not args.json:
+                    note = f" ({WRITES_PER_RUN} writes)" if operation == 'write_to_csv' else ''
+                    print(f"{size:>10} rows  {operation:<30} {result['seconds'] * 1000:10.1f} ms"
+                          f"  peak +{result['peak_bytes'] / 1e6:8.1f} MB{note}", flush=True)
+            os.remove(source_file)
+
+    if args.json:
+        print(json.dumps({'writes_per_run': WRITES_PER_RUN, 'results': results}, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Measures worker startup cost: importing the app module and running create_app().
+
+Each run is a fresh interpreter started with `python -X importtime`, so the numbers
+include everything a new gunicorn worker pays. Prints the median wall times and the
+slowest top-level imports (cumulative, as reported by -X importtime).
+
+    python benchmarks/startup.py --runs 5 --top 15
+    python benchmarks/startup.py --json > startup.json
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in the child interpreter. SECRET_KEY only has to be non-empty for create_app().
+PROBE = """
+import os, time, json
+os.environ.setdefault('SECRET_KEY', 'startup-benchmark')
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+app.create_app()
+created = time.perf_counter()
+print(json.dumps({'import_s': imported - start, 'create_app_s': created - imported}))
+"""
+
+def parse_importtime(stderr):
+    """
+    Parses `-X importtime` output.
+
+    Returns:
+        list: (module, self_us, cumulative_us, depth) tuples in import order.
+    """
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|', 2)
+        depth = (len(name) - len(name.lstrip(' '))) // 2
+        rows.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return rows
+
+def run_once():
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', PROBE],
+        cwd=REPO_ROOT, capture_output=True, text=True, check=True
+    )
+    timings = json.loads(result.stdout.strip().splitlines()[-1])
+    return timings, parse_importtime(result.stderr)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark app import and create_app() time.")
+    parser.add_argument('--runs', type=int, default=5, help="Number of fresh interpreters to measure")
+    parser.add_argument('--top', type=int, default=15, help="Number of slowest imports to list")
+    parser.add_argument('--json', action='store_true', help="Print machine readable results")
+    args = parser.parse_args()
+
+    runs = [run_once() for _ in range(args.runs)]
+    import_s = statistics.median(timings['import_s'] for timings, _ in runs)
+    create_app_s = statistics.median(timings['create_app_s'] for timings, _ in runs)
+
+    # Median cumulative time per module imported directly by the interpreter's top level
+    per_module = {}
+    for _, rows in runs:
+        for name, _, cumulative_us, depth in rows:
+            if depth == 1:
+                per_module.setdefault(name, []).append(cumulative_us)
+    slowest = sorted(((statistics.median(v), name) for name, v in per_module.items()), reverse=True)[:args.top]
+    heavy = [name for name in ('paramiko', 'cryptography') if name in per_module]
+
+    if args.json:
+        print(json.dumps({
+            'runs': args.runs,
+            'import_ms': round(import_s * 1000, 2),
+            'create_app_ms': round(create_app_s * 1000, 2),
+            'heavy_modules_at_startup': heavy,
+            'slowest_imports_ms': {name: round(us / 1000, 2) for us, name in slowest},
+        }, indent=2))
+        return
+
+    print(f"Runs: {args.runs} (median)")
+    print(f"import app:     {import_s * 1000:8.1f} ms")
+    print(f"create_app():   {create_app_s * 1000:8.1f} ms")
+    print(f"Heavy modules imported at startup: {', '.join(heavy) or 'none'}")
+    print("\nSlowest top-level imports (cumulative):")
+    for us, name in slowest:
+        print(f"  {us / 1000:8.1f} ms  {name}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+In-memory stand-in for service.ssh_service.SSHClient, for load tests of the web tier.
+
+Understands the commands issued by service/create_user.py and service/remove_user.py
+and keeps per-host account state in memory. Every connect and command sleeps for a
+configurable latency, so the portal's fan-out behaves roughly as with real hosts.
+
+    STUB_SSH_CONNECT_MS=50 STUB_SSH_COMMAND_MS=5
+"""
+import io
+import os
+import re
+import time
+import shlex
+import threading
+
+STUB_SSH_CONNECT_MS = float(os.getenv('STUB_SSH_CONNECT_MS', 50))
+STUB_SSH_COMMAND_MS = float(os.getenv('STUB_SSH_COMMAND_MS', 5))
+
+_hosts = {}  # ip -> {username: {'groups': set, 'keys': set}}
+_lock = threading.Lock()
+
+class _Channel:
+    def __init__(self, exit_status):
+        self._exit_status = exit_status
+
+    def recv_exit_status(self):
+        return self._exit_status
+
+class _Stream(io.BytesIO):
+    def __init__(self, data, exit_status):
+        super().__init__(data.encode('utf-8'))
+        self.channel = _Channel(exit_status)
+
+def _user_from_path(command):
+    match = re.search(r"/home/([^/\s']+)/", command)
+    return match.group(1) if match else None
+
+class _Transport:
+    def __init__(self):
+        self.active = True
+
+    def is_active(self):
+        return self.active
+
+class StubSSHClient:
+    def __init__(self, ip, *args, **kwargs):
+        self.ip = ip
+        self.last_error = None
+        self._transport = None
+
+    def connect(self):
+        # Like SSHClient.connect(), a no-op on a (warm) connected client
+        if self._transport is not None and self._transport.is_active():
+            return True, f"Already connected to {self.ip} (stub)"
+        time.sleep(STUB_SSH_CONNECT_MS / 1000)
+        self._transport = _Transport()
+        return True, f"Connected to {self.ip} (stub)"
+
+    def get_transport(self):
+        return self._transport
+
+    def close(self):
+        if self._transport is not None:
+            self._transport.active = False
+
+    def exec_command(self, command, *args, **kwargs):
+        time.sleep(STUB_SSH_COMMAND_MS / 1000)
+        output, exit_status = self._run(command)
+        return None, _Stream(output, exit_status), _Stream('', exit_status)
+
+    def _run(self, command):
+        with _lock:
+            users = _hosts.setdefault(self.ip, {})
+
+            match = re.match(r"id -un (\S+) 2>/dev/null && groups (\S+)", command)
+            if match:
+                user = users.get(match.group(1))
+                if user is None:
+                    return '', 1
+                return f"{match.group(1)}\n{match.group(1)} : {match.group(1)} {' '.join(sorted(user['groups']))}", 0
+            match = re.match(r"id -u (\S+)$", command)
+            if match:
+                return ('1001', 0) if match.group(1) in users else ('', 1)
+            if command.startswith('test -'):
+                return '', 0 if _user_from_path(command) in users else 1
+            match = re.search(r"sudo useradd -m -s /bin/bash (\S+)", command)
+            if match:
+                users.setdefault(match.group(1), {'groups': set(), 'keys': set()})
+                return '', 0
+            match = re.match(r"sudo usermod -aG sudo (\S+)", command)
+            if match:
+                users[match.group(1)]['groups'].add('sudo')
+                return '', 0
+            match = re.search(r"sudo deluser (\S+) sudo", command)
+            if match:
+                users[match.group(1)]['groups'].discard('sudo')
+                return '', 0
+            match = re.match(r"sudo sh -c '\nu=(\S+)\n", command)
+            if match:
+                # service.remove_user.build_removal_command()
+                if users.pop(match.group(1), None) is None:
+                    return '', 3
+                return 'killed=0\nuserdel_status=0\nuserdel_output=\n', 0
+            if command.startswith("sudo sh -c ") and '\nline=' in command:
+                # service.create_user.plan_user_changes(), adding a key; stored as
+                # "type base64", the form probe_user_state() greps for
+                script = shlex.split(command)[3]
+                line = next(value for name, _, value in (row.partition('=') for row in script.splitlines()) if name == 'line')
+                users[_user_from_path(command)]['keys'].add(' '.join(shlex.split(line)[0].split()[:2]))
+                return '', 0
+            if 'grep -Fwq' in command:
+                user = users.get(_user_from_path(command))
+                key = command.split("'")[1]
+                return ('', 0) if user and key in user['keys'] else ('NOT_FOUND', 0)
+            # mkdir/chown/chmod/touch and anything else succeed without changing state
+            return '', 0
+
+def install():
+    """
+    Replaces the SSH client everywhere the portal creates one with the stub.
+
+    Modules that import SSHClient at import time are patched by name; the ones that
+    import it inside functions (key_index, bastion) pick up the patched
+    service.ssh_service.SSHClient. Grants get their clients through
+    warm_pool.checkout_client(), so patching warm_pool covers them.
+    """
+    import service.ssh_service
+    import service.warm_pool
+    import service.remove_user
+    import service.rotate_key
+    for module in (service.ssh_service, service.warm_pool, service.remove_user, service.rotate_key):
+        module.SSHClient = StubSSHClient
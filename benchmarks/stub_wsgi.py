@@ -0,0 +1,10 @@
+"""
+WSGI entry point serving the portal with the stub SSH backend, for load tests.
+
+    gunicorn -c gunicorn.conf.py benchmarks.stub_wsgi:app
+"""
+from app import create_app
+from benchmarks.stub_ssh import install
+
+app = create_app()
+install()
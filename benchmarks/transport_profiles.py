@@ -0,0 +1,179 @@
+"""
+Compares the SSH transport profiles of config/transport_profiles.py.
+
+A local stand-in SSH server (paramiko, password auth, answers every exec with a fixed
+output) runs in a child process, so its CPU use does not count against the client.
+For every profile, service.ssh_service.SSHClient measures:
+
+- handshake: TCP connect, key exchange, host key check and authentication, on a
+  new connection each time,
+- command: exec of a small command plus reading its output and exit status, on
+  one open connection.
+
+    python benchmarks/transport_profiles.py --handshakes 30 --commands 300
+    python benchmarks/transport_profiles.py --profiles default,lan-fast --output-bytes 65536 --json
+"""
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import tempfile
+import threading
+import statistics
+import subprocess
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+STAND_IN_USER = 'bench'
+STAND_IN_PASSWORD = 'bench'
+
+def serve(output_bytes):
+    """Runs the stand-in server until stdin closes. Prints the listening port first."""
+    import paramiko
+
+    host_key = paramiko.ECDSAKey.generate()
+    output = b'x' * output_bytes
+
+    class StandIn(paramiko.ServerInterface):
+        def check_auth_password(self, username, password):
+            if username == STAND_IN_USER and password == STAND_IN_PASSWORD:
+                return paramiko.AUTH_SUCCESSFUL
+            return paramiko.AUTH_FAILED
+
+        def get_allowed_auths(self, username):
+            return 'password'
+
+        def check_channel_request(self, kind, chanid):
+            return paramiko.OPEN_SUCCEEDED if kind == 'session' else paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+        def check_channel_exec_request(self, channel, command):
+            def reply():
+                channel.sendall(output)
+                channel.send_exit_status(0)
+                # EOF rather than close: a close could overtake the exec reply, the client closes
+                channel.shutdown_write()
+            threading.Thread(target=reply, daemon=True).start()
+            return True
+
+    def handle(conn):
+        transport = paramiko.Transport(conn)
+        transport.add_server_key(host_key)
+        transport.start_server(server=StandIn())
+        channels = []  # keep accepted channels referenced until the client is done
+        while transport.is_active():
+            channel = transport.accept(1)
+            if channel is not None:
+                channels.append(channel)
+
+    listener = socket.socket()
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(128)
+    print(listener.getsockname()[1], flush=True)
+
+    def accept_loop():
+        while True:
+            conn, _ = listener.accept()
+            threading.Thread(target=handle, args=(conn,), daemon=True).start()
+
+    threading.Thread(target=accept_loop, daemon=True).start()
+    sys.stdin.read()
+
+def _summary(samples):
+    ordered = sorted(samples)
+    return {
+        'median_ms': round(statistics.median(ordered) * 1000, 3),
+        'p95_ms': round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 3),
+    }
+
+def measure_profile(profile, port, handshakes, commands):
+    from service.ssh_service import SSHClient
+
+    handshake_times = []
+    for _ in range(handshakes):
+        client = SSHClient('127.0.0.1', port=port, use_bastion=False, profile=profile)
+        start = time.perf_counter()
+        success, message = client.connect()
+        handshake_times.append(time.perf_counter() - start)
+        client.close()
+        if not success:
+            raise RuntimeError(f"Profile {profile}: {message}")
+
+    command_times = []
+    client = SSHClient('127.0.0.1', port=port, use_bastion=False, profile=profile)
+    success, message = client.connect()
+    if not success:
+        raise RuntimeError(f"Profile {profile}: {message}")
+    try:
+        transport = client.get_transport()
+        negotiated = {'cipher': transport.remote_cipher, 'kex': transport.kex_engine.__class__.__name__}
+        for _ in range(commands):
+            start = time.perf_counter()
+            stdin, stdout, stderr = client.exec_command('true')
+            stdout.read()
+            stdout.channel.recv_exit_status()
+            command_times.append(time.perf_counter() - start)
+    finally:
+        client.close()
+
+    return {'profile': profile, **negotiated,
+            'handshake': _summary(handshake_times), 'command': _summary(command_times)}
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark SSH transport profiles against a local stand-in server.")
+    parser.add_argument('--profiles', default=None, help="Comma separated profiles (default: all)")
+    parser.add_argument('--handshakes', type=int, default=20, help="New connections per profile")
+    parser.add_argument('--commands', type=int, default=200, help="Commands per profile, on one connection")
+    parser.add_argument('--output-bytes', type=int, default=64, help="Output size of each command")
+    parser.add_argument('--json', action='store_true', help="Print machine readable results")
+    parser.add_argument('--serve', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.output_bytes)
+        return
+
+    work_dir = tempfile.mkdtemp(prefix='transport_bench_')
+    # The stand-in's key is trusted on first use, in a throwaway known_hosts
+    os.environ.update({
+        'ADMIN_USERNAME': STAND_IN_USER,
+        'ADMIN_PASSWORD': STAND_IN_PASSWORD,
+        'KNOWN_HOSTS_FILE': os.path.join(work_dir, 'known_hosts'),
+        'SSH_STRICT_HOST_KEYS': 'false',
+        'TRANSPORT_PROFILES_FILE': os.path.join(work_dir, 'none.txt'),
+    })
+    from config.transport_profiles import TRANSPORT_PROFILES
+    profiles = args.profiles.split(',') if args.profiles else list(TRANSPORT_PROFILES)
+
+    server = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--serve', '--output-bytes', str(args.output_bytes)],
+                              stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+    try:
+        port = int(server.stdout.readline())
+        # Warm up imports and the known_hosts entry outside the measurements
+        measure_profile('default', port, 1, 1)
+        results = [measure_profile(profile, port, args.handshakes, args.commands) for profile in profiles]
+    finally:
+        server.stdin.close()
+        server.wait(timeout=10)
+
+    if args.json:
+        print(json.dumps({'handshakes': args.handshakes, 'commands': args.commands,
+                          'output_bytes': args.output_bytes, 'results': results}, indent=2))
+        return
+    baseline = next((result for result in results if result['profile'] == 'default'), None)
+    print(f"{'profile':<12} {'cipher':<24} {'handshake p50':>14} {'p95':>9} {'command p50':>12} {'p95':>9}")
+    for result in results:
+        line = (f"{result['profile']:<12} {result['cipher']:<24} {result['handshake']['median_ms']:>11.2f} ms"
+                f" {result['handshake']['p95_ms']:>6.2f} ms {result['command']['median_ms']:>9.3f} ms"
+                f" {result['command']['p95_ms']:>6.3f} ms")
+        if baseline is not None and result is not baseline:
+            handshake_change = result['handshake']['median_ms'] / baseline['handshake']['median_ms'] - 1
+            command_change = result['command']['median_ms'] / baseline['command']['median_ms'] - 1
+            line += f"   vs default: handshake {handshake_change:+.0%}, command {command_change:+.0%}"
+        print(line)
+
+if __name__ == "__main__":
+    main()
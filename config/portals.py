@@ -3,14 +3,14 @@ INTERNAL_TOOLS = [
         'id': 'accesspoint',
         'name': 'Access Point',
         'description': 'Grant and revoke SSH access to designated servers.',
-        'url_endpoint': 'accesspoint', # Use the function name for url_for
+        'url_endpoint': 'portal.accesspoint', # Use the endpoint name (blueprint.view_func) for url_for
         'icon': 'fas fa-server' # Example Font Awesome icon class
     },
     # {
     #     'id': 'logsviewer',
     #     'name': 'Access Logs',
     #     'description': 'View the history of granted server access.',
-    #     'url_endpoint': 'logs_page', # Links directly to the logs page
+    #     'url_endpoint': 'portal.logs_page', # Links directly to the logs page
     #     'icon': 'fas fa-clipboard-list' # Example Font Awesome icon class
     # },
     # --- Add future tools here ---
@@ -18,7 +18,7 @@ INTERNAL_TOOLS = [
     #     'id': 'futuretool',
     #     'name': 'Future Tool',
     #     'description': 'Placeholder for another internal utility.',
-    #     'url_endpoint': 'home', # Link somewhere, maybe back home for now
+    #     'url_endpoint': 'portal.home', # Link somewhere, maybe back home for now
     #     'icon': 'fas fa-tools'
     # },
 ]
\ No newline at end of file
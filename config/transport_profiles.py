@@ -0,0 +1,47 @@
+# Named SSH transport settings, selected per group in assets/transport_profiles.txt
+# (see service/transport_profiles.py). Keys left out keep paramiko's defaults.
+#
+#   connect_timeout      TCP connect timeout (seconds)
+#   banner_timeout       wait for the server's SSH banner
+#   auth_timeout         wait for an authentication response
+#   channel_timeout      wait for a channel (exec) to open
+#   ciphers, kex, digests
+#                        algorithms to offer first, in order; the rest stay enabled as fallback
+#   compress             zlib compression, only worth it on slow links
+#   window_size          SSH channel window (bytes)
+#   max_packet_size      SSH packet size (bytes)
+#   tcp_nodelay          disable Nagle, small commands are not held back
+#   tcp_keepalive        let the kernel detect dead peers
+#   keepalive_interval   SSH-level keepalive every N seconds, 0 disables
+TRANSPORT_PROFILES = {
+    'default': {
+        'description': 'paramiko defaults (the behaviour before profiles existed).',
+        'connect_timeout': 5,
+    },
+    'lan-fast': {
+        'description': 'Hosts on the local network: short timeouts, cheapest AES-NI friendly algorithms, no Nagle.',
+        'connect_timeout': 2,
+        'banner_timeout': 5,
+        'auth_timeout': 5,
+        'channel_timeout': 5,
+        # GCM needs no separate MAC, curve25519 is the cheapest key exchange
+        'ciphers': ['aes128-gcm@openssh.com', 'aes128-ctr'],
+        'kex': ['curve25519-sha256@libssh.org', 'ecdh-sha2-nistp256'],
+        'digests': ['hmac-sha2-256-etm@openssh.com', 'hmac-sha2-256'],
+        'compress': False,
+        'tcp_nodelay': True,
+    },
+    'wan-robust': {
+        'description': 'Remote sites and slow links: generous timeouts, compression, keepalives, larger windows.',
+        'connect_timeout': 15,
+        'banner_timeout': 30,
+        'auth_timeout': 30,
+        'channel_timeout': 30,
+        'kex': ['curve25519-sha256@libssh.org'],
+        'compress': True,
+        'window_size': 4 * 1024 * 1024,
+        'tcp_nodelay': True,
+        'tcp_keepalive': True,
+        'keepalive_interval': 15,
+    },
+}
@@ -0,0 +1,35 @@
+"""
+Gunicorn settings for running the portal with several worker processes.
+
+Each worker is a separate process with its own thread pool (gthread). Access
+records are shared through logs/user_records.csv and every mutation of it is
+serialized with an fcntl lock (see service/csv_service.py), so any number of
+workers on the same host can write safely. Override the defaults through the
+environment, e.g. GUNICORN_WORKERS=8 GUNICORN_THREADS=4.
+"""
+import multiprocessing
+import os
+from dotenv import load_dotenv
+load_dotenv()
+
+bind = f"0.0.0.0:{os.getenv('APP_PORT', 5000)}"
+
+# SSH fan-out is I/O bound, so a few processes with several threads each is a good default.
+workers = int(os.getenv('GUNICORN_WORKERS', min(multiprocessing.cpu_count() * 2 + 1, 8)))
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', 4))
+
+# Warm SSH connections (service/warm_pool.py) stay in the worker that opened them and
+# the grant usually lands on another one, so warm-up is off with several workers
+# unless SSH_WARMUP_MAX_CONNECTIONS is set explicitly. Workers inherit the environment.
+if workers > 1:
+    os.environ.setdefault('SSH_WARMUP_MAX_CONNECTIONS', '0')
+
+# Grants to large groups can take a while, one SSH session per host.
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 300))
+graceful_timeout = 30
+keepalive = 5
+
+accesslog = '-'
+errorlog = '-'
+loglevel = os.getenv('GUNICORN_LOG_LEVEL', 'info')
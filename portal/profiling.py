@@ -0,0 +1,78 @@
+"""
+Request hooks deciding which requests are profiled (see service/request_profiler.py).
+
+A request is profiled when
+- a profile admin (PROFILE_ADMINS) asks for it with ?profile=<mode> or an
+  X-Profile: <mode> header (mode cprofile or sample, anything else means the
+  configured mode), or
+- it falls in the sampled fraction set with POST /api/profiling (any user).
+
+Responses to profile admins carry X-Profile-Id and X-Profile-URL, the URL serving
+the profile; other users' responses do not reveal that they were sampled. Streamed
+response bodies (the log export) are produced after the profile is written and are
+not part of it.
+"""
+import random
+import logging
+from flask import g, request, url_for
+from flask_login import current_user
+from service.request_profiler import (PROFILE_MODES, ProfileSession, activate, deactivate,
+                                      get_settings, is_profile_admin)
+
+logger = logging.getLogger(__name__)
+
+def _requested_mode():
+    """Returns the mode to profile this request with, or None."""
+    requested = request.args.get('profile') or request.headers.get('X-Profile')
+    if requested:
+        if not (current_user.is_authenticated and is_profile_admin(current_user.id)):
+            logger.warning("Ignoring profile request for %s from a non-admin", request.path)
+            return None
+        return requested if requested in PROFILE_MODES else get_settings()['mode']
+    settings = get_settings()
+    if settings['sample_rate'] > 0 and random.random() < settings['sample_rate']:
+        return settings['mode']
+    return None
+
+def _start_profile():
+    if request.endpoint in (None, 'static'):
+        return
+    mode = _requested_mode()
+    if mode is None:
+        return
+    session = ProfileSession(mode, f"{request.method} {request.path}")
+    g.profile = (session, activate(session), session.begin_thread())
+
+def _finish_profile(response):
+    profile = g.pop('profile', None)
+    if profile is None:
+        return response
+    session, context_token, thread_token = profile
+    session.end_thread(thread_token)
+    deactivate(context_token)
+    try:
+        if session.finish() is not None and current_user.is_authenticated and is_profile_admin(current_user.id):
+            response.headers['X-Profile-Id'] = session.profile_id
+            response.headers['X-Profile-URL'] = url_for('portal.get_profile_api', profile_id=session.profile_id)
+    except Exception as e:
+        logger.exception("Could not write profile %s of %s: %s", session.profile_id, session.label, e)
+    return response
+
+def _abandon_profile(error=None):
+    # after_request does not run when the view raised; still write what was recorded
+    profile = g.pop('profile', None)
+    if profile is None:
+        return
+    session, context_token, thread_token = profile
+    session.end_thread(thread_token)
+    deactivate(context_token)
+    try:
+        session.finish()
+    except Exception as e:
+        logger.exception("Could not write profile %s of %s: %s", session.profile_id, session.label, e)
+
+def init_profiling(app):
+    """Registers the profiling hooks on the app."""
+    app.before_request(_start_profile)
+    app.after_request(_finish_profile)
+    app.teardown_request(_abandon_profile)
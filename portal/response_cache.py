@@ -0,0 +1,120 @@
+"""
+Conditional GET support and an in-process response cache for views that only read
+the record store.
+
+Responses are tagged with the record store version (see
+csv_service.record_store_version()), so clients revalidate with If-None-Match /
+If-Modified-Since and get a 304 while nothing has been written. Serialized bodies
+are kept in a small LRU per process; any write, from any worker, changes the version
+and empties it.
+"""
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from flask import Response, request, session
+from service.csv_service import record_store_version
+from utils.env import EnvSettings
+
+logger = logging.getLogger(__name__)
+
+env = EnvSettings(
+    RESPONSE_CACHE_SIZE=(256, int),
+)
+
+class ResponseCache:
+    """LRU of (body, status, mimetype) per key, valid for a single record store version."""
+
+    def __init__(self, max_entries=None):
+        self.max_entries = env.RESPONSE_CACHE_SIZE if max_entries is None else max_entries
+        self._entries = OrderedDict()
+        self._version = None
+        self._lock = threading.Lock()
+
+    def _sync_version(self, version):
+        if version != self._version:
+            self._entries.clear()
+            self._version = version
+
+    def get(self, key, version):
+        with self._lock:
+            self._sync_version(version)
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, version, entry):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._sync_version(version)
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def _get_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ResponseCache()
+    return _cache
+
+def _etag(key, version):
+    return hashlib.sha1(f"{version}|{key}".encode('utf-8')).hexdigest()
+
+def _set_validators(response, etag, last_modified):
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    # Always revalidate, and keep per-operator responses out of shared caches
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    response.vary.add('Cookie')
+
+def cached_response(key, build):
+    """
+    Returns a conditional response for a read-only view of the record store.
+
+    Args:
+        key: Tuple identifying the response, including anything it depends on besides
+            the record store (endpoint, arguments, operator).
+        build: Callable returning (body, status, mimetype); called only when neither the
+            client nor this process has the response for the current version.
+
+    Returns:
+        Response: 304 if the client copy is current, otherwise the (cached) response.
+    """
+    if session.get('_flashes'):
+        # Pending flash messages are rendered once, so the page must not be reused
+        body, status, mimetype = build()
+        return Response(body, status=status, mimetype=mimetype)
+
+    version, last_modified = record_store_version()
+    etag = _etag(key, version)
+
+    not_modified = Response(status=200)
+    _set_validators(not_modified, etag, last_modified)
+    not_modified.make_conditional(request)
+    if not_modified.status_code == 304:
+        return not_modified
+
+    entry = _get_cache().get(key, version)
+    if entry is None:
+        entry = build()
+        _get_cache().put(key, version, entry)
+    else:
+        logger.debug("Response cache hit for %s", key[0])
+    body, status, mimetype = entry
+    response = Response(body, status=status, mimetype=mimetype)
+    _set_validators(response, etag, last_modified)
+    return response
@@ -0,0 +1,708 @@
+"""
+Routes of the portal itself: home, Access Point pages and their APIs.
+
+Modules that pull in paramiko/cryptography (everything that opens SSH connections)
+are imported inside the views that need them, so creating the app stays cheap.
+"""
+from datetime import datetime
+from flask import Blueprint, current_app, jsonify, request, render_template, url_for, flash, redirect, Response, send_file, stream_with_context
+from flask_login import login_required, current_user
+import os
+import logging
+
+from config.portals import INTERNAL_TOOLS
+from service.csv_service import get_all_servers_for_user, iter_log_records, set_access_expiry
+from service.expiry_scheduler import parse_expires_at
+from service.export_service import EXPORT_FORMATS, generate_export
+from service.key_index import lookup_fingerprint
+from service.record_snapshot import get_snapshot
+from service.request_profiler import find_profile, get_settings, is_profile_admin, update_settings
+from service.ssh_scheduler import get_scheduler
+from portal.response_cache import cached_response
+from utils.get_group_list import get_group_list
+from utils.validators import validate_ip, validate_username, validate_pub_key
+from utils.group_ip_provider import get_ips_from_group
+from utils.logging_config import log_context
+from utils.ssh_keys import parse_public_key, is_fingerprint
+
+logger = logging.getLogger(__name__)
+portal_bp = Blueprint('portal', __name__, template_folder='../templates') # Point to root templates
+
+@portal_bp.app_context_processor
+def inject_now():
+    return {'now': datetime.utcnow}
+
+@portal_bp.route('/')
+@login_required
+def home():
+    """Serves the home page dashboard."""
+    logger.info("User '%s' accessed the home page.", current_user.id)
+    # Prepare tools data with actual URLs generated by url_for
+    tools_with_urls = []
+    for tool in INTERNAL_TOOLS:
+        try:
+            # Copy the tool dict and add the generated URL
+            tool_data = tool.copy() 
+            if tool.get('url_endpoint') and tool['url_endpoint'] in current_app.view_functions:
+                 tool_data['url'] = url_for(tool['url_endpoint'])
+            else:
+                 tool_data['url'] = '#' # Default if endpoint is missing or invalid
+                 logger.warning("URL endpoint '%s' not found for tool '%s'.", tool.get('url_endpoint', 'N/A'), tool.get('name', 'N/A'))
+            tools_with_urls.append(tool_data)
+        except Exception as e:
+            logger.error("Could not generate URL for tool endpoint '%s': %s", tool.get('url_endpoint', 'N/A'), e)
+            tool_data = tool.copy()
+            tool_data['url'] = '#'
+            tools_with_urls.append(tool_data)
+
+    return render_template('home.html', tools=tools_with_urls)
+
+@portal_bp.route('/accesspoint', methods=['GET'])
+@login_required
+def accesspoint():
+    """Serves the access point page."""
+    logger.info("User '%s' accessed Access Point main page.", current_user.id)
+    return render_template('accesspoint.html')
+
+@portal_bp.route('/api/get-user-ips/<username>', methods=['GET'])
+@login_required
+def get_user_ips_api(username):
+    """API endpoint to fetch the list of IPs associated with a username.
+
+    Answers with 304 while the record store is unchanged (see portal/response_cache.py).
+    """
+    logger.info("API request by '%s' for IPs of user: %s", current_user.id, username)
+    try:
+        if not validate_username(username): # Validate username format first
+            logger.warning("Invalid username format requested: %s", username)
+            return jsonify({'error': 'Invalid username format.'}), 400
+
+        def build():
+            ips = get_all_servers_for_user(username)
+            if not ips:
+                logger.info("No servers found for username: %s", username)
+                payload, status = {'message': f'No active servers found for username "{username}".'}, 404
+            else:
+                logger.info("Found %s servers for user %s", len(ips), username)
+                logger.debug("Servers for user %s: %s", username, ips)
+                payload, status = {'ips': ips}, 200
+            return current_app.json.dumps(payload), status, 'application/json'
+
+        return cached_response(('get_user_ips', username), build)
+    except Exception as e:
+        logger.exception("Error fetching IPs for user %s: %s", username, str(e))
+        return jsonify({'error': 'Server error retrieving IP list.'}), 500
+
+@portal_bp.route('/api/keys/lookup', methods=['GET'])
+@login_required
+def key_lookup_api():
+    """API endpoint listing the users and hosts a public key is authorized on.
+
+    Takes either ?fingerprint=SHA256:... or ?pub_key=<key line>.
+    """
+    fingerprint = request.args.get('fingerprint', '').strip()
+    pub_key = request.args.get('pub_key', '').strip()
+    try:
+        if pub_key:
+            try:
+                fingerprint = parse_public_key(pub_key).fingerprint
+            except ValueError as e:
+                return jsonify({'error': f'Invalid public key: {e}'}), 400
+        elif not is_fingerprint(fingerprint):
+            return jsonify({'error': 'Provide a SHA256 fingerprint or a pub_key.'}), 400
+
+        logger.info("API request by '%s' for locations of key %s", current_user.id, fingerprint)
+        locations = lookup_fingerprint(fingerprint)
+        if not locations:
+            return jsonify({'fingerprint': fingerprint, 'message': 'Key is not recorded on any host.'}), 404
+        return jsonify({
+            'fingerprint': fingerprint,
+            'key_type': locations[0]['key_type'],
+            'bits': locations[0]['bits'],
+            'locations': [
+                {'username': location['username'], 'ip': location['ip'], 'granted_at': location['granted_at']}
+                for location in locations
+            ],
+        }), 200
+    except Exception as e:
+        logger.exception("Error looking up key %s: %s", fingerprint, str(e))
+        return jsonify({'error': 'Server error looking up key.'}), 500
+
+def expand_targets(group_string, manual_ip_string):
+    """
+    Expands comma separated groups and manual IPs into target hosts.
+
+    Returns:
+        A tuple: (groups, ips, invalid_ips). ips are de-duplicated; invalid_ips are the
+        manual entries that are not IP addresses.
+    """
+    ips = []
+    groups = []
+    invalid_ips = []
+
+    if group_string:
+        groups = [group.strip() for group in group_string.split(',') if group.strip()]
+        for group in groups:
+            group_ips = get_ips_from_group(group)
+            ips.extend(group_ips)
+
+    if manual_ip_string:
+        manual_ips = [ip.strip() for ip in manual_ip_string.split(',') if ip.strip()]
+        for ip in manual_ips:
+            if validate_ip(ip):
+                ips.append(ip)
+            else:
+                invalid_ips.append(ip)
+
+    return groups, list(set(ips)), invalid_ips
+
+def parse_give_access_payload(data):
+    """
+    Validates a give access JSON payload and expands its groups into IPs.
+
+    Returns:
+        A tuple: (params, error_message). params holds username, pub_key,
+        add_to_sudoers, the selected groups, the de-duplicated ips and expires_at
+        (a datetime, or None for permanent access); error_message is None if valid.
+    """
+    if not data or 'username' not in data or 'pub_key' not in data:  
+        return None, 'Invalid request payload. Missing username or public key'
+
+    username = data.get('username')
+    group_string = data.get('groups', '')
+    manual_ip_string = data.get('ips', '')
+    pub_key = data.get('pub_key')
+    add_to_sudoers = data.get('add_to_sudoers', False)  
+
+    if not validate_username(username):
+        return None, 'Invalid username. Use only letters, numbers, underscores, and hyphens'
+
+    if not validate_pub_key(pub_key):
+        return None, 'Invalid public key format'
+
+    expires_at = None
+    if data.get('expires_at'):
+        try:
+            expires_at = parse_expires_at(str(data['expires_at']))
+        except ValueError as e:
+            return None, f'Invalid expiry time: {e}'
+    
+    groups, ips, invalid_ips = expand_targets(group_string, manual_ip_string)
+    if invalid_ips:
+        return None, f'Invalid IP address: {invalid_ips[0]}'
+    if not ips:
+        return None, 'At least one IP is required'
+
+    return {'username': username, 'pub_key': pub_key, 'add_to_sudoers': add_to_sudoers, 'groups': groups, 'ips': ips,
+            'expires_at': expires_at}, None
+
+def parse_remove_access_payload(data):
+    """
+    Validates a remove access JSON payload.
+
+    Returns:
+        A tuple: (params, error_message). params holds username and ips;
+        error_message is None if valid.
+    """
+    if not data or 'username' not in data or 'ips' not in data:
+        return None, 'Invalid request payload. Missing username or ips list.'
+
+    username = data.get('username')
+    ips_to_remove = data.get('ips', [])
+
+    if not validate_username(username):
+        return None, 'Invalid username.'
+    if not isinstance(ips_to_remove, list):
+        return None, 'Invalid format for IPs - expected a list.'
+    if not ips_to_remove:
+        return None, 'No IP addresses were selected for removal.'
+    invalid_ips = [ip for ip in ips_to_remove if not validate_ip(ip)]
+    if invalid_ips:
+        return None, f'Invalid IP address format submitted: {", ".join(invalid_ips)}'
+
+    return {'username': username, 'ips': ips_to_remove}, None
+
+def summarize_host_results(host_results):
+    """Converts ip -> (success, message, attempts) into the JSON results shape and overall status."""
+    results = {
+        ip: {'success': success, 'message': message, 'attempts': attempts}
+        for ip, (success, message, attempts) in host_results.items()
+    }
+    all_success = all(result['success'] for result in results.values())
+    return results, all_success
+
+@portal_bp.route('/accesspoint/giveaccess', methods=['POST', 'GET'])
+@login_required
+def create_user():
+    """API endpoint to create a user on multiple servers."""   
+    try: 
+        if request.method == 'GET':
+            logger.info("User '%s' accessed the give access form.", current_user.id)
+            available_groups = get_group_list()
+            logger.info("Serving give access form.")
+            return render_template('giveaccess.html', available_groups=available_groups)
+        
+        # POST logic
+        logger.info("Received POST request on /accesspoint/giveaccess from user '%s'", current_user.id)
+        params, message = parse_give_access_payload(request.get_json())
+        if message:
+            logger.warning(message)
+            return jsonify({'error': message}), 400
+
+        username = params['username']
+        pub_key = params['pub_key']
+        add_to_sudoers = params['add_to_sudoers']
+        ips = params['ips']
+
+        from service.create_user import create_user_on_server
+        from service.fanout import run_on_hosts
+
+        results = {}
+        all_success = True
+        action_by_user = current_user.id if current_user.is_authenticated else 'anonymous'
+        with log_context(operation='giveaccess', user=username, operator=action_by_user):
+            host_results = run_on_hosts(
+                lambda ip: create_user_on_server(ip, username, pub_key, add_to_sudoers, action_by_user, raise_transient=True),
+                ips, action_by_user
+            )
+        for ip, (success, message, attempts) in host_results.items():
+            results[ip] = {'success': success, 'message': message, 'attempts': attempts}
+            if not success:
+                all_success = False
+                logger.error("Failed to create user %s on %s: %s", username, ip, message)
+            else:
+                logger.info("Successfully processed user %s on %s: %s", username, ip, message)
+
+        # Also clears an earlier expiry when access is granted again without one
+        granted_ips = [ip for ip, result in results.items() if result['success']]
+        set_access_expiry(username, granted_ips, params['expires_at'], action_by_user)
+
+        if params['groups'] and params['expires_at'] is None:
+            if all_success:
+                # Hosts added to these groups later are granted by the group sync
+                from service.group_sync import record_assignments
+                record_assignments(params['groups'], username, pub_key, add_to_sudoers, action_by_user)
+            else:
+                # The sync would take the failed hosts as granted; grant the groups again instead
+                logger.warning("Not recording group assignment of user '%s', the grant failed on some hosts.", username)
+
+        response_data = {
+                'message': 'Access request processed. See details below.',
+                'results': results, 
+                'all_success': all_success
+            }
+        status_code = 200 if all_success else 207 
+
+        return jsonify(response_data), status_code
+
+    except Exception as e:
+        logger.exception("An error occurred during give access POST by %s: %s", (current_user.id if current_user.is_authenticated else 'anonymous'), str(e))
+        return jsonify({'error': str(e)}), 500
+
+@portal_bp.route('/accesspoint/removeaccess', methods=['POST', 'GET'])
+@login_required
+def remove_user():
+    """API endpoint to remove a user from multiple servers."""
+    try:
+        if request.method == 'GET':
+            logger.info("User '%s' accessed the remove access form.", current_user.id)
+            return render_template('removeaccess.html')
+    
+        if request.method == 'POST':
+            logger.info("Received POST request on /accesspoint/removeaccess from user '%s'", current_user.id)
+            params, message = parse_remove_access_payload(request.get_json())
+            if message:
+                logger.warning(message)
+                return jsonify({'error': message}), 400
+
+            username = params['username']
+            ips_to_remove = params['ips']
+
+            logger.info("Processing removal request for user : '%s'.", username)
+
+            from service.remove_user import remove_user_from_server
+            from service.fanout import run_on_hosts
+
+            results = {}
+            all_success = True
+            action_by_user = current_user.id if current_user.is_authenticated else 'anonymous'
+
+            with log_context(operation='removeaccess', user=username, operator=action_by_user):
+                host_results = run_on_hosts(
+                    lambda ip: remove_user_from_server(ip, username, action_by_user, raise_transient=True),
+                    ips_to_remove, action_by_user
+                )
+            for ip, (success, message, attempts) in host_results.items():
+                results[ip] = {'success': success, 'message': message, 'attempts': attempts}
+                if not success:
+                    all_success = False
+                    logger.error("Failed to remove user %s from %s by %s: %s", username, ip, action_by_user, message)
+                else:
+                    logger.info("Successfully processed removal for user %s from %s by %s: %s", username, ip, action_by_user, message)
+                    # NOTE: The remove_user_from_server function itself should handle updating the CSV log
+
+            # Otherwise the next group sync would grant the removed user again
+            from service.group_sync import remove_assignments_for_hosts
+            unassigned_groups = remove_assignments_for_hosts(
+                username, [ip for ip, result in results.items() if result['success']], action_by_user
+            )
+
+            response_data = {
+                'message': 'User removal process completed. See details below.',
+                'results': results,
+                'all_success': all_success,
+                'unassigned_groups': unassigned_groups
+            }
+            status_code = 200 if all_success else 207 # 207 Multi-Status
+
+            return jsonify(response_data), status_code
+        else:
+            message = 'Invalid request method. Only POST is allowed.'
+            logger.warning(message)
+            return jsonify({'error': message}), 405
+    except Exception as e:
+        logger.exception("An error occurred during user removal POST by %s: %s", (current_user.id if current_user.is_authenticated else 'anonymous'), str(e))
+        return jsonify({'error': f'An unexpected server error occurred: {str(e)}'}), 500
+    
+@portal_bp.route('/accesspoint/giveaccess/warmup', methods=['POST'])
+@login_required
+def warm_up_give_access_api():
+    """
+    API endpoint called by the give access form as soon as targets are selected.
+
+    Starts opening SSH connections to the selected hosts in the background, so the
+    grant finds them ready (see service/warm_pool.py). Invalid manual IPs are ignored,
+    the form may still be in progress.
+    """
+    data = request.get_json(silent=True) or {}
+    _, ips, _ = expand_targets(data.get('groups', ''), data.get('ips', ''))
+    if not ips:
+        return jsonify({'started': 0, 'already_warm': 0, 'skipped': 0}), 200
+
+    from service.warm_pool import get_warm_pool
+    try:
+        counts = get_warm_pool().warm_up(sorted(ips), current_user.id)
+    except Exception as e:
+        logger.exception("Error warming up connections for %s: %s", current_user.id, str(e))
+        return jsonify({'error': 'Server error warming up connections.'}), 500
+    return jsonify(counts), 202
+
+@portal_bp.route('/accesspoint/giveaccess/plan', methods=['POST'])
+@login_required
+def plan_give_access_api():
+    """API endpoint to preview a give access request. Runs only read-only probes and stores the plan."""
+    try:
+        logger.info("Received POST request on /accesspoint/giveaccess/plan from user '%s'", current_user.id)
+        params, message = parse_give_access_payload(request.get_json())
+        if message:
+            logger.warning(message)
+            return jsonify({'error': message}), 400
+
+        from service.plan_service import plan_give_access, summarize_plan
+        with log_context(operation='plan_giveaccess', user=params['username'], operator=current_user.id):
+            plan_id, plan = plan_give_access(params['ips'], params['username'], params['pub_key'], params['add_to_sudoers'],
+                                             current_user.id, params['groups'], params['expires_at'])
+        return jsonify(summarize_plan(plan_id, plan)), 200
+    except Exception as e:
+        logger.exception("An error occurred while planning give access by %s: %s", current_user.id, str(e))
+        return jsonify({'error': str(e)}), 500
+
+@portal_bp.route('/accesspoint/removeaccess/plan', methods=['POST'])
+@login_required
+def plan_remove_access_api():
+    """API endpoint to preview a remove access request. Runs only read-only probes and stores the plan."""
+    try:
+        logger.info("Received POST request on /accesspoint/removeaccess/plan from user '%s'", current_user.id)
+        params, message = parse_remove_access_payload(request.get_json())
+        if message:
+            logger.warning(message)
+            return jsonify({'error': message}), 400
+
+        from service.plan_service import plan_remove_access, summarize_plan
+        with log_context(operation='plan_removeaccess', user=params['username'], operator=current_user.id):
+            plan_id, plan = plan_remove_access(params['ips'], params['username'], current_user.id)
+        return jsonify(summarize_plan(plan_id, plan)), 200
+    except Exception as e:
+        logger.exception("An error occurred while planning removal by %s: %s", current_user.id, str(e))
+        return jsonify({'error': str(e)}), 500
+
+@portal_bp.route('/accesspoint/plans/<plan_id>', methods=['GET'])
+@login_required
+def get_plan_api(plan_id):
+    """API endpoint to fetch a stored plan while it is still fresh."""
+    from service.plan_service import get_plan, summarize_plan
+    plan = get_plan(plan_id)
+    if plan is None:
+        return jsonify({'error': f"Plan '{plan_id}' not found or expired."}), 404
+    return jsonify(summarize_plan(plan_id, plan)), 200
+
+@portal_bp.route('/accesspoint/plans/<plan_id>/apply', methods=['POST'])
+@login_required
+def apply_plan_api(plan_id):
+    """API endpoint to apply a stored plan. Only the mutating commands are run."""
+    from service.plan_service import PlanError, apply_plan
+    try:
+        logger.info("User '%s' applying plan %s", current_user.id, plan_id)
+        try:
+            with log_context(operation='apply_plan', operator=current_user.id):
+                host_results = apply_plan(plan_id, current_user.id)
+        except PlanError as e:
+            logger.warning(str(e))
+            return jsonify({'error': str(e)}), e.status_code
+
+        results, all_success = summarize_host_results(host_results)
+        for ip, result in results.items():
+            if not result['success']:
+                logger.error("Failed to apply plan %s on %s: %s", plan_id, ip, result['message'])
+
+        response_data = {
+            'message': 'Plan applied. See details below.',
+            'results': results,
+            'all_success': all_success
+        }
+        return jsonify(response_data), 200 if all_success else 207
+    except Exception as e:
+        logger.exception("An error occurred while applying plan %s by %s: %s", plan_id, current_user.id, str(e))
+        return jsonify({'error': str(e)}), 500
+
+def parse_rotate_key_payload(data):
+    """
+    Validates a key rotation JSON payload.
+
+    Returns:
+        A tuple: (params, error_message). params holds username, new_pub_key and
+        old_pub_key or old_fingerprint; error_message is None if valid.
+    """
+    if not data or 'username' not in data or 'new_pub_key' not in data:
+        return None, 'Invalid request payload. Missing username or new public key.'
+
+    username = data.get('username')
+    new_pub_key = data.get('new_pub_key')
+    old_pub_key = (data.get('old_pub_key') or '').strip() or None
+    old_fingerprint = (data.get('old_fingerprint') or '').strip() or None
+
+    if not validate_username(username):
+        return None, 'Invalid username. Use only letters, numbers, underscores, and hyphens'
+    if not validate_pub_key(new_pub_key):
+        return None, 'Invalid new public key format'
+    if old_pub_key:
+        if not validate_pub_key(old_pub_key):
+            return None, 'Invalid old public key format'
+        old_fingerprint = None
+    elif not is_fingerprint(old_fingerprint):
+        return None, 'Provide the old key as old_pub_key or as a SHA256 old_fingerprint.'
+
+    return {'username': username, 'new_pub_key': new_pub_key,
+            'old_pub_key': old_pub_key, 'old_fingerprint': old_fingerprint}, None
+
+def _rotation_response(rotation_id, host_results):
+    results, all_success = summarize_host_results(host_results)
+    response_data = {
+        'rotation_id': rotation_id,
+        'message': 'Key rotation processed. See details below.',
+        'results': results,
+        'all_success': all_success,
+    }
+    return jsonify(response_data), 200 if all_success else 207
+
+@portal_bp.route('/accesspoint/rotatekey', methods=['POST'])
+@login_required
+def rotate_key_api():
+    """API endpoint to replace one of a user's keys on all hosts the user is recorded on."""
+    from service.rotate_key import RotationError, start_rotation
+    try:
+        logger.info("Received POST request on /accesspoint/rotatekey from user '%s'", current_user.id)
+        params, message = parse_rotate_key_payload(request.get_json())
+        if message:
+            logger.warning(message)
+            return jsonify({'error': message}), 400
+
+        try:
+            with log_context(operation='rotatekey', user=params['username'], operator=current_user.id):
+                rotation_id, host_results = start_rotation(
+                    params['username'], params['new_pub_key'], current_user.id,
+                    params['old_pub_key'], params['old_fingerprint']
+                )
+        except RotationError as e:
+            logger.warning(str(e))
+            return jsonify({'error': str(e)}), e.status_code
+        return _rotation_response(rotation_id, host_results)
+    except Exception as e:
+        logger.exception("An error occurred while rotating a key by %s: %s", current_user.id, str(e))
+        return jsonify({'error': str(e)}), 500
+
+@portal_bp.route('/accesspoint/rotations/<rotation_id>', methods=['GET'])
+@login_required
+def get_rotation_api(rotation_id):
+    """API endpoint to fetch the per host state of a key rotation."""
+    from service.rotate_key import get_rotation, summarize_rotation
+    rotation = get_rotation(rotation_id)
+    if rotation is None:
+        return jsonify({'error': f"Rotation '{rotation_id}' not found or expired."}), 404
+    return jsonify(summarize_rotation(rotation_id, rotation)), 200
+
+@portal_bp.route('/accesspoint/rotations/<rotation_id>/resume', methods=['POST'])
+@login_required
+def resume_rotation_api(rotation_id):
+    """API endpoint to retry a key rotation on the hosts that failed."""
+    from service.rotate_key import RotationError, resume_rotation
+    try:
+        logger.info("User '%s' resuming rotation %s", current_user.id, rotation_id)
+        try:
+            with log_context(operation='resume_rotation', operator=current_user.id):
+                host_results = resume_rotation(rotation_id, current_user.id)
+        except RotationError as e:
+            logger.warning(str(e))
+            return jsonify({'error': str(e)}), e.status_code
+        return _rotation_response(rotation_id, host_results)
+    except Exception as e:
+        logger.exception("An error occurred while resuming rotation %s by %s: %s", rotation_id, current_user.id, str(e))
+        return jsonify({'error': str(e)}), 500
+
+def parse_record_filters(args):
+    """
+    Validates the record filters of the logs page and the export.
+
+    Returns:
+        A tuple: (filters, error_message). filters holds the given ones of username,
+        ip, action_by, start and end (naive local datetimes); error_message is None if valid.
+    """
+    filters = {}
+    for arg in ('start', 'end'):
+        value = args.get(arg)
+        if not value:
+            continue
+        try:
+            timestamp = datetime.fromisoformat(value)
+        except ValueError:
+            return None, f'Invalid {arg} timestamp: {value}. Use ISO 8601 format.'
+        # Records are stored in naive local time, so values with an offset are converted to it
+        if timestamp.tzinfo is not None:
+            timestamp = timestamp.astimezone().replace(tzinfo=None)
+        filters[arg] = timestamp
+
+    for arg in ('username', 'ip', 'action_by'):
+        if args.get(arg):
+            filters[arg] = args.get(arg)
+    if 'username' in filters and not validate_username(filters['username']):
+        return None, 'Invalid username format.'
+    if 'ip' in filters and not validate_ip(filters['ip']):
+        return None, f"Invalid IP address: {filters['ip']}"
+    return filters, None
+
+@portal_bp.route('/accesspoint/logs')
+@login_required
+def logs_page():
+    """Serves the page displaying the current access records from the in-memory record snapshot.
+
+    Accepts the same username, ip, action_by, start and end filters as the export.
+    """
+    logger.info("User '%s' accessed the Current Access Report page.", current_user.id)
+    filters, message = parse_record_filters(request.args)
+    if message:
+        logger.warning(message)
+        return jsonify({'error': message}), 400
+
+    def build():
+        snapshot = get_snapshot()
+        error_message = snapshot.error
+        logs_json = snapshot.query(**filters).to_json() if not error_message else '[]'
+        return render_template('logs.html', logs_json=logs_json, error_message=error_message), 200, 'text/html'
+
+    # The page shows the operator's name and the year, so both are part of the key
+    key = ('logs_page', current_user.id, datetime.utcnow().year, tuple(sorted(filters.items())))
+    return cached_response(key, build)
+
+@portal_bp.route('/api/ssh-scheduler/stats', methods=['GET'])
+@login_required
+def ssh_scheduler_stats_api():
+    """API endpoint exposing SSH admission control load, queue depth and wait times, and warm connection counts."""
+    from service.warm_pool import get_warm_pool
+    return jsonify(dict(get_scheduler().stats(), warm_pool=get_warm_pool().stats())), 200
+
+@portal_bp.route('/api/profiling', methods=['GET', 'POST'])
+@login_required
+def profiling_settings_api():
+    """API endpoint to read or set which fraction of requests is profiled, and how. Profile admins only.
+
+    POST body: {"sample_rate": 0.05, "mode": "cprofile" | "sample"}; sample_rate 0 turns sampling off.
+    """
+    if not is_profile_admin(current_user.id):
+        logger.warning("User '%s' is not allowed to manage request profiling.", current_user.id)
+        return jsonify({'error': 'Not allowed.'}), 403
+    if request.method == 'GET':
+        return jsonify(get_settings()), 200
+
+    data = request.get_json(silent=True) or {}
+    settings = get_settings()
+    try:
+        settings = update_settings(data.get('sample_rate', settings['sample_rate']), data.get('mode', settings['mode']), current_user.id)
+    except (TypeError, ValueError) as e:
+        logger.warning("Invalid profiling settings from '%s': %s", current_user.id, e)
+        return jsonify({'error': str(e)}), 400
+    return jsonify(settings), 200
+
+@portal_bp.route('/api/profiles/<profile_id>', methods=['GET'])
+@login_required
+def get_profile_api(profile_id):
+    """API endpoint to download a stored request profile (pstats or speedscope JSON). Profile admins only."""
+    if not is_profile_admin(current_user.id):
+        logger.warning("User '%s' is not allowed to download profile %s.", current_user.id, profile_id)
+        return jsonify({'error': 'Not allowed.'}), 403
+    path, mode = find_profile(profile_id)
+    if path is None:
+        return jsonify({'error': f"Profile '{profile_id}' not found."}), 404
+    return send_file(os.path.abspath(path), as_attachment=True, download_name=os.path.basename(path),
+                     mimetype='application/json' if mode == 'sample' else 'application/octet-stream')
+
+@portal_bp.route('/accesspoint/logs/export')
+@login_required
+def export_logs():
+    """Streams the access records as CSV or NDJSON, optionally gzip-compressed.
+
+    Query parameters: format (csv|ndjson), gzip (1/true), start and end (ISO 8601),
+    username, ip and action_by.
+    """
+    export_format = request.args.get('format', 'csv').lower()
+    compress = request.args.get('gzip', '').lower() in ('1', 'true', 'yes')
+    if export_format not in EXPORT_FORMATS:
+        message = f'Unsupported export format: {export_format}'
+        logger.warning(message)
+        return jsonify({'error': message}), 400
+
+    filters, message = parse_record_filters(request.args)
+    if message:
+        logger.warning(message)
+        return jsonify({'error': message}), 400
+
+    logger.info("User '%s' exported access records as %s (gzip=%s).", current_user.id, export_format, compress)
+    records = iter_log_records(**filters)
+    extension = EXPORT_FORMATS[export_format]['extension']
+    if compress:
+        mimetype = 'application/gzip'
+        filename = f"user_records.{extension}.gz"
+    else:
+        mimetype = EXPORT_FORMATS[export_format]['mimetype']
+        filename = f"user_records.{extension}"
+
+    return Response(
+        stream_with_context(generate_export(records, export_format, compress)),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+    )
+
+@portal_bp.app_errorhandler(401) # Unauthorized
+def unauthorized_access(error):
+    logger.warning("Unauthorized access attempt to %s", request.path)
+    flash("You need to be logged in to access this page.", "warning")
+    return redirect(url_for('auth.login', next=request.url))
+
+@portal_bp.app_errorhandler(404) # Not Found
+def page_not_found(error):
+    logger.warning("404 Not Found error for URL: %s", request.path)
+    return render_template('errors/404.html'), 404 # Create a simple 404 template
+
+@portal_bp.app_errorhandler(500) # Internal Server Error
+def internal_server_error(error):
+    logger.error("500 Internal Server Error: %s", error, exc_info=True)
+    return render_template('errors/500.html'), 500 # Create a simple 500 template
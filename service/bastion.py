@@ -0,0 +1,169 @@
+"""
+Jump host (bastion) support.
+
+Groups whose hosts are only reachable through a bastion are listed in BASTIONS_FILE,
+one "<group> <bastion>[:port]" per line. Every host of such a group is then reached
+through a direct-tcpip channel of a single authenticated transport to the bastion.
+
+The transport is shared by all connections of the process (across hosts and
+requests), kept alive with keepalives and re-established when it drops. At most
+BASTION_MAX_CHANNELS channels are open per bastion at a time; further connections
+wait up to BASTION_CHANNEL_WAIT_SECONDS for a free one.
+"""
+import logging
+import threading
+import paramiko
+from utils.env import EnvSettings
+from utils.group_ip_provider import get_ips_from_group, group_files_stat
+
+logger = logging.getLogger(__name__)
+
+env = EnvSettings(
+    BASTIONS_FILE=('assets/bastions.txt', str),
+    BASTION_MAX_CHANNELS=(64, int),
+    BASTION_CHANNEL_WAIT_SECONDS=(30, float),
+    BASTION_KEEPALIVE_SECONDS=(30, int),
+)
+GROUPS_DIR = "assets/groups"
+CHANNEL_OPEN_TIMEOUT = 10
+
+class BastionError(paramiko.SSHException):
+    """A target could not be reached through its bastion (retried like other SSH errors)."""
+
+def parse_bastion(value):
+    """Parses "host[:port]" into (host, port)."""
+    host, _, port = value.strip().partition(':')
+    return host, int(port) if port else 22
+
+def _read_bastions_file():
+    """Returns {group: (host, port)} from BASTIONS_FILE."""
+    bastions = {}
+    try:
+        with open(env.BASTIONS_FILE, 'r') as f:
+            for line_number, line in enumerate(f, 1):
+                line = line.split('#', 1)[0].strip()
+                if not line:
+                    continue
+                parts = line.split()
+                try:
+                    if len(parts) != 2:
+                        raise ValueError("expected '<group> <bastion>[:port]'")
+                    bastions[parts[0]] = parse_bastion(parts[1])
+                except ValueError as e:
+                    logger.error("Ignoring line %s of %s: %s", line_number, env.BASTIONS_FILE, e)
+    except FileNotFoundError:
+        pass
+    return bastions
+
+_routes_lock = threading.Lock()
+_routes = {'stat': None, 'by_ip': {}}
+
+def get_bastion_for(ip):
+    """
+    Returns the (host, port) of the bastion to reach ip through, or None to connect directly.
+
+    A host listed in several groups with different bastions uses the first group in
+    alphabetical order.
+    """
+    stat = group_files_stat([env.BASTIONS_FILE], GROUPS_DIR)
+    with _routes_lock:
+        if _routes['stat'] != stat:
+            by_ip = {}
+            for group, bastion in sorted(_read_bastions_file().items()):
+                for group_ip in get_ips_from_group(group, GROUPS_DIR):
+                    if by_ip.setdefault(group_ip, bastion) != bastion:
+                        logger.warning("%s is in several groups with different bastions, using %s", group_ip, by_ip[group_ip][0])
+            _routes.update(stat=stat, by_ip=by_ip)
+        return _routes['by_ip'].get(ip)
+
+class BastionTunnel:
+    """One shared, self-healing transport to a bastion with a cap on concurrent channels."""
+
+    def __init__(self, host, port=22, max_channels=None):
+        self.host = host
+        self.port = port
+        self._client = None
+        self._lock = threading.Lock()
+        self.max_channels = env.BASTION_MAX_CHANNELS if max_channels is None else max_channels
+        self._slots = threading.BoundedSemaphore(self.max_channels)
+        self.connects = 0
+
+    def _transport(self):
+        """Returns the live transport, connecting (again) if needed. Caller holds _lock."""
+        transport = self._client.get_transport() if self._client else None
+        if transport is not None and transport.is_active():
+            return transport
+        if self._client is not None:
+            logger.warning("Transport to bastion %s is down, reconnecting", self.host)
+            self._client.close()
+            self._client = None
+
+        # Imported here, ssh_service imports this module
+        from service.ssh_service import SSHClient
+        client = SSHClient(self.host, port=self.port, use_bastion=False)
+        success, message = client.connect()
+        if not success:
+            client.close()
+            if client.last_error is not None:
+                raise client.last_error
+            raise BastionError(f"Unable to connect to bastion {self.host}: {message}")
+        transport = client.get_transport()
+        transport.set_keepalive(env.BASTION_KEEPALIVE_SECONDS)
+        self._client = client
+        self.connects += 1
+        logger.info("Connected to bastion %s:%s", self.host, self.port)
+        return transport
+
+    def open_channel(self, ip, port=22, timeout=CHANNEL_OPEN_TIMEOUT):
+        """
+        Opens a direct-tcpip channel to ip:port through the bastion.
+
+        Takes one of the bastion's channel slots; release it with release() once the
+        channel is closed.
+
+        Raises:
+            BastionError: If no slot frees up in time.
+        """
+        if not self._slots.acquire(timeout=env.BASTION_CHANNEL_WAIT_SECONDS):
+            raise BastionError(f"All {self.max_channels} channels through bastion {self.host} are busy")
+        try:
+            with self._lock:
+                transport = self._transport()
+            try:
+                return transport.open_channel('direct-tcpip', (ip, port), ('127.0.0.1', 0), timeout=timeout)
+            except (paramiko.SSHException, EOFError, OSError):
+                if transport.is_active():
+                    raise  # the bastion is fine, the target refused or timed out
+                with self._lock:
+                    transport = self._transport()
+                return transport.open_channel('direct-tcpip', (ip, port), ('127.0.0.1', 0), timeout=timeout)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def release(self):
+        self._slots.release()
+
+    def close(self):
+        with self._lock:
+            if self._client is not None:
+                self._client.close()
+                self._client = None
+
+_tunnels_lock = threading.Lock()
+_tunnels = {}
+
+def get_tunnel(host, port=22):
+    """Returns the process-wide tunnel to the bastion at host:port."""
+    with _tunnels_lock:
+        tunnel = _tunnels.get((host, port))
+        if tunnel is None:
+            tunnel = _tunnels[(host, port)] = BastionTunnel(host, port)
+        return tunnel
+
+def close_tunnels():
+    """Closes all bastion transports (e.g. on worker shutdown)."""
+    with _tunnels_lock:
+        tunnels = list(_tunnels.values())
+    for tunnel in tunnels:
+        tunnel.close()
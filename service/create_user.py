@@ -1,12 +1,171 @@
-import paramiko 
+import shlex
+import paramiko
 import logging
 from service.crypt_service import decrypt_file
 from service.csv_service import write_to_csv
-from service.ssh_service import SSHClient
+from service.warm_pool import checkout_client
+from service.host_state_cache import current_generation, get_cached_state, record_probe, record_grant, invalidate
+from service.retry import check_transient, TransientSSHError
+from service.key_index import record_key
+from utils.ssh_keys import parse_public_key
 
-logger = logging.getLogger(__name__)  
+logger = logging.getLogger(__name__)
 
-def create_user_on_server(ip, username, pub_key, add_to_sudoers=False, action_by_user="System"):
+# Human readable descriptions of the changes plan_user_changes() can produce
+ACTION_DESCRIPTIONS = {
+    'create_user': "create user",
+    'create_ssh_dir': "create .ssh directory",
+    'create_authorized_keys': "create authorized_keys file",
+    'add_key': "add public key",
+    'add_sudo': "add to sudo group",
+    'remove_sudo': "remove from sudo group",
+}
+
+def probe_user_state(client, username, pub_key):
+    """Runs the read-only checks needed to decide what has to change for a user on a host.
+
+    Args:
+        client: A connected SSHClient.
+        username: The username to inspect.
+        pub_key: The public key that should be authorized, or None.
+
+    Returns:
+        dict: user_exists, groups, ssh_dir_exists, auth_keys_exists and key_present.
+    """
+    stdin, stdout, stderr = client.exec_command(f"id -un {username} 2>/dev/null && groups {username}")
+    exit_status = stdout.channel.recv_exit_status()
+    user_exists = (exit_status == 0)
+    groups = ""
+    if user_exists:
+        output = stdout.read().decode('utf-8').strip()
+        parts = output.split(":")
+        if len(parts) > 1:
+            groups = parts[1].strip()
+
+    state = {
+        'user_exists': user_exists,
+        'groups': groups,
+        'ssh_dir_exists': None,
+        'auth_keys_exists': None,
+        'key_present': None,
+    }
+    if pub_key:
+        stdin, stdout, stderr = client.exec_command(f"test -d /home/{username}/.ssh")
+        state['ssh_dir_exists'] = stdout.channel.recv_exit_status() == 0
+
+        stdin, stdout, stderr = client.exec_command(f"test -f /home/{username}/.ssh/authorized_keys")
+        state['auth_keys_exists'] = stdout.channel.recv_exit_status() == 0
+
+        # Match on "type base64" only, so the same key with another comment counts as present
+        try:
+            key_match = parse_public_key(pub_key).normalized
+        except ValueError:
+            key_match = pub_key
+        stdin, stdout, stderr = client.exec_command(f"sudo grep -Fwq '{key_match}' /home/{username}/.ssh/authorized_keys || echo 'NOT_FOUND'")
+        state['key_present'] = stdout.read().decode().strip() != 'NOT_FOUND'
+    return state
+
+def plan_user_changes(state, username, pub_key, add_to_sudoers=False):
+    """Turns a probed user state into the mutating commands needed on the host.
+
+    Args:
+        state: The dict returned by probe_user_state().
+        username: The username to create/configure.
+        pub_key: The public key to authorize, or None.
+        add_to_sudoers: Whether the user should be in the sudo group.
+
+    Returns:
+        A tuple: (commands, actions), the shell commands to run in order and the
+        ACTION_DESCRIPTIONS keys they implement.
+
+    Every command is idempotent (it checks the host again before changing it), so a
+    retry of apply_user_plan() after a partly applied attempt does not fail on an
+    existing user or append the key twice.
+    """
+    commands = []
+    actions = []
+    if not state['user_exists']:
+        commands.extend([
+            f"id -u {username} >/dev/null 2>&1 || sudo useradd -m -s /bin/bash {username}",
+            f"sudo mkdir -p /home/{username}/.ssh",
+            f"sudo chown -R {username}:{username} /home/{username}/.ssh",
+            f"sudo chmod 700 /home/{username}/.ssh",
+        ])
+        actions.append('create_user')
+
+    # SSH Key configuration commands
+    if pub_key:
+        if not state['ssh_dir_exists']:
+            commands.extend([
+                f"sudo mkdir -p /home/{username}/.ssh",
+                f"sudo chown {username}:{username} /home/{username}/.ssh",
+                f"sudo chmod 700 /home/{username}/.ssh",
+            ])
+            actions.append('create_ssh_dir')
+
+        if not state['auth_keys_exists']:
+            commands.append(f"sudo touch /home/{username}/.ssh/authorized_keys")
+            commands.append(f"sudo chown {username}:{username} /home/{username}/.ssh/authorized_keys")
+            commands.append(f"sudo chmod 600 /home/{username}/.ssh/authorized_keys")
+            actions.append('create_authorized_keys')
+
+        if not state['key_present']:
+            # Same "type base64" match as probe_user_state(), so the key is only appended once
+            try:
+                key_match = parse_public_key(pub_key).normalized
+            except ValueError:
+                key_match = pub_key
+            # Every value is shell-quoted, the key comment is free text
+            script = f"""
+f={shlex.quote(f'/home/{username}/.ssh/authorized_keys')}
+key={shlex.quote(key_match)}
+line={shlex.quote(pub_key.strip())}
+grep -Fwq "$key" "$f" || printf '%s\\n' "$line" >> "$f"
+"""
+            commands.append(f"sudo sh -c {shlex.quote(script)}")
+            commands.append(f"sudo chown {username}:{username} /home/{username}/.ssh/authorized_keys")
+            commands.append(f"sudo chmod 600 /home/{username}/.ssh/authorized_keys")
+            actions.append('add_key')
+
+    # Sudoers configuration commands
+    groups = state['groups']
+    if add_to_sudoers:
+        if f"sudo" not in groups:
+            commands.append(f"sudo usermod -aG sudo {username}")
+            actions.append('add_sudo')
+    elif f"sudo" in groups:  # Remove from sudo if not requested but currently in group
+        commands.append(f"if id -nG {username} | grep -qw sudo; then sudo deluser {username} sudo; fi")
+        actions.append('remove_sudo')
+
+    return commands, actions
+
+def run_commands(client, ip, commands, username, action_by_user="System"):
+    """Runs commands in order on a connected client, stopping at the first failure.
+
+    Returns:
+        A tuple: (success, message). message is None on success.
+    """
+    for command in commands:
+        logger.debug("Executing command on %s (User: %s, ActionBy: %s): %s", ip, username, action_by_user, command)
+        stdin, stdout, stderr = client.exec_command(command)
+        exit_status = stdout.channel.recv_exit_status()
+        if exit_status != 0:
+            error_message = stderr.read().decode('utf-8').strip()
+            message = f"Error executing command '{command}' on {ip}: {error_message}"
+            logger.error(message)
+            return False, message # Stop on first error
+    return True, None
+
+def _log_actions(ip, username, actions, action_by_user):
+    for action in actions:
+        logger.info("Planned to %s for user '%s' on %s (Action by: %s)", ACTION_DESCRIPTIONS[action], username, ip, action_by_user)
+
+def _success_message(ip, username, user_existed):
+    if user_existed:
+        return f"User '{username}' configured successfully on {ip}."
+    return f"User '{username}' created and configured successfully on {ip}."
+
+def create_user_on_server(ip, username, pub_key, add_to_sudoers=False, action_by_user="System", raise_transient=False):
     """Creates a user on a remote server via SSH.
 
     Attempts password-based authentication first, then falls back to PEM key authentication.
@@ -15,110 +174,153 @@ def create_user_on_server(ip, username, pub_key, add_to_sudoers=False, action_by
         ip: The IP address of the server.
         username: The username to create.
         pub_key: The public key to authorize for the user.
+        raise_transient: Raise TransientSSHError instead of returning a failure when
+            the error is worth retrying (see service/retry.py).
 
     Returns:
         A tuple: (success, message), where success is a boolean indicating
         success or failure, and message is a string containing output or error.
     """
-    client = SSHClient(ip)
-    try: 
-        logger.debug(f"Attempting to create/configure user '{username}' on {ip}, requested by '{action_by_user}'")
+    # Read first: an invalidate() from any process after this point keeps our results out of the cache
+    generation = current_generation()
+    state = get_cached_state(ip, username, pub_key)
+    if state is not None and not plan_user_changes(state, username, pub_key, add_to_sudoers)[0]:
+        # Configured moments ago, nothing to change on the host, only record the grant
+        logger.info("User '%s' already configured on %s (cached state), skipping SSH (Action by: %s)", username, ip, action_by_user)
+        write_to_csv(username, ip, action_by_user)
+        record_key(pub_key, username, ip)
+        return True, _success_message(ip, username, True)
+
+    client = checkout_client(ip)
+    try:
+        logger.debug("Attempting to create/configure user '%s' on %s, requested by '%s'", username, ip, action_by_user)
         success, message = client.connect()
         if not success:
+            check_transient(client.last_error, message, raise_transient)
             return success, message
 
-        stdin, stdout, stderr = client.exec_command(f"id -un {username} 2>/dev/null && groups {username}")
-        exit_status = stdout.channel.recv_exit_status()
-        user_exists = (exit_status == 0)
-        groups = ""
-        if user_exists:
-            output = stdout.read().decode('utf-8').strip()
-            parts = output.split(":")
-            if len(parts) > 1:
-                groups = parts[1].strip()
-            logger.info(f"User '{username}' already exists on {ip} (Action by: {action_by_user})")
-
-        commands = []
-        if not user_exists:
-            commands.extend([
-                f"sudo useradd -m -s /bin/bash {username}",
-                f"sudo mkdir -p /home/{username}/.ssh",
-                f"sudo chown -R {username}:{username} /home/{username}/.ssh",
-                f"sudo chmod 700 /home/{username}/.ssh",
-            ])
-            logger.info(f"Creating user '{username}' on {ip} (Action by: {action_by_user})")
-        else:
-            logger.info(f"User '{username}' already exists on {ip}, proceeding with configuration (Action by: {action_by_user})")
+        if state is None:
+            state = probe_user_state(client, username, pub_key)
+            record_probe(ip, username, pub_key, state, generation)
+        if state['user_exists']:
+            logger.info("User '%s' already exists on %s, proceeding with configuration (Action by: %s)", username, ip, action_by_user)
 
-        # SSH Key configuration commands
-        if pub_key:
-            # Check/create .ssh dir
-            stdin, stdout, stderr = client.exec_command(f"test -d /home/{username}/.ssh")
-            ssh_dir_exists = stdout.channel.recv_exit_status() == 0
-            
-            if not ssh_dir_exists:
-                commands.extend([
-                    f"sudo mkdir -p /home/{username}/.ssh", 
-                    f"sudo chown {username}:{username} /home/{username}/.ssh",
-                    f"sudo chmod 700 /home/{username}/.ssh",
-                ])
-                logger.info(f"Creating .ssh directory for user '{username}' on {ip} (Action by: {action_by_user})")
-            
-            # Check/create authorized_keys file
-            stdin, stdout, stderr = client.exec_command(f"test -f /home/{username}/.ssh/authorized_keys")
-            auth_keys_exists = stdout.channel.recv_exit_status() == 0
-            
-            if not auth_keys_exists:
-                commands.append(f"sudo touch /home/{username}/.ssh/authorized_keys")
-                commands.append(f"sudo chown {username}:{username} /home/{username}/.ssh/authorized_keys")
-                commands.append(f"sudo chmod 600 /home/{username}/.ssh/authorized_keys")
-                logger.info(f"Creating authorized_keys file for user '{username}' on {ip} (Action by: {action_by_user})")
-            
-            # Check/add public key
-            stdin, stdout, stderr = client.exec_command(f"sudo grep -Fwq '{pub_key}' /home/{username}/.ssh/authorized_keys || echo 'NOT_FOUND'")
-            output = stdout.read().decode().strip()
-            if output == 'NOT_FOUND':
-                # Add the key safely using printf to avoid issues with special characters
-                commands.append(f"sudo sh -c 'printf \"%s\\n\" \"{pub_key}\" >> /home/{username}/.ssh/authorized_keys'")
-                commands.append(f"sudo chown {username}:{username} /home/{username}/.ssh/authorized_keys")
-                commands.append(f"sudo chmod 600 /home/{username}/.ssh/authorized_keys")
-                logger.info(f"Adding public key for user '{username}' on {ip} (Action by: {action_by_user})")
-            else:
-                logger.info(f"Public key for user '{username}' on '{ip}' already exists (Action by: {action_by_user})")
-
-        # Sudoers configuration commands
-        if add_to_sudoers:
-            if f"sudo" not in groups:
-                commands.append(f"sudo usermod -aG sudo {username}")
-                logger.info(f"Adding user '{username}' to the sudo group on {ip} (Action by: {action_by_user})")
-            else:
-                logger.info(f"User '{username}' is already in the sudo group on {ip} (Action by: {action_by_user})")
-        elif f"sudo" in groups:  # Remove from sudo if not requested but currently in group
-            commands.append(f"sudo deluser {username} sudo")
-            logger.info(f"Removing user '{username}' from the sudo group on {ip} (Action by: {action_by_user})")
-
-        for command in commands:
-            logger.debug(f"Executing command on {ip} (User: {username}, ActionBy: {action_by_user}): {command}")
-            stdin, stdout, stderr = client.exec_command(command)
-            exit_status = stdout.channel.recv_exit_status()
-            if exit_status != 0:
-                error_message = stderr.read().decode('utf-8').strip()
-                message = f"Error executing command '{command}' on {ip}: {error_message}"
-                logger.error(message)
-                return False, message # Stop on first error
-
-        if user_exists:
-            message = f"User '{username}' configured successfully on {ip}."
-        else:
-            message = f"User '{username}' created and configured successfully on {ip}."
-        write_to_csv(username, ip, action_by_user) 
+        commands, actions = plan_user_changes(state, username, pub_key, add_to_sudoers)
+        _log_actions(ip, username, actions, action_by_user)
+
+        success, message = run_commands(client, ip, commands, username, action_by_user)
+        if not success:
+            invalidate(ip, username)
+            return False, message
+
+        record_grant(ip, username, pub_key, add_to_sudoers, state, generation)
+        message = _success_message(ip, username, state['user_exists'])
+        write_to_csv(username, ip, action_by_user)
+        record_key(pub_key, username, ip)
         return True, message
 
+    except TransientSSHError:
+        raise
+    except paramiko.SSHException as e:
+        invalidate(ip, username)
+        logger.exception("SSH connection error for %s (User: %s, ActionBy: %s): %s", ip, username, action_by_user, e)
+        message = f"SSH error connecting to {ip}: {e}"
+        check_transient(e, message, raise_transient)
+        return False, message
+    except Exception as e:
+        invalidate(ip, username)
+        logger.exception("General error configuring user %s on %s (ActionBy: %s): %s", username, ip, action_by_user, e)
+        message = f"General error configuring user on {ip}: {e}"
+        check_transient(e, message, raise_transient)
+        return False, message
+    finally:
+        client.close()
+
+def plan_user_on_server(ip, username, pub_key, add_to_sudoers=False, action_by_user="System", raise_transient=False):
+    """Probes a server and returns the changes a grant would make, without making them.
+
+    Returns:
+        A tuple: (success, result). On success result is a dict with user_exists,
+        actions and commands; on failure it is the error message.
+    """
+    client = checkout_client(ip)
+    try:
+        success, message = client.connect()
+        if not success:
+            check_transient(client.last_error, message, raise_transient)
+            return success, message
+
+        generation = current_generation()
+        state = probe_user_state(client, username, pub_key)
+        record_probe(ip, username, pub_key, state, generation)
+        commands, actions = plan_user_changes(state, username, pub_key, add_to_sudoers)
+        _log_actions(ip, username, actions, action_by_user)
+        return True, {'user_exists': state['user_exists'], 'actions': actions, 'commands': commands, 'state': state}
+    except TransientSSHError:
+        raise
+    except paramiko.SSHException as e:
+        logger.exception("SSH connection error while planning for %s (User: %s, ActionBy: %s): %s", ip, username, action_by_user, e)
+        message = f"SSH error connecting to {ip}: {e}"
+        check_transient(e, message, raise_transient)
+        return False, message
+    except Exception as e:
+        logger.exception("General error planning user %s on %s (ActionBy: %s): %s", username, ip, action_by_user, e)
+        message = f"General error planning user on {ip}: {e}"
+        check_transient(e, message, raise_transient)
+        return False, message
+    finally:
+        client.close()
+
+def apply_user_plan(ip, username, commands, user_existed, action_by_user="System",
+                    pub_key=None, add_to_sudoers=False, state=None, raise_transient=False):
+    """Runs the mutating commands of a previously planned grant, skipping all probes.
+
+    Args:
+        pub_key, add_to_sudoers, state: The grant and the probed state it was planned
+            from. When state is given, the host state cache is updated on success.
+
+    Returns:
+        A tuple: (success, message), as for create_user_on_server().
+    """
+    if not commands:
+        # Nothing to change on the host, only record the grant
+        write_to_csv(username, ip, action_by_user)
+        if pub_key:
+            record_key(pub_key, username, ip)
+        return True, f"User '{username}' already configured on {ip}, nothing to apply."
+
+    generation = current_generation()
+    client = checkout_client(ip)
+    try:
+        success, message = client.connect()
+        if not success:
+            check_transient(client.last_error, message, raise_transient)
+            return success, message
+
+        success, message = run_commands(client, ip, commands, username, action_by_user)
+        if not success:
+            invalidate(ip, username)
+            return False, message
+
+        if state is not None:
+            record_grant(ip, username, pub_key, add_to_sudoers, state, generation)
+        write_to_csv(username, ip, action_by_user)
+        if pub_key:
+            record_key(pub_key, username, ip)
+        return True, _success_message(ip, username, user_existed)
+    except TransientSSHError:
+        raise
     except paramiko.SSHException as e:
-        logger.exception(f"SSH connection error for {ip} (User: {username}, ActionBy: {action_by_user}): {e}")
-        return False, f"SSH error connecting to {ip}: {e}"
+        invalidate(ip, username)
+        logger.exception("SSH connection error for %s (User: %s, ActionBy: %s): %s", ip, username, action_by_user, e)
+        message = f"SSH error connecting to {ip}: {e}"
+        check_transient(e, message, raise_transient)
+        return False, message
     except Exception as e:
-        logger.exception(f"General error configuring user {username} on {ip} (ActionBy: {action_by_user}): {e}")
-        return False, f"General error configuring user on {ip}: {e}"
+        invalidate(ip, username)
+        logger.exception("General error applying plan for user %s on %s (ActionBy: %s): %s", username, ip, action_by_user, e)
+        message = f"General error configuring user on {ip}: {e}"
+        check_transient(e, message, raise_transient)
+        return False, message
     finally:
-        client.close()
\ No newline at end of file
+        client.close()
@@ -6,8 +6,6 @@ from cryptography.hazmat.primitives.ciphers import algorithms, modes, Cipher
 from cryptography.hazmat.primitives.padding import PKCS7
 import secrets
 import logging
-from dotenv import load_dotenv
-load_dotenv()
 
 logger = logging.getLogger(__name__)
 
@@ -59,7 +57,7 @@ def encrypt_file(input_file_path: str, output_file_path: str, password: str) ->
         with open(output_file_path, "wb") as f:
             f.write(salt + iv + ciphertext)
     except Exception as e:
-        logger.error(f"Error encrypting file: {e}")
+        logger.error("Error encrypting file: %s", e)
         raise
 
 def decrypt_file(input_file_path: str, password: str) -> bytes:
@@ -97,14 +95,16 @@ def decrypt_file(input_file_path: str, password: str) -> bytes:
 
         return plaintext
     except ValueError as e:
-        logger.error(f"Error with wrong password: {e}")
+        logger.error("Error with wrong password: %s", e)
         raise
     except Exception as e:
-        logger.error(f"Error decrypting file: {e}")
+        logger.error("Error decrypting file: %s", e)
         raise
 
 
 if __name__ == "__main__":
+    from utils.env import load_env
+    load_env()
     PEM_FILE_PATH = "/home/aditya/.ssh/DEV.pem"
     ENCRYP_FILE_PATH = "encrypted_dev.enc"
     CRYPT_PASSWORD = os.getenv("CRYPT_PASSWORD", "banzo")
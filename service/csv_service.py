@@ -1,80 +1,213 @@
 import csv
+import io
 import os
 from datetime import datetime
 import logging
+from service.record_index import ensure_index, find_start_offset, rebuild_index, update_index_after_append
+from utils.file_lock import file_lock
 
 logger = logging.getLogger(__name__)
 DATA_FILE = "logs/user_records.csv"
+# Every mutation of DATA_FILE (and its index) happens under this lock, so several
+# worker processes can share the record store safely.
+LOCK_FILE = f"{DATA_FILE}.lock"
 FIELDNAMES = ['Timestamp', 'IP Address', 'Username', 'Action By']
+# Expiry times of time-bound grants, kept next to DATA_FILE and changed under the
+# same lock (see service/expiry_scheduler.py)
+EXPIRY_FILE = "logs/access_expiry.csv"
+EXPIRY_FIELDNAMES = ['Expires At', 'IP Address', 'Username', 'Action By']
 
-if not os.path.exists("logs"):
-    os.makedirs("logs")
-    logger.info("Created logs directory.")
+def _init_data_file():
+    """Creates DATA_FILE with headers if missing and validates the header otherwise."""
+    if not os.path.exists(DATA_FILE):
+        try:
+            with open(DATA_FILE, 'w', newline='') as csvfile:
+                writer = csv.DictWriter(csvfile, fieldnames=FIELDNAMES)
+                writer.writeheader()
+            logger.info("Created %s with headers: %s", DATA_FILE, FIELDNAMES)
+        except IOError as e:
+             logger.error("Failed to create %s: %s", DATA_FILE, e)
+    else:
+        try:
+            with open(DATA_FILE, 'r', newline='') as csvfile:
+                reader = csv.reader(csvfile)
+                try:
+                    header = next(reader)
+                    if header != FIELDNAMES:
+                        logger.warning("CSV file %s header mismatch. Expected %s, found %s. Manual correction might be needed.", DATA_FILE, FIELDNAMES, header)
+                        # Consider adding migration logic here in a real app
+                except StopIteration: # File is empty
+                    with open(DATA_FILE, 'w', newline='') as outfile: # Overwrite/create header
+                        writer = csv.DictWriter(outfile, fieldnames=FIELDNAMES)
+                        writer.writeheader()
+                        logger.info("CSV file %s was empty. Wrote headers: %s", DATA_FILE, FIELDNAMES)
+        except IOError as e:
+            logger.error("Error checking/reading header for %s: %s", DATA_FILE, e)
+        except Exception as e: # Catch broader exceptions during header check
+            logger.error("Unexpected error during header check for %s: %s", DATA_FILE, e, exc_info=True)
+
+def init_record_store():
+    """
+    Prepares the record store: creates the logs directory and DATA_FILE, validates the
+    header and builds the record index if needed. Called once at startup (create_app()).
+    """
+    if not os.path.exists("logs"):
+        os.makedirs("logs", exist_ok=True)
+        logger.info("Created logs directory.")
+    with file_lock(LOCK_FILE):
+        _init_data_file()
+        try:
+            ensure_index(DATA_FILE)
+        except Exception as e:
+            logger.error("Failed to build record index for %s: %s", DATA_FILE, e, exc_info=True)
+
+def record_store_version():
+    """
+    Returns (version, last_modified) of DATA_FILE.
 
-if not os.path.exists(DATA_FILE):
+    version changes on every write from any process: appends grow the file and
+    removals replace it (new inode). last_modified is the mtime as a POSIX timestamp,
+    or None if the file does not exist.
+    """
     try:
-        with open(DATA_FILE, 'w', newline='') as csvfile:
-            writer = csv.DictWriter(csvfile, fieldnames=FIELDNAMES)
-            writer.writeheader()
-        logger.info(f"Created {DATA_FILE} with headers: {FIELDNAMES}")
-    except IOError as e:
-         logger.error(f"Failed to create {DATA_FILE}: {e}")
-else:
+        stat = os.stat(DATA_FILE)
+    except FileNotFoundError:
+        return 'missing', None
+    return f"{stat.st_ino:x}-{stat.st_mtime_ns:x}-{stat.st_size:x}", stat.st_mtime
+
+def _generation_file():
+    return f"{DATA_FILE}.generation"
+
+def data_file_generation():
+    """
+    Returns the number of times DATA_FILE was rewritten (removals), 0 if never.
+
+    Readers holding parsed state (record_snapshot) compare it to tell a replaced file
+    from one that was appended to; inode numbers are reused, so they cannot.
+    """
     try:
-        with open(DATA_FILE, 'r', newline='') as csvfile:
-            reader = csv.reader(csvfile)
-            try:
-                header = next(reader)
-                if header != FIELDNAMES:
-                    logger.warning(f"CSV file {DATA_FILE} header mismatch. Expected {FIELDNAMES}, found {header}. Manual correction might be needed.")
-                    # Consider adding migration logic here in a real app
-            except StopIteration: # File is empty
-                with open(DATA_FILE, 'w', newline='') as outfile: # Overwrite/create header
-                    writer = csv.DictWriter(outfile, fieldnames=FIELDNAMES)
-                    writer.writeheader()
-                    logger.info(f"CSV file {DATA_FILE} was empty. Wrote headers: {FIELDNAMES}")
-    except IOError as e:
-        logger.error(f"Error checking/reading header for {DATA_FILE}: {e}")
-    except Exception as e: # Catch broader exceptions during header check
-        logger.error(f"Unexpected error during header check for {DATA_FILE}: {e}", exc_info=True)
+        with open(_generation_file(), 'r') as f:
+            return int(f.read().strip() or 0)
+    except (FileNotFoundError, ValueError):
+        return 0
+
+def _bump_data_file_generation():
+    """Increments the generation after DATA_FILE was replaced. Caller holds LOCK_FILE."""
+    path = _generation_file()
+    temp_file = f"{path}.temp"
+    with open(temp_file, 'w') as f:
+        f.write(str(data_file_generation() + 1))
+    os.replace(temp_file, path)
 
 def write_to_csv(username, ip, action_by):
     """Writes a user record to the CSV file."""
     try:
-        file_exists = os.path.exists(DATA_FILE)
-        with open(DATA_FILE, mode='a', newline='') as csvfile:
-            writer = csv.DictWriter(csvfile, fieldnames=FIELDNAMES)
-            if not file_exists:
-                writer.writeheader()
-            writer.writerow({
-                'Timestamp': datetime.now().isoformat(), 
-                'IP Address': ip, 
-                'Username': username, 
-                'Action By': action_by
-            })
-        logger.debug(f"Record for user {username} written to {DATA_FILE}")
+        with file_lock(LOCK_FILE):
+            file_exists = os.path.exists(DATA_FILE)
+            with open(DATA_FILE, mode='a', newline='') as csvfile:
+                writer = csv.DictWriter(csvfile, fieldnames=FIELDNAMES)
+                if not file_exists:
+                    writer.writeheader()
+                offset = csvfile.tell()
+                # Taken under the lock so rows are appended in the order they were stamped
+                timestamp = datetime.now().isoformat()
+                writer.writerow({
+                    'Timestamp': timestamp, 
+                    'IP Address': ip, 
+                    'Username': username, 
+                    'Action By': action_by
+                })
+            update_index_after_append(DATA_FILE, offset, timestamp)
+        logger.debug("Record for user %s written to %s", username, DATA_FILE)
     except Exception as e:
-        logger.error(f"Error writing to CSV file {DATA_FILE}: {e}")
+        logger.error("Error writing to CSV file %s: %s", DATA_FILE, e)
 
-def get_all_servers_for_user(username):
-    """"Gets a UNIQUE list of all servers a user was created on from the CSV."""
-    logger.info(f"Fetching all servers for user {username}")
-    servers = set()
+def _read_expiries():
     try:
-        with open(DATA_FILE, 'r', newline='') as csvfile:
-            reader = csv.DictReader(csvfile)
-            if not reader.fieldnames or not all(hrd in reader.fieldnames for hrd in FIELDNAMES):
-                logger.error(f"CSV file {DATA_FILE} has incorrect headers. Expected {FIELDNAMES}, got {reader.fieldnames}")
-                return []
+        with open(EXPIRY_FILE, 'r', newline='') as csvfile:
+            return list(csv.DictReader(csvfile))
+    except FileNotFoundError:
+        return []
+
+def _replace_expiries(keep, added=()):
+    """Rewrites EXPIRY_FILE with the rows for which keep(row) is true plus added. Caller holds LOCK_FILE."""
+    existing = _read_expiries()
+    rows = [row for row in existing if keep(row)]
+    if len(rows) == len(existing) and not added:
+        return
+    rows.extend(added)
+    temp_file = f"{EXPIRY_FILE}.temp"
+    with open(temp_file, 'w', newline='') as csvfile:
+        writer = csv.DictWriter(csvfile, fieldnames=EXPIRY_FIELDNAMES)
+        writer.writeheader()
+        writer.writerows(rows)
+    os.replace(temp_file, EXPIRY_FILE)
+
+def set_access_expiry(username, ips, expires_at, action_by):
+    """
+    Sets when the access of a user to the given hosts ends.
+
+    A new grant replaces the user's earlier expiry on those hosts; expires_at=None makes
+    the access permanent again.
+
+    Args:
+        expires_at: Naive local datetime, or None.
+    """
+    ips = set(ips)
+    added = [
+        {'Expires At': expires_at.isoformat(), 'IP Address': ip, 'Username': username, 'Action By': action_by}
+        for ip in sorted(ips)
+    ] if expires_at is not None else []
+    try:
+        with file_lock(LOCK_FILE):
+            _replace_expiries(lambda row: not (row['Username'] == username and row['IP Address'] in ips), added)
+        if expires_at is not None:
+            logger.info("Access of user '%s' to %s hosts expires at %s (by '%s').", username, len(ips), expires_at.isoformat(), action_by)
+    except Exception as e:
+        logger.error("Error writing access expiries to %s: %s", EXPIRY_FILE, e)
 
-            for row in reader:
-                if row['Username'] == username and row['IP Address']:
-                    servers.add(row['IP Address'])
+def get_access_expiries():
+    """Returns the pending expiries as dicts with the EXPIRY_FIELDNAMES keys."""
+    return _read_expiries()
+
+def get_access_expiry(username, ip):
+    """
+    Returns when the access of a user to a host ends, as a naive local datetime, or
+    None if it does not expire. Read under LOCK_FILE, so grants that are still writing
+    their expiry are waited for.
+    """
+    with file_lock(LOCK_FILE):
+        rows = _read_expiries()
+    for row in rows:
+        if row['Username'] == username and row['IP Address'] == ip:
+            try:
+                return datetime.fromisoformat(row['Expires At'])
+            except (TypeError, ValueError):
+                return None
+    return None
+
+def expiry_store_version():
+    """Like record_store_version(), for EXPIRY_FILE (rewritten on every change)."""
+    try:
+        stat = os.stat(EXPIRY_FILE)
     except FileNotFoundError:
-        logger.warning(f"CSV file not found: {DATA_FILE}")
+        return 'missing'
+    return f"{stat.st_ino:x}-{stat.st_mtime_ns:x}-{stat.st_size:x}"
+
+def get_all_servers_for_user(username):
+    """"Gets a UNIQUE list of all servers a user was created on, from the in-memory record snapshot."""
+    # Imported here, record_snapshot reads DATA_FILE and FIELDNAMES from this module
+    from service.record_snapshot import get_snapshot
+    logger.info("Fetching all servers for user %s", username)
+    try:
+        snapshot = get_snapshot()
+        if snapshot.error:
+            logger.warning(snapshot.error)
+            return []
+        return snapshot.query(username=username).ips()
     except Exception as e:
-        logger.error(f"Error reading CSV file {DATA_FILE}: {e}")
-    return list(servers)
+        logger.error("Error reading CSV file %s: %s", DATA_FILE, e)
+        return []
 
 def remove_user_records_from_csv(username: str, ip: str = None, action_by: str = 'System'):
     """Removes user records from the CSV.
@@ -91,66 +224,73 @@ def remove_user_records_from_csv(username: str, ip: str = None, action_by: str =
     temp_file = f"{DATA_FILE}.temp"
     records_removed = False
     
-    try:
-        # Check if file exists
-        if not os.path.exists(DATA_FILE):
-            logger.warning(f"CSV file '{DATA_FILE}' is empty or missing.")
-            return
+    with file_lock(LOCK_FILE):
+        try:
+            # Check if file exists
+            if not os.path.exists(DATA_FILE):
+                logger.warning("CSV file '%s' is empty or missing.", DATA_FILE)
+                return
             
-        # Open original file for reading and temp file for writing
-        with open(DATA_FILE, 'r', newline='') as infile, open(temp_file, 'w', newline='') as outfile:
-            reader = csv.DictReader(infile)
+            # Open original file for reading and temp file for writing
+            with open(DATA_FILE, 'r', newline='') as infile, open(temp_file, 'w', newline='') as outfile:
+                reader = csv.DictReader(infile)
             
-            # Ensure we're using the correct fieldnames from the file
-            if not reader.fieldnames:
-                logger.error(f"CSV file '{DATA_FILE}' has no headers.")
-                return
+                # Ensure we're using the correct fieldnames from the file
+                if not reader.fieldnames:
+                    logger.error("CSV file '%s' has no headers.", DATA_FILE)
+                    return
                 
-            writer = csv.DictWriter(outfile, fieldnames=reader.fieldnames)
-            writer.writeheader()
+                writer = csv.DictWriter(outfile, fieldnames=reader.fieldnames)
+                writer.writeheader()
             
-            for row in reader:
-                should_keep = True
+                for row in reader:
+                    should_keep = True
                 
-                # Check if this is a row we should remove
-                if 'Username' in row and 'IP Address' in row:
-                    if ip is None:  # Remove all records for username
-                        if row['Username'] == username:
-                            should_keep = False
-                            records_removed = True
-                    else:  # Remove only matching username and IP
-                        if row['Username'] == username and row['IP Address'] == ip:
-                            should_keep = False
-                            records_removed = True
-                else:
-                    logger.warning(f"Malformed row in CSV missing required fields: {row}")
+                    # Check if this is a row we should remove
+                    if 'Username' in row and 'IP Address' in row:
+                        if ip is None:  # Remove all records for username
+                            if row['Username'] == username:
+                                should_keep = False
+                                records_removed = True
+                        else:  # Remove only matching username and IP
+                            if row['Username'] == username and row['IP Address'] == ip:
+                                should_keep = False
+                                records_removed = True
+                    else:
+                        logger.warning("Malformed row in CSV missing required fields: %s", row)
                     
-                if should_keep:
-                    writer.writerow(row)
+                    if should_keep:
+                        writer.writerow(row)
                     
-        # Replace original with temp file
-        os.replace(temp_file, DATA_FILE)
+            # Replace original with temp file
+            os.replace(temp_file, DATA_FILE)
+            _bump_data_file_generation()
+            # Byte offsets shifted, so the sparse timestamp index must be rebuilt
+            rebuild_index(DATA_FILE)
+            # Removed access has nothing left to expire
+            if os.path.exists(EXPIRY_FILE):
+                _replace_expiries(lambda row: not (row['Username'] == username and (ip is None or row['IP Address'] == ip)))
         
-        # Log results
-        if records_removed:
-            if ip is None:
-                logger.info(f"Removed all records for user '{username}' from {DATA_FILE}")
-            else:
-                logger.info(f"Removed record(s) for user '{username}' and IP '{ip}' from {DATA_FILE}")
-        else:
-            if ip is None:
-                logger.warning(f"No records found for user '{username}' in {DATA_FILE}")
+            # Log results
+            if records_removed:
+                if ip is None:
+                    logger.info("Removed all records for user '%s' from %s", username, DATA_FILE)
+                else:
+                    logger.info("Removed record(s) for user '%s' and IP '%s' from %s", username, ip, DATA_FILE)
             else:
-                logger.warning(f"No records found for user '{username}' and IP '{ip}' in {DATA_FILE}")
+                if ip is None:
+                    logger.warning("No records found for user '%s' in %s", username, DATA_FILE)
+                else:
+                    logger.warning("No records found for user '%s' and IP '%s' in %s", username, ip, DATA_FILE)
                 
-    except Exception as e:
-        logger.exception(f"An error occurred during CSV processing: {e}")
-        # Clean up temp file if it exists
-        if os.path.exists(temp_file):
-            try:
-                os.remove(temp_file)
-            except Exception:
-                pass
+        except Exception as e:
+            logger.exception("An error occurred during CSV processing: %s", e)
+            # Clean up temp file if it exists
+            if os.path.exists(temp_file):
+                try:
+                    os.remove(temp_file)
+                except Exception:
+                    pass
 
 def get_all_log_records():
     """
@@ -173,7 +313,7 @@ def get_all_log_records():
             # Check for empty file
             csvfile.seek(0, os.SEEK_END)
             if csvfile.tell() == 0:
-                logger.info(f"Log file is empty: {DATA_FILE}")
+                logger.info("Log file is empty: %s", DATA_FILE)
                 return log_data, error_message # Return empty list, no error message needed for empty file
             csvfile.seek(0)
 
@@ -185,7 +325,7 @@ def get_all_log_records():
                 logger.error(error_message)
             else:
                 log_data = list(reader)
-                logger.info(f"Successfully read {len(log_data)} records from {DATA_FILE}.")
+                logger.info("Successfully read %s records from %s.", len(log_data), DATA_FILE)
 
     except FileNotFoundError: # Should be caught above, but handle defensively
         error_message = f"Error: Log data file ({DATA_FILE}) not found."
@@ -193,11 +333,67 @@ def get_all_log_records():
         log_data = []
     except Exception as e:
         error_message = f"Error: Could not read or parse log data file. Details: {e}"
-        logger.exception(f"Error reading log file {DATA_FILE}: {e}")
+        logger.exception("Error reading log file %s: %s", DATA_FILE, e)
         log_data = [] # Ensure empty list on error
 
     return log_data, error_message
 
+def iter_log_records(start=None, end=None, username=None, ip=None, action_by=None):
+    """
+    Lazily yields records from the user_records.csv file matching the given filters.
+
+    Unlike get_all_log_records(), rows are never collected into a list, so memory
+    stays constant regardless of the file size. When `start` is given the sparse
+    timestamp index is used to seek close to the first matching row. Reading goes on
+    to the end of the file: timestamps are naive local time and go back an hour when
+    DST ends, so rows past `end` can be followed by rows inside the range.
+
+    Args:
+        start: Optional datetime, only records at or after this time are yielded.
+        end: Optional datetime, only records before this time are yielded.
+        username: Optional exact username to match.
+        ip: Optional exact IP address to match.
+        action_by: Optional exact 'Action By' value to match.
+
+    Yields:
+        dict: One record per matching row.
+    """
+    if not os.path.exists(DATA_FILE):
+        logger.warning("Log data file (%s) not found.", DATA_FILE)
+        return
+
+    with open(DATA_FILE, mode='rb') as rawfile:
+        fieldnames = next(csv.reader([rawfile.readline().decode('utf-8')]), None)
+        if not fieldnames or not all(hdr in fieldnames for hdr in FIELDNAMES):
+            logger.error("CSV file %s has incorrect headers. Expected %s, got %s", DATA_FILE, FIELDNAMES, fieldnames)
+            return
+
+        if start is not None:
+            offset = find_start_offset(DATA_FILE, start, rawfile)
+            if offset is not None:
+                rawfile.seek(offset)
+        csvfile = io.TextIOWrapper(rawfile, encoding='utf-8', newline='')
+        reader = csv.DictReader(csvfile, fieldnames=fieldnames)
+
+        for row in reader:
+            if username is not None and row['Username'] != username:
+                continue
+            if ip is not None and row['IP Address'] != ip:
+                continue
+            if action_by is not None and row['Action By'] != action_by:
+                continue
+            if start is not None or end is not None:
+                try:
+                    timestamp = datetime.fromisoformat(row['Timestamp'])
+                except (TypeError, ValueError):
+                    logger.warning("Skipping row with invalid timestamp: %s", row)
+                    continue
+                if start is not None and timestamp < start:
+                    continue
+                if end is not None and timestamp >= end:
+                    continue
+            yield row
+
 if __name__ == "__main__":
     # Example usage
     # write_to_csv("banzo", "127.0.0.13")
@@ -0,0 +1,181 @@
+"""
+Revokes time-bound grants when they expire.
+
+Grants made with an expires_at are stored in csv_service.EXPIRY_FILE. The scheduler
+keeps them in a min-heap ordered by expiry and sleeps until the earliest one is
+due, so pending expiries cost nothing in between; the file is only re-read when it
+changed (checked every EXPIRY_RESCAN_SECONDS, a single stat). Due expiries are
+grouped by host and each host gets one SSH connection removing all of its expired
+users. Right before each removal the user's expiry is read again under the record
+store lock, and users whose grant was extended or made permanent in the meantime are
+left alone. Users that could not be removed are retried after EXPIRY_RETRY_SECONDS.
+
+Run one scheduler next to the portal workers (a second one exits):
+    python -m service.expiry_scheduler
+"""
+import heapq
+import logging
+import threading
+import time
+from datetime import datetime
+from service import csv_service
+from utils.env import EnvSettings
+from utils.file_lock import file_lock
+
+logger = logging.getLogger(__name__)
+
+env = EnvSettings(
+    EXPIRY_RESCAN_SECONDS=(30, float),
+    EXPIRY_RETRY_SECONDS=(300, float),
+)
+SCHEDULER_LOCK_FILE = "logs/expiry_scheduler.lock"
+OPERATOR = 'access-expiry'
+
+def parse_expires_at(value):
+    """
+    Parses an ISO 8601 expiry time into a naive local datetime.
+
+    Values with an offset are converted to local time; values without one (e.g. from a
+    datetime-local input) are taken as local time.
+
+    Raises:
+        ValueError: If the value is not a datetime or not in the future.
+    """
+    expires_at = datetime.fromisoformat(value.strip())
+    if expires_at.tzinfo is not None:
+        expires_at = expires_at.astimezone().replace(tzinfo=None)
+    if expires_at <= datetime.now():
+        raise ValueError("expiry time is in the past")
+    return expires_at
+
+class ExpiryScheduler:
+    """Min-heap of (deadline, username, ip) built from the expiry file."""
+
+    def __init__(self):
+        self._heap = []
+        self._version = None
+        self._retry_at = {}   # (username, ip) -> deadline of the next attempt after a failure
+        self._stop = threading.Event()
+
+    def reload(self):
+        """Rebuilds the heap if the expiry file changed. Returns True if it did."""
+        version = csv_service.expiry_store_version()
+        if version == self._version:
+            return False
+        heap = []
+        pending = set()
+        for row in csv_service.get_access_expiries():
+            key = (row['Username'], row['IP Address'])
+            try:
+                deadline = datetime.fromisoformat(row['Expires At']).timestamp()
+            except (TypeError, ValueError):
+                logger.warning("Skipping expiry with invalid time: %s", row)
+                continue
+            deadline = max(deadline, self._retry_at.get(key, 0))
+            heap.append((deadline, key[0], key[1]))
+            pending.add(key)
+        heapq.heapify(heap)
+        self._heap = heap
+        self._retry_at = {key: at for key, at in self._retry_at.items() if key in pending}
+        self._version = version
+        logger.info("Loaded %s pending access expiries", len(heap))
+        return True
+
+    def next_deadline(self):
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now=None):
+        """Removes the due expiries from the heap. Returns {ip: [usernames]}."""
+        now = time.time() if now is None else now
+        due = {}
+        while self._heap and self._heap[0][0] <= now:
+            deadline, username, ip = heapq.heappop(self._heap)
+            due.setdefault(ip, []).append(username)
+        return due
+
+    def revoke(self, due):
+        """
+        Removes the due users, one connection per host.
+
+        Returns:
+            dict: ip -> (success, message, attempts).
+        """
+        from service.remove_user import remove_users_from_server
+        from service.fanout import run_on_hosts
+
+        outcomes = {}
+        extended = set()
+
+        def still_due(username, ip):
+            # pop_due() ran before the SSH connection; a grant may have moved the deadline since
+            expires_at = csv_service.get_access_expiry(username, ip)
+            if expires_at is None or expires_at.timestamp() > time.time():
+                logger.info("Expiry of '%s' on %s moved to %s, not revoking", username, ip, (expires_at.isoformat() if expires_at else 'never'))
+                extended.add((username, ip))
+                return False
+            return True
+
+        def task(ip):
+            success, result = remove_users_from_server(ip, due[ip], OPERATOR, raise_transient=True,
+                                                       confirm=lambda username: still_due(username, ip))
+            if not success:
+                return success, result
+            outcomes[ip] = result
+            failures = [f"{username}: {message}" for username, (ok, message) in result.items() if not ok]
+            if failures:
+                return False, '; '.join(failures)
+            removed = sum(1 for username in result if (username, ip) not in extended)
+            return True, f"Removed {removed} expired users from {ip}."
+
+        logger.info("Revoking %s expired grants on %s hosts", sum((len(users) for users in due.values())), len(due))
+        results = run_on_hosts(task, sorted(due), OPERATOR)
+
+        retry_at = time.time() + env.EXPIRY_RETRY_SECONDS
+        for ip, (success, message, attempts) in results.items():
+            for username in due[ip]:
+                user_result = outcomes.get(ip, {}).get(username)
+                if user_result is not None and user_result[0]:
+                    continue
+                # Still in the expiry file, try again later
+                logger.error("Failed to revoke expired access of '%s' on %s: %s", username, ip, (user_result[1] if user_result else message))
+                self._retry_at[(username, ip)] = retry_at
+                heapq.heappush(self._heap, (retry_at, username, ip))
+        return results
+
+    def run(self):
+        """Sleeps until the next expiry and revokes what is due, until stop() is called."""
+        while not self._stop.is_set():
+            # Re-checked before revoking, a grant may have been extended since the last wait
+            self.reload()
+            due = self.pop_due()
+            if due:
+                self.revoke(due)
+                continue
+            deadline = self.next_deadline()
+            timeout = env.EXPIRY_RESCAN_SECONDS
+            if deadline is not None:
+                timeout = min(timeout, max(deadline - time.time(), 0))
+            self._stop.wait(timeout)
+
+    def stop(self):
+        self._stop.set()
+
+def run_scheduler():
+    """Runs the expiry scheduler, unless another process already does."""
+    try:
+        with file_lock(SCHEDULER_LOCK_FILE, blocking=False):
+            logger.info("Access expiry scheduler started")
+            ExpiryScheduler().run()
+    except BlockingIOError:
+        logger.error("Another expiry scheduler holds %s, exiting.", SCHEDULER_LOCK_FILE)
+
+
+if __name__ == "__main__":
+    from utils.env import load_env
+    from utils.logging_config import configure_logging
+    load_env()
+    configure_logging()
+    try:
+        run_scheduler()
+    except KeyboardInterrupt:
+        logger.info("Access expiry scheduler stopped.")
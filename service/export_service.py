@@ -0,0 +1,67 @@
+import csv
+import io
+import json
+import zlib
+import logging
+from service.csv_service import FIELDNAMES
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FORMATS = {
+    'csv': {'mimetype': 'text/csv', 'extension': 'csv'},
+    'ndjson': {'mimetype': 'application/x-ndjson', 'extension': 'ndjson'},
+}
+CHUNK_SIZE = 64 * 1024  # flush to the client roughly every 64 KiB
+
+def _iter_text_chunks(records, export_format):
+    """Serializes records into text chunks of about CHUNK_SIZE characters."""
+    buffer = io.StringIO()
+    if export_format == 'csv':
+        writer = csv.DictWriter(buffer, fieldnames=FIELDNAMES, extrasaction='ignore')
+        writer.writeheader()
+        write_row = writer.writerow
+    else:
+        def write_row(row):
+            buffer.write(json.dumps({field: row.get(field) for field in FIELDNAMES}))
+            buffer.write('\n')
+
+    row_count = 0
+    for row in records:
+        write_row(row)
+        row_count += 1
+        if buffer.tell() >= CHUNK_SIZE:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+    if buffer.tell():
+        yield buffer.getvalue()
+    logger.info("Exported %s records as %s.", row_count, export_format)
+
+def generate_export(records, export_format='csv', compress=False):
+    """
+    Streams records as CSV or NDJSON bytes, optionally gzip-compressed.
+
+    Args:
+        records: An iterable of record dicts, typically csv_service.iter_log_records().
+        export_format: One of EXPORT_FORMATS ('csv' or 'ndjson').
+        compress: If True, the output is a gzip stream.
+
+    Yields:
+        bytes: Encoded output chunks, suitable for a streamed Flask Response.
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unsupported export format: {export_format}")
+
+    # wbits=31 makes zlib emit a gzip header/trailer instead of a raw zlib stream
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+    for chunk in _iter_text_chunks(records, export_format):
+        data = chunk.encode('utf-8')
+        if compressor:
+            data = compressor.compress(data)
+            if not data:
+                continue
+        yield data
+
+    if compressor:
+        yield compressor.flush()
@@ -0,0 +1,64 @@
+import logging
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from service.request_profiler import profile_worker
+from service.ssh_scheduler import get_scheduler
+from service.retry import run_with_retry, request_deadline
+from utils.env import EnvSettings
+from utils.logging_config import log_context
+
+logger = logging.getLogger(__name__)
+
+env = EnvSettings(
+    SSH_FANOUT_WORKERS=(16, int),
+)
+
+def run_on_hosts(task, ips, operator, max_attempts=None):
+    """
+    Runs task(ip) for every ip in parallel, each attempt holding an SSH scheduler slot.
+
+    Hosts whose task raises TransientSSHError are retried with jittered backoff
+    (see service/retry.py); the slot is released while waiting. All hosts share one
+    request deadline of SSH_REQUEST_BUDGET_SECONDS.
+
+    Args:
+        task: Callable taking an IP and returning a (success, message) tuple.
+        ips: The target IP addresses.
+        operator: The portal user the work is done for, used for fair queuing.
+        max_attempts: Maximum attempts per host, SSH_RETRY_ATTEMPTS by default.
+
+    Returns:
+        dict: ip -> (success, message, attempts), in the order of `ips`.
+    """
+    scheduler = get_scheduler()
+    deadline = request_deadline()
+
+    def attempt(ip, remaining):
+        if remaining <= 0:
+            return False, f"Request time budget exhausted before {ip} could be processed"
+        try:
+            with scheduler.slot(operator, ip, timeout=remaining):
+                return task(ip)
+        except TimeoutError as e:
+            return False, str(e)
+
+    def run(ip):
+        with profile_worker(), log_context(host=ip, operator=operator):
+            return run_with_retry(lambda remaining: attempt(ip, remaining), ip, deadline, max_attempts)
+
+    results = {}
+    if not ips:
+        return results
+
+    with ThreadPoolExecutor(max_workers=min(len(ips), env.SSH_FANOUT_WORKERS)) as executor:
+        # Each task runs in a copy of the caller's context, so request log fields and an
+        # active request profile carry over
+        futures = {executor.submit(contextvars.copy_context().run, run, ip): ip for ip in ips}
+        for future in as_completed(futures):
+            ip = futures[future]
+            try:
+                results[ip] = future.result()
+            except Exception as e:
+                logger.exception("Unexpected error running SSH task on %s for '%s': %s", ip, operator, e)
+                results[ip] = (False, f"Unexpected error on {ip}: {e}", 1)
+    return {ip: results[ip] for ip in ips}
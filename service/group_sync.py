@@ -0,0 +1,277 @@
+"""
+Group-level grants and incremental sync of group membership changes.
+
+A grant made for a group (not only for manually entered IPs) is recorded as an
+assignment: group, username, public key and sudo flag. The hosts of every group as
+of its last sync are kept in GROUP_SYNC_STATE_FILE. Syncing a group diffs that
+against the current group file and only touches the difference:
+
+- hosts added to the group get every assignee of the group granted,
+- hosts removed from the group get the assignees removed, if revoke is requested
+  and no other group assignment of the user still covers the host.
+
+Removing a user through the portal (directly or by applying a removal plan) drops
+their assignments to every group containing one of the hosts they were removed from.
+
+Hosts whose changes failed stay pending and are retried by the next sync. Run it
+after editing group files, e.g. from cron:
+    python -m service.group_sync                # all groups
+    python -m service.group_sync devops --revoke
+"""
+import os
+import csv
+import json
+import logging
+import argparse
+from datetime import datetime
+from utils.env import EnvSettings
+from utils.file_lock import file_lock
+from utils.get_group_list import get_group_list
+from utils.group_ip_provider import get_ips_from_group
+
+logger = logging.getLogger(__name__)
+
+env = EnvSettings(
+    GROUP_ASSIGNMENTS_FILE=('logs/group_assignments.csv', str),
+    GROUP_SYNC_STATE_FILE=('logs/group_sync_state.json', str),
+)
+FIELDNAMES = ['Group', 'Username', 'Public Key', 'Sudo', 'Assigned By', 'Timestamp']
+
+def _lock_path():
+    return f"{env.GROUP_ASSIGNMENTS_FILE}.lock"
+
+def _read_assignments():
+    try:
+        with open(env.GROUP_ASSIGNMENTS_FILE, 'r', newline='') as f:
+            return list(csv.DictReader(f))
+    except FileNotFoundError:
+        return []
+
+def _write_assignments(rows):
+    temp_path = f"{env.GROUP_ASSIGNMENTS_FILE}.{os.getpid()}.temp"
+    with open(temp_path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=FIELDNAMES)
+        writer.writeheader()
+        writer.writerows(rows)
+    os.replace(temp_path, env.GROUP_ASSIGNMENTS_FILE)
+
+def _read_state():
+    try:
+        with open(env.GROUP_SYNC_STATE_FILE, 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except ValueError as e:
+        logger.error("Ignoring unreadable group sync state %s: %s", env.GROUP_SYNC_STATE_FILE, e)
+        return {}
+
+def _write_state(state):
+    temp_path = f"{env.GROUP_SYNC_STATE_FILE}.{os.getpid()}.temp"
+    with open(temp_path, 'w') as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.replace(temp_path, env.GROUP_SYNC_STATE_FILE)
+
+def get_assignments(group=None, username=None):
+    """
+    Returns the recorded group assignments.
+
+    Returns:
+        list: dicts with group, username, pub_key, add_to_sudoers, assigned_by and assigned_at.
+    """
+    return [
+        {
+            'group': row['Group'],
+            'username': row['Username'],
+            'pub_key': row['Public Key'],
+            'add_to_sudoers': row['Sudo'] == 'True',
+            'assigned_by': row['Assigned By'],
+            'assigned_at': row['Timestamp'],
+        }
+        for row in _read_assignments()
+        if (group is None or row['Group'] == group) and (username is None or row['Username'] == username)
+    ]
+
+def record_assignments(groups, username, pub_key, add_to_sudoers, assigned_by):
+    """
+    Records that username was granted access to each of the groups.
+
+    A repeated grant replaces the user's earlier assignment to the group (new key or
+    sudo flag). A group seen for the first time has its current hosts stored as the
+    synced membership, since the grant that is being recorded just covered them, so
+    callers only record grants that succeeded on every host.
+    """
+    if not groups:
+        return
+    try:
+        with file_lock(_lock_path()):
+            rows = [row for row in _read_assignments()
+                    if not (row['Group'] in groups and row['Username'] == username)]
+            timestamp = datetime.now().isoformat()
+            for group in groups:
+                rows.append({'Group': group, 'Username': username, 'Public Key': pub_key.strip(),
+                             'Sudo': str(bool(add_to_sudoers)), 'Assigned By': assigned_by, 'Timestamp': timestamp})
+            _write_assignments(rows)
+
+            state = _read_state()
+            new_groups = [group for group in groups if group not in state]
+            for group in new_groups:
+                state[group] = sorted(set(get_ips_from_group(group)))
+            if new_groups:
+                _write_state(state)
+        logger.info("Recorded group assignment of user '%s' to %s (by '%s').", username, ', '.join(groups), assigned_by)
+    except OSError as e:
+        logger.error("Failed to record group assignments in %s: %s", env.GROUP_ASSIGNMENTS_FILE, e)
+
+def remove_assignment(group, username):
+    """Drops a user's assignment to a group. Returns True if there was one."""
+    with file_lock(_lock_path()):
+        rows = _read_assignments()
+        kept = [row for row in rows if not (row['Group'] == group and row['Username'] == username)]
+        if len(kept) == len(rows):
+            return False
+        _write_assignments(kept)
+    logger.info("Removed group assignment of user '%s' to %s.", username, group)
+    return True
+
+def remove_assignments_for_hosts(username, ips, removed_by):
+    """
+    Drops the user's assignments to every group containing one of the given hosts.
+
+    Called after the user was removed from those hosts through the portal, so the
+    next sync does not grant the removed user again on hosts added to the group.
+
+    Returns:
+        list: The groups the user was unassigned from.
+    """
+    ips = set(ips)
+    if not ips:
+        return []
+    try:
+        with file_lock(_lock_path()):
+            rows = _read_assignments()
+            groups = sorted({row['Group'] for row in rows if row['Username'] == username
+                             and ips & set(get_ips_from_group(row['Group']))})
+            if groups:
+                _write_assignments([row for row in rows if not (row['Username'] == username and row['Group'] in groups)])
+    except OSError as e:
+        logger.error("Failed to drop group assignments of user '%s' in %s: %s", username, env.GROUP_ASSIGNMENTS_FILE, e)
+        return []
+    if groups:
+        logger.info("Removed group assignments of user '%s' to %s after removal by '%s'.", username, ', '.join(groups), removed_by)
+    return groups
+
+def diff_membership(group, state):
+    """
+    Returns (added, removed, current) hosts of a group relative to its synced state.
+
+    A group without state has nothing to diff against; its current hosts are returned
+    as (set(), set(), current) and become the baseline.
+    """
+    current = set(get_ips_from_group(group))
+    if group not in state:
+        return set(), set(), current
+    previous = set(state[group])
+    return current - previous, previous - current, current
+
+def _hosts_covered_by_other_groups(username, group, assignments):
+    hosts = set()
+    for assignment in assignments:
+        if assignment['username'] == username and assignment['group'] != group:
+            hosts.update(get_ips_from_group(assignment['group']))
+    return hosts
+
+def sync_group(group, revoke=False, operator='group-sync'):
+    """
+    Pushes the membership changes of one group to its assignees.
+
+    Returns:
+        dict: added, removed and results (ip -> (success, message, attempts)).
+    """
+    from service.create_user import create_user_on_server
+    from service.remove_user import remove_user_from_server
+    from service.fanout import run_on_hosts
+
+    with file_lock(_lock_path()):
+        state = _read_state()
+        assignments = get_assignments()
+    added, removed, current = diff_membership(group, state)
+    assignees = [assignment for assignment in assignments if assignment['group'] == group]
+    summary = {'group': group, 'added': sorted(added), 'removed': sorted(removed) if revoke else [], 'results': {}}
+
+    if group not in state:
+        logger.info("No synced membership for group %s yet, recording %s hosts as baseline.", group, len(current))
+    if not revoke:
+        removed = set()
+
+    if assignees and (added or removed):
+        covered = {assignment['username']: _hosts_covered_by_other_groups(assignment['username'], group, assignments)
+                   for assignment in assignees}
+
+        def task(ip):
+            failures = []
+            changed = 0
+            for assignment in assignees:
+                username = assignment['username']
+                if ip in added:
+                    success, message = create_user_on_server(
+                        ip, username, assignment['pub_key'], assignment['add_to_sudoers'], operator, raise_transient=True
+                    )
+                elif ip in covered[username]:
+                    continue  # still granted through another group
+                else:
+                    success, message = remove_user_from_server(ip, username, operator, raise_transient=True)
+                if not success:
+                    failures.append(f"{username}: {message}")
+                changed += 1
+            if failures:
+                return False, '; '.join(failures)
+            action = 'Granted' if ip in added else 'Revoked'
+            return True, f"{action} {changed} assignees of {group} on {ip}."
+
+        logger.info("Syncing group %s: %s hosts added, %s removed, %s assignees (by '%s').", group, len(added), len(removed), len(assignees), operator)
+        summary['results'] = run_on_hosts(task, sorted(added | removed), operator)
+
+    # Failed hosts stay pending: an added host is left out of the state, a removed one kept in it
+    failed = {ip for ip, (success, message, attempts) in summary['results'].items() if not success}
+    synced = (current - (added & failed)) | (removed & failed)
+    with file_lock(_lock_path()):
+        state = _read_state()
+        state[group] = sorted(synced)
+        _write_state(state)
+    return summary
+
+def sync_groups(groups=None, revoke=False, operator='group-sync'):
+    """Syncs the given groups (default: every group with assignments). Returns a list of summaries."""
+    if groups is None:
+        assigned = {assignment['group'] for assignment in get_assignments()}
+        groups = sorted(group for group in get_group_list() if group in assigned)
+    return [sync_group(group, revoke, operator) for group in groups]
+
+
+if __name__ == "__main__":
+    from utils.env import load_env
+    from utils.logging_config import configure_logging
+    load_env()
+    configure_logging()
+    parser = argparse.ArgumentParser(description="Push group membership changes to the users assigned to the groups.")
+    parser.add_argument('groups', nargs='*', help="Groups to sync (default: all groups with assignments)")
+    parser.add_argument('--revoke', action='store_true', help="Remove assignees from hosts that left the group")
+    parser.add_argument('--list', action='store_true', help="List the group assignments instead of syncing")
+    parser.add_argument('--unassign', metavar='USERNAME', help="Drop USERNAME's assignment to the given groups")
+    args = parser.parse_args()
+
+    if args.list:
+        for group in args.groups or [None]:
+            for assignment in get_assignments(group):
+                print(f"{assignment['group']}\t{assignment['username']}\tsudo={assignment['add_to_sudoers']}\t"
+                      f"{assignment['assigned_by']}\t{assignment['assigned_at']}")
+    elif args.unassign:
+        if not args.groups:
+            parser.error("--unassign needs the groups to drop the user from.")
+        for group in args.groups:
+            print(f"{group}: {'removed' if remove_assignment(group, args.unassign) else 'not assigned'}")
+    else:
+        for summary in sync_groups(args.groups or None, args.revoke):
+            print(f"{summary['group']}: +{len(summary['added'])} -{len(summary['removed'])} hosts")
+            for ip, (success, message, attempts) in summary['results'].items():
+                print(f"  {ip}: {'ok' if success else 'failed'} {message}")
@@ -0,0 +1,162 @@
+"""
+Short-lived cache of remote account state per (host, username).
+
+Filled by probe_user_state() results and updated after successful grants, so a
+repeated grant (a retry, or a second group containing the same host) can be planned
+without probing again. Entries expire after HOST_STATE_TTL_SECONDS. Set the TTL to 0
+to disable the cache.
+
+The entries live in each process, but they are only valid for one shared generation
+of the host state. Every invalidate() (removals, rotations and failed grants, in any
+worker, the expiry scheduler or the group sync CLI) bumps the generation in
+HOST_STATE_GENERATION_FILE. That drops the cached entries of all processes, at the
+cost of one stat per lookup.
+"""
+import os
+import time
+import uuid
+import logging
+import threading
+from utils.env import EnvSettings
+from utils.ssh_keys import parse_public_key, fingerprint_of_blob
+
+logger = logging.getLogger(__name__)
+
+env = EnvSettings(
+    HOST_STATE_TTL_SECONDS=(60, float),
+    HOST_STATE_GENERATION_FILE=('logs/host_state.generation', str),
+)
+
+_cache = {}  # (ip, username) -> {'expires_at', 'user_exists', 'groups', 'ssh_dir_exists', 'auth_keys_exists', 'keys'}
+_lock = threading.Lock()
+
+def key_fingerprint(pub_key):
+    """Returns the OpenSSH SHA256 fingerprint of a public key line."""
+    try:
+        return parse_public_key(pub_key).fingerprint
+    except ValueError:
+        return fingerprint_of_blob(pub_key.strip().encode('utf-8'))
+
+def _generation():
+    """Returns the current shared generation: the identity of HOST_STATE_GENERATION_FILE."""
+    try:
+        stat = os.stat(env.HOST_STATE_GENERATION_FILE)
+    except FileNotFoundError:
+        return None
+    return (stat.st_ino, stat.st_mtime_ns)
+
+def _bump_generation():
+    """Replaces HOST_STATE_GENERATION_FILE, so every process sees a new generation."""
+    os.makedirs(os.path.dirname(env.HOST_STATE_GENERATION_FILE) or '.', exist_ok=True)
+    tmp_path = f"{env.HOST_STATE_GENERATION_FILE}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, 'w') as f:
+        f.write(uuid.uuid4().hex)
+    os.replace(tmp_path, env.HOST_STATE_GENERATION_FILE)
+
+def _fresh_entry(ip, username, generation):
+    entry = _cache.get((ip, username))
+    if entry is None:
+        return None
+    if time.monotonic() >= entry['expires_at'] or entry['generation'] != generation:
+        del _cache[(ip, username)]
+        return None
+    return entry
+
+def get_cached_state(ip, username, pub_key):
+    """
+    Returns a probe_user_state()-style dict from the cache, or None if the cache
+    cannot answer (no entry, expired, or the key's presence is unknown).
+    """
+    if env.HOST_STATE_TTL_SECONDS <= 0:
+        return None
+    generation = _generation()
+    with _lock:
+        entry = _fresh_entry(ip, username, generation)
+        if entry is None:
+            return None
+        state = {
+            'user_exists': entry['user_exists'],
+            'groups': entry['groups'],
+            'ssh_dir_exists': None,
+            'auth_keys_exists': None,
+            'key_present': None,
+        }
+        if pub_key:
+            key_present = entry['keys'].get(key_fingerprint(pub_key))
+            if key_present is None or entry['ssh_dir_exists'] is None:
+                return None
+            state['ssh_dir_exists'] = entry['ssh_dir_exists']
+            state['auth_keys_exists'] = entry['auth_keys_exists']
+            state['key_present'] = key_present
+    logger.debug("Using cached state for user '%s' on %s", username, ip)
+    return state
+
+def record_probe(ip, username, pub_key, state, generation):
+    """
+    Stores the result of probe_user_state().
+
+    Args:
+        generation: The current_generation() read before the host was probed. A
+            probe that raced an invalidate() is not stored.
+    """
+    if env.HOST_STATE_TTL_SECONDS <= 0:
+        return
+    with _lock:
+        if generation != _generation():
+            return
+        entry = _fresh_entry(ip, username, generation)
+        # A new user_exists answer makes the remembered key checks meaningless
+        if entry is None or entry['user_exists'] != state['user_exists']:
+            entry = {'ssh_dir_exists': None, 'auth_keys_exists': None, 'keys': {}}
+        entry.update(user_exists=state['user_exists'], groups=state['groups'], generation=generation,
+                     expires_at=time.monotonic() + env.HOST_STATE_TTL_SECONDS)
+        if pub_key:
+            entry['ssh_dir_exists'] = state['ssh_dir_exists']
+            entry['auth_keys_exists'] = state['auth_keys_exists']
+            entry['keys'][key_fingerprint(pub_key)] = state['key_present']
+        _cache[(ip, username)] = entry
+
+def record_grant(ip, username, pub_key, add_to_sudoers, state, generation):
+    """
+    Updates the cache after a grant's commands all succeeded on a host.
+
+    Args:
+        state: The state the grant was planned from.
+        generation: The current_generation() read before the grant's commands ran.
+    """
+    groups = state['groups'].split()
+    if add_to_sudoers and 'sudo' not in groups:
+        groups.append('sudo')
+    elif not add_to_sudoers and 'sudo' in groups:
+        groups.remove('sudo')
+
+    granted = {
+        'user_exists': True,
+        'groups': ' '.join(groups),
+        'ssh_dir_exists': True if pub_key else state['ssh_dir_exists'],
+        'auth_keys_exists': True if pub_key else state['auth_keys_exists'],
+        'key_present': True if pub_key else None,
+    }
+    record_probe(ip, username, pub_key, granted, generation)
+
+def current_generation():
+    """Returns the shared generation to pass to record_probe()/record_grant(), or None if the cache is off."""
+    if env.HOST_STATE_TTL_SECONDS <= 0:
+        return None
+    return _generation()
+
+def invalidate(ip, username):
+    """
+    Forgets the cached state of a user on a host, in this and every other process.
+
+    Call it before and after changing the account on the host, so that no process
+    keeps or stores a state probed in between.
+    """
+    with _lock:
+        _cache.pop((ip, username), None)
+    if env.HOST_STATE_TTL_SECONDS <= 0:
+        return
+    try:
+        _bump_generation()
+    except OSError as e:
+        logger.error("Could not bump %s, other processes may use stale host state: %s", env.HOST_STATE_GENERATION_FILE, e)
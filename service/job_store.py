@@ -0,0 +1,111 @@
+"""
+Small on-disk store for short-lived jobs (e.g. give/remove access plans).
+
+Jobs are JSON files under logs/jobs/<kind>/<job_id>.json, so any worker process can
+pick up a job created by another one.
+"""
+import os
+import re
+import json
+import time
+import uuid
+import logging
+
+logger = logging.getLogger(__name__)
+
+JOBS_DIR = "logs/jobs"
+_JOB_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+def _job_dir(kind):
+    path = os.path.join(JOBS_DIR, kind)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+def _job_path(kind, job_id):
+    if not _JOB_ID_PATTERN.match(job_id or ''):
+        return None
+    return os.path.join(_job_dir(kind), f"{job_id}.json")
+
+def _is_expired(job):
+    expires_at = job.get('expires_at')
+    return expires_at is not None and time.time() >= expires_at
+
+def _read(path):
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logger.error("Failed to read job file %s: %s", path, e)
+        return None
+
+def purge_expired_jobs(kind):
+    """Deletes expired jobs of the given kind."""
+    job_dir = _job_dir(kind)
+    for filename in os.listdir(job_dir):
+        path = os.path.join(job_dir, filename)
+        job = _read(path)
+        if job is not None and _is_expired(job):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+def save_job(kind, job, ttl=None, job_id=None):
+    """
+    Stores a job and returns its id.
+
+    Args:
+        kind: Job category, used as the sub-directory name.
+        job: JSON-serializable dict. created_at (and expires_at when ttl is given)
+            are added to it in place.
+        ttl: Optional lifetime in seconds, after which the job can no longer be loaded.
+        job_id: Existing id to overwrite, a new one is generated if omitted.
+
+    Returns:
+        str: The job id.
+    """
+    job_id = job_id or uuid.uuid4().hex
+    path = _job_path(kind, job_id)
+    job.setdefault('created_at', time.time())
+    if ttl is not None:
+        job['expires_at'] = job['created_at'] + ttl
+
+    temp_path = f"{path}.{os.getpid()}.temp"
+    with open(temp_path, 'w') as f:
+        json.dump(job, f)
+    os.replace(temp_path, path)
+    return job_id
+
+def load_job(kind, job_id):
+    """Returns the job, or None if it does not exist or has expired."""
+    path = _job_path(kind, job_id)
+    if path is None:
+        return None
+    job = _read(path)
+    if job is None or _is_expired(job):
+        return None
+    return job
+
+def claim_job(kind, job_id):
+    """
+    Loads and deletes a job in one step, so only one caller (in any process) gets it.
+
+    Returns:
+        dict or None: The job, or None if it does not exist, has expired or was
+        already claimed.
+    """
+    path = _job_path(kind, job_id)
+    if path is None:
+        return None
+    claimed_path = f"{path}.{os.getpid()}.claimed"
+    try:
+        os.rename(path, claimed_path)
+    except FileNotFoundError:
+        return None
+    job = _read(claimed_path)
+    os.remove(claimed_path)
+    if job is None or _is_expired(job):
+        return None
+    return job
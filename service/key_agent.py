@@ -0,0 +1,147 @@
+"""
+Local key agent holding the unlocked admin key for all portal workers.
+
+The agent decrypts PEM_FILE_PATH once at startup and answers the ssh-agent
+protocol (identities + sign requests) on a UNIX domain socket. Workers point
+KEY_AGENT_SOCKET at it and never need CRYPT_PASSWORD or the KDF themselves.
+
+Run it before starting the workers:
+    python -m service.key_agent
+"""
+import os
+import socket
+import socketserver
+import logging
+import paramiko
+from paramiko.agent import AgentSSH
+
+from service.ssh_service import load_private_key
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SOCKET_PATH = "logs/key_agent.sock"
+
+# ssh-agent protocol message numbers (draft-miller-ssh-agent)
+SSH_AGENT_FAILURE = 5
+SSH2_AGENTC_REQUEST_IDENTITIES = 11
+SSH2_AGENT_IDENTITIES_ANSWER = 12
+SSH2_AGENTC_SIGN_REQUEST = 13
+SSH2_AGENT_SIGN_RESPONSE = 14
+
+SSH_AGENT_RSA_SHA2_256 = 2
+SSH_AGENT_RSA_SHA2_512 = 4
+
+class KeyAgentClient(AgentSSH):
+    """Client side of the key agent, usable as an auth source by SSHClient."""
+
+    def __init__(self, socket_path):
+        super().__init__()
+        conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        conn.connect(socket_path)
+        self._connect(conn)
+
+    def close(self):
+        self._close()
+
+def _recv_exact(conn, size):
+    data = b''
+    while len(data) < size:
+        chunk = conn.recv(size - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return data
+
+def _signature_algorithm(flags):
+    """Maps the sign request flags to the RSA signature algorithm the client asked for."""
+    if flags & SSH_AGENT_RSA_SHA2_512:
+        return "rsa-sha2-512"
+    if flags & SSH_AGENT_RSA_SHA2_256:
+        return "rsa-sha2-256"
+    return "ssh-rsa"
+
+class _AgentRequestHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        key = self.server.private_key
+        while True:
+            header = _recv_exact(self.request, 4)
+            if header is None:
+                return
+            length = int.from_bytes(header, 'big')
+            body = _recv_exact(self.request, length)
+            if body is None:
+                return
+
+            request = paramiko.Message(body)
+            reply = paramiko.Message()
+            msg_type = request.get_byte()[0]
+            try:
+                if msg_type == SSH2_AGENTC_REQUEST_IDENTITIES:
+                    reply.add_byte(bytes([SSH2_AGENT_IDENTITIES_ANSWER]))
+                    reply.add_int(1)
+                    reply.add_string(key.asbytes())
+                    reply.add_string(self.server.key_comment)
+                elif msg_type == SSH2_AGENTC_SIGN_REQUEST:
+                    key_blob = request.get_binary()
+                    data = request.get_binary()
+                    flags = request.get_int()
+                    if key_blob != key.asbytes():
+                        logger.warning("Key agent received a sign request for an unknown key.")
+                        reply.add_byte(bytes([SSH_AGENT_FAILURE]))
+                    else:
+                        signature = key.sign_ssh_data(data, _signature_algorithm(flags))
+                        reply.add_byte(bytes([SSH2_AGENT_SIGN_RESPONSE]))
+                        reply.add_string(signature.asbytes())
+                else:
+                    reply.add_byte(bytes([SSH_AGENT_FAILURE]))
+            except Exception as e:
+                logger.exception("Key agent failed to handle request type %s: %s", msg_type, e)
+                reply = paramiko.Message()
+                reply.add_byte(bytes([SSH_AGENT_FAILURE]))
+
+            payload = reply.asbytes()
+            self.request.sendall(len(payload).to_bytes(4, 'big') + payload)
+
+class KeyAgentServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, private_key, key_comment="one-click-lite"):
+        self.private_key = private_key
+        self.key_comment = key_comment
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        # Only the owner (the user running the portal) may talk to the agent.
+        old_umask = os.umask(0o177)
+        try:
+            super().__init__(socket_path, _AgentRequestHandler)
+        finally:
+            os.umask(old_umask)
+
+def run_agent(socket_path=None):
+    """Unlocks the admin PEM once and serves it to local workers until interrupted."""
+    socket_path = socket_path or os.getenv('KEY_AGENT_SOCKET', DEFAULT_SOCKET_PATH)
+    pem_file_path = os.getenv('PEM_FILE_PATH')
+    crypt_password = os.getenv('CRYPT_PASSWORD')
+    if not pem_file_path or not os.path.exists(pem_file_path):
+        raise ValueError(f"PEM file not found at specified path {pem_file_path}")
+
+    private_key = load_private_key(pem_file_path, crypt_password)
+    logger.info("Key agent unlocked %s, listening on %s", pem_file_path, socket_path)
+
+    server = KeyAgentServer(socket_path, private_key)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+
+
+if __name__ == "__main__":
+    from utils.env import load_env
+    load_env()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    try:
+        run_agent()
+    except KeyboardInterrupt:
+        logger.info("Key agent stopped.")
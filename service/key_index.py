@@ -0,0 +1,217 @@
+"""
+Index of granted public keys: SHA256 fingerprint -> (username, host).
+
+Every grant records the key's fingerprint for the user and host, and every removal
+drops the user's entries for that host, so "which hosts accept this key?" is one
+lookup. The index is a CSV file (KEY_INDEX_FILE) that every worker process can
+read; it is loaded into memory and reloaded when another process changes it.
+
+Grants made before the index existed can be backfilled from the hosts themselves:
+    python -m service.key_index --backfill
+"""
+import os
+import csv
+import logging
+import argparse
+import threading
+from datetime import datetime
+from utils.env import EnvSettings
+from utils.file_lock import file_lock
+from utils.ssh_keys import parse_public_key
+
+logger = logging.getLogger(__name__)
+
+env = EnvSettings(
+    KEY_INDEX_FILE=('logs/key_index.csv', str),
+)
+FIELDNAMES = ['Fingerprint', 'Key Type', 'Bits', 'Username', 'IP Address', 'Timestamp']
+
+_cache_lock = threading.Lock()
+_cache = {'stat': None, 'by_fingerprint': {}, 'by_account': {}}
+
+def _lock_path():
+    return f"{env.KEY_INDEX_FILE}.lock"
+
+def _file_stat():
+    try:
+        stat = os.stat(env.KEY_INDEX_FILE)
+        return (stat.st_mtime_ns, stat.st_size)
+    except FileNotFoundError:
+        return None
+
+def _read_rows():
+    try:
+        with open(env.KEY_INDEX_FILE, 'r', newline='') as f:
+            return list(csv.DictReader(f))
+    except FileNotFoundError:
+        return []
+
+def _load():
+    """Returns (by_fingerprint, by_account), reloading the file if it changed."""
+    stat = _file_stat()
+    with _cache_lock:
+        if _cache['stat'] == stat and stat is not None:
+            return _cache['by_fingerprint'], _cache['by_account']
+
+    by_fingerprint = {}
+    by_account = {}
+    for row in _read_rows():
+        by_fingerprint.setdefault(row['Fingerprint'], {})[(row['Username'], row['IP Address'])] = row
+        by_account.setdefault((row['Username'], row['IP Address']), set()).add(row['Fingerprint'])
+    with _cache_lock:
+        _cache.update(stat=stat, by_fingerprint=by_fingerprint, by_account=by_account)
+    return by_fingerprint, by_account
+
+def _write_rows(rows):
+    temp_path = f"{env.KEY_INDEX_FILE}.{os.getpid()}.{threading.get_ident()}.temp"
+    with open(temp_path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=FIELDNAMES)
+        writer.writeheader()
+        writer.writerows(rows)
+    os.replace(temp_path, env.KEY_INDEX_FILE)
+
+def _new_row(key, username, ip):
+    return {
+        'Fingerprint': key.fingerprint,
+        'Key Type': key.key_type,
+        'Bits': key.bits,
+        'Username': username,
+        'IP Address': ip,
+        'Timestamp': datetime.now().isoformat(),
+    }
+
+def record_key(pub_key, username, ip):
+    """Records that pub_key is authorized for username on ip (deduplicated by fingerprint)."""
+    try:
+        key = parse_public_key(pub_key)
+    except ValueError as e:
+        logger.warning("Not indexing unparsable key for user '%s' on %s: %s", username, ip, e)
+        return
+    try:
+        with file_lock(_lock_path()):
+            by_fingerprint, _ = _load()
+            if (username, ip) in by_fingerprint.get(key.fingerprint, {}):
+                return
+            file_exists = os.path.exists(env.KEY_INDEX_FILE)
+            with open(env.KEY_INDEX_FILE, 'a', newline='') as f:
+                writer = csv.DictWriter(f, fieldnames=FIELDNAMES)
+                if not file_exists:
+                    writer.writeheader()
+                writer.writerow(_new_row(key, username, ip))
+        logger.debug("Indexed key %s for user '%s' on %s", key.fingerprint, username, ip)
+    except OSError as e:
+        logger.error("Failed to update key index %s: %s", env.KEY_INDEX_FILE, e)
+
+def remove_account_keys(username, ip, fingerprint=None):
+    """
+    Drops index entries for username on ip: all of them, or only the given fingerprint.
+    """
+    try:
+        with file_lock(_lock_path()):
+            _, by_account = _load()
+            fingerprints = by_account.get((username, ip), set())
+            if not fingerprints or (fingerprint is not None and fingerprint not in fingerprints):
+                return
+            rows = [
+                row for row in _read_rows()
+                if not (row['Username'] == username and row['IP Address'] == ip
+                        and (fingerprint is None or row['Fingerprint'] == fingerprint))
+            ]
+            _write_rows(rows)
+        logger.debug("Removed indexed keys for user '%s' on %s", username, ip)
+    except OSError as e:
+        logger.error("Failed to update key index %s: %s", env.KEY_INDEX_FILE, e)
+
+def lookup_fingerprint(fingerprint):
+    """
+    Returns where a key is authorized.
+
+    Returns:
+        list: dicts with username, ip, key_type, bits and granted_at, sorted by host.
+    """
+    by_fingerprint, _ = _load()
+    locations = [
+        {
+            'username': row['Username'],
+            'ip': row['IP Address'],
+            'key_type': row['Key Type'],
+            'bits': int(row['Bits']),
+            'granted_at': row['Timestamp'],
+        }
+        for row in by_fingerprint.get(fingerprint, {}).values()
+    ]
+    return sorted(locations, key=lambda location: (location['ip'], location['username']))
+
+def account_fingerprints(username, ip):
+    """Returns the set of indexed fingerprints for username on ip."""
+    _, by_account = _load()
+    return set(by_account.get((username, ip), set()))
+
+def backfill_from_hosts(accounts, operator='System'):
+    """
+    Reads authorized_keys of the given accounts over SSH and indexes every key found.
+
+    Args:
+        accounts: Iterable of (username, ip) pairs.
+        operator: Operator name used for SSH admission control.
+
+    Returns:
+        dict: ip -> (success, message, attempts), as returned by run_on_hosts().
+    """
+    from service.fanout import run_on_hosts
+    from service.ssh_service import SSHClient
+
+    users_by_ip = {}
+    for username, ip in accounts:
+        users_by_ip.setdefault(ip, set()).add(username)
+
+    def scan(ip):
+        client = SSHClient(ip)
+        try:
+            success, message = client.connect()
+            if not success:
+                return success, message
+            indexed = 0
+            for username in sorted(users_by_ip[ip]):
+                stdin, stdout, stderr = client.exec_command(f"sudo cat /home/{username}/.ssh/authorized_keys")
+                if stdout.channel.recv_exit_status() != 0:
+                    continue
+                for line in stdout.read().decode('utf-8', 'replace').splitlines():
+                    line = line.strip()
+                    if not line or line.startswith('#'):
+                        continue
+                    try:
+                        parse_public_key(line)
+                    except ValueError:
+                        continue  # lines with options or unsupported key types
+                    record_key(line, username, ip)
+                    indexed += 1
+            return True, f"Indexed {indexed} keys on {ip}"
+        except Exception as e:
+            logger.exception("Error reading authorized_keys on %s: %s", ip, e)
+            return False, f"Error reading authorized_keys on {ip}: {e}"
+        finally:
+            client.close()
+
+    return run_on_hosts(scan, list(users_by_ip), operator)
+
+
+if __name__ == "__main__":
+    from utils.env import load_env
+    load_env()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Query or backfill the public key fingerprint index.")
+    parser.add_argument('fingerprint', nargs='?', help="Fingerprint (SHA256:...) to look up")
+    parser.add_argument('--backfill', action='store_true', help="Index the keys of every recorded account from its host")
+    args = parser.parse_args()
+
+    if args.backfill:
+        from service.csv_service import iter_log_records
+        accounts = {(record['Username'], record['IP Address']) for record in iter_log_records()}
+        for ip, (success, message, attempts) in backfill_from_hosts(accounts, 'key-index-backfill').items():
+            print(f"{ip}: {'ok' if success else 'failed'} {message}")
+    elif args.fingerprint:
+        for location in lookup_fingerprint(args.fingerprint):
+            print(f"{location['ip']}\t{location['username']}\t{location['key_type']} {location['bits']}\t{location['granted_at']}")
+    else:
+        parser.error("Give a fingerprint or --backfill.")
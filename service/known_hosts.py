@@ -0,0 +1,240 @@
+"""
+Managed known_hosts store for the portal's outbound SSH connections.
+
+The file (KNOWN_HOSTS_FILE, OpenSSH known_hosts format) is loaded once per process
+into a dict indexed by host. Each SSHClient is seeded with only its target's keys,
+so paramiko verifies the host key before authenticating and a changed key fails
+fast with BadHostKeyException. Unknown hosts are trusted on first use and recorded,
+unless SSH_STRICT_HOST_KEYS is enabled, in which case they are rejected.
+
+Seed the store for whole groups with the parallel scanner:
+    python -m service.known_hosts devops sre
+"""
+import os
+import socket
+import logging
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import paramiko
+from paramiko.hostkeys import HostKeyEntry
+from utils.env import EnvSettings, env_flag
+
+from utils.file_lock import file_lock
+from service.bastion import get_bastion_for, get_tunnel
+
+logger = logging.getLogger(__name__)
+
+env = EnvSettings(
+    KNOWN_HOSTS_FILE=('logs/known_hosts', str),
+    SSH_STRICT_HOST_KEYS=('false', env_flag),
+    SCAN_WORKERS=(32, int, 'KNOWN_HOSTS_SCAN_WORKERS'),
+)
+
+class KnownHostsRegistry:
+    def __init__(self, path=None):
+        self.path = env.KNOWN_HOSTS_FILE if path is None else path
+        self._lock = threading.Lock()
+        self._keys = {}  # host -> {key_type: PKey}
+        self._loaded_stat = None
+        self.load()
+
+    def _file_stat(self):
+        try:
+            stat = os.stat(self.path)
+            return (stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError:
+            return None
+
+    def load(self):
+        """(Re)loads the known_hosts file into memory."""
+        keys = {}
+        stat = self._file_stat()
+        if stat is not None:
+            with open(self.path, 'r') as f:
+                for lineno, line in enumerate(f, 1):
+                    line = line.strip()
+                    if not line or line.startswith('#'):
+                        continue
+                    try:
+                        entry = HostKeyEntry.from_line(line, lineno)
+                    except Exception as e:
+                        logger.warning("Skipping invalid line %s in %s: %s", lineno, self.path, e)
+                        continue
+                    if entry is None:
+                        continue
+                    for host in entry.hostnames:
+                        if host.startswith('|1|'):
+                            logger.warning("Skipping hashed hostname on line %s of %s, it cannot be indexed.", lineno, self.path)
+                            continue
+                        keys.setdefault(host, {})[entry.key.get_name()] = entry.key
+        with self._lock:
+            self._keys = keys
+            self._loaded_stat = stat
+        logger.info("Loaded host keys for %s hosts from %s", len(keys), self.path)
+
+    def refresh_if_changed(self):
+        """Reloads the file if another process has written to it since the last load."""
+        if self._file_stat() != self._loaded_stat:
+            self.load()
+
+    def get(self, host):
+        """Returns {key_type: PKey} for host, or None if the host is unknown."""
+        with self._lock:
+            keys = self._keys.get(host)
+            return dict(keys) if keys else None
+
+    def add(self, host, key):
+        """Records a host key in memory and appends it to the known_hosts file."""
+        with file_lock(f"{self.path}.lock"):
+            with open(self.path, 'a') as f:
+                f.write(f"{host} {key.get_name()} {key.get_base64()}\n")
+            with self._lock:
+                self._keys.setdefault(host, {})[key.get_name()] = key
+                self._loaded_stat = self._file_stat()
+
+    def replace(self, host, key):
+        """Replaces all keys of host (e.g. after a legitimate reinstall) and rewrites the file."""
+        with file_lock(f"{self.path}.lock"):
+            with self._lock:
+                self._keys[host] = {key.get_name(): key}
+                temp_path = f"{self.path}.{os.getpid()}.temp"
+                with open(temp_path, 'w') as f:
+                    for known_host, keys in self._keys.items():
+                        for known_key in keys.values():
+                            f.write(f"{known_host} {known_key.get_name()} {known_key.get_base64()}\n")
+                os.replace(temp_path, self.path)
+                self._loaded_stat = self._file_stat()
+
+    def seed(self, client, host):
+        """Gives an SSH client only the known keys of the host it is about to connect to."""
+        keys = self.get(host)
+        if keys is None:
+            self.refresh_if_changed()
+            keys = self.get(host)
+        if keys:
+            host_keys = client.get_host_keys()
+            for key_type, key in keys.items():
+                host_keys.add(host, key_type, key)
+
+class UnknownHostKeyError(paramiko.SSHException):
+    """The host has no recorded key and strict host key checking is enabled."""
+
+class RegistryHostKeyPolicy(paramiko.MissingHostKeyPolicy):
+    """Handles hosts that have no entry in the registry: record them, or reject them in strict mode."""
+
+    def __init__(self, registry, strict=None):
+        self.registry = registry
+        self.strict = env.SSH_STRICT_HOST_KEYS if strict is None else strict
+
+    def missing_host_key(self, client, hostname, key):
+        if self.strict:
+            raise UnknownHostKeyError(f"Host key for {hostname} is not in {self.registry.path} and strict host key checking is enabled.")
+        logger.info("Recording new %s host key for %s (trust on first use).", key.get_name(), hostname)
+        self.registry.add(hostname, key)
+
+_registry = None
+_registry_lock = threading.Lock()
+
+def get_known_hosts():
+    """Returns the process-wide known hosts registry, loading it on first use."""
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = KnownHostsRegistry()
+    return _registry
+
+def scan_host_key(ip, port=22, timeout=5):
+    """
+    Fetches the host key of a server without authenticating (like ssh-keyscan).
+
+    Returns:
+        A tuple: (success, result), where result is the PKey or an error message.
+    """
+    sock = None
+    transport = None
+    tunnel = None
+    try:
+        bastion = get_bastion_for(ip)
+        if bastion:
+            tunnel = get_tunnel(*bastion)
+            sock = tunnel.open_channel(ip, port, timeout=timeout)
+        else:
+            sock = socket.create_connection((ip, port), timeout=timeout)
+        transport = paramiko.Transport(sock)
+        transport.start_client(timeout=timeout)
+        return True, transport.get_remote_server_key()
+    except Exception as e:
+        logger.warning("Host key scan failed for %s: %s", ip, e)
+        return False, str(e)
+    finally:
+        if transport is not None:
+            transport.close()
+        elif sock is not None:
+            sock.close()
+        if tunnel is not None and sock is not None:
+            tunnel.release()
+
+def scan_and_record(ips, replace_changed=False, workers=None):
+    """
+    Scans host keys in parallel and records them in the registry.
+
+    Args:
+        ips: Hosts to scan.
+        replace_changed: Overwrite keys that differ from the recorded ones.
+        workers: Number of parallel scans, KNOWN_HOSTS_SCAN_WORKERS by default.
+
+    Returns:
+        dict: ip -> {'status': 'added'|'unchanged'|'changed'|'replaced'|'failed', 'message': str}
+    """
+    registry = get_known_hosts()
+    registry.refresh_if_changed()
+    results = {}
+    if not ips:
+        return results
+
+    with ThreadPoolExecutor(max_workers=min(len(ips), workers or env.SCAN_WORKERS)) as executor:
+        scans = dict(zip(ips, executor.map(scan_host_key, ips)))
+
+    for ip, (success, result) in scans.items():
+        if not success:
+            results[ip] = {'status': 'failed', 'message': result}
+            continue
+        known = registry.get(ip)
+        fingerprint = f"{result.get_name()} {result.fingerprint}"
+        if known is None or result.get_name() not in known:
+            registry.add(ip, result)
+            results[ip] = {'status': 'added', 'message': fingerprint}
+        elif known[result.get_name()] == result:
+            results[ip] = {'status': 'unchanged', 'message': fingerprint}
+        elif replace_changed:
+            registry.replace(ip, result)
+            results[ip] = {'status': 'replaced', 'message': fingerprint}
+        else:
+            logger.warning("Host key for %s differs from the recorded one: %s", ip, fingerprint)
+            results[ip] = {'status': 'changed', 'message': f"Host key differs from the recorded one: {fingerprint}"}
+    return results
+
+
+if __name__ == "__main__":
+    from utils.env import load_env
+    from utils.group_ip_provider import get_ips_from_group
+
+    load_env()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Scan and record host keys for groups of servers.")
+    parser.add_argument('groups', nargs='*', help="Group names from assets/groups")
+    parser.add_argument('--ips', default='', help="Additional comma separated IPs")
+    parser.add_argument('--replace', action='store_true', help="Replace keys that changed")
+    args = parser.parse_args()
+
+    targets = [ip.strip() for ip in args.ips.split(',') if ip.strip()]
+    for group in args.groups:
+        targets.extend(get_ips_from_group(group))
+    targets = list(dict.fromkeys(targets))
+    if not targets:
+        parser.error("No hosts to scan.")
+
+    for ip, result in scan_and_record(targets, replace_changed=args.replace).items():
+        print(f"{ip}: {result['status']} {result['message']}")
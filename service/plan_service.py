@@ -0,0 +1,171 @@
+"""
+Plan/apply mode for give and remove access.
+
+Planning runs only the read-only probes (in parallel) and stores the resulting
+per-host diff for PLAN_TTL_SECONDS. Applying a fresh plan runs only the mutating
+commands, so previewing a change does not double the SSH work.
+"""
+import time
+import logging
+from datetime import datetime
+from service.create_user import plan_user_on_server, apply_user_plan
+from service.remove_user import plan_removal_on_server, apply_removal_plan
+from service.fanout import run_on_hosts
+from service.csv_service import set_access_expiry
+from service.group_sync import record_assignments, remove_assignments_for_hosts
+from service.job_store import save_job, load_job, claim_job, purge_expired_jobs
+from utils.env import EnvSettings
+
+logger = logging.getLogger(__name__)
+
+env = EnvSettings(
+    PLAN_TTL_SECONDS=(300, int),
+)
+PLAN_KIND = 'plans'
+
+class PlanError(Exception):
+    """Raised when a plan cannot be applied. status_code is the HTTP status to report."""
+
+    def __init__(self, message, status_code):
+        super().__init__(message)
+        self.status_code = status_code
+
+def _collect_host_plans(host_results):
+    hosts = {}
+    for ip, (success, result, attempts) in host_results.items():
+        if success:
+            hosts[ip] = dict(result, success=True, attempts=attempts)
+        else:
+            hosts[ip] = {'success': False, 'message': result, 'attempts': attempts}
+    return hosts
+
+def _save_plan(plan):
+    purge_expired_jobs(PLAN_KIND)
+    plan_id = save_job(PLAN_KIND, plan, ttl=env.PLAN_TTL_SECONDS)
+    logger.info("Stored %s plan %s for user '%s' on %s hosts (by '%s').", plan['operation'], plan_id, plan['username'], len(plan['hosts']), plan['created_by'])
+    return plan_id
+
+def plan_give_access(ips, username, pub_key, add_to_sudoers, action_by_user, groups=(), expires_at=None):
+    """
+    Probes all hosts in parallel and stores the changes a grant would make.
+
+    groups are the groups the ips were expanded from; they are recorded as group
+    assignments when the plan is applied (see service/group_sync.py), unless the
+    grant expires at expires_at (see service/expiry_scheduler.py).
+
+    Returns:
+        A tuple: (plan_id, plan).
+    """
+    host_results = run_on_hosts(
+        lambda ip: plan_user_on_server(ip, username, pub_key, add_to_sudoers, action_by_user, raise_transient=True),
+        ips, action_by_user
+    )
+    plan = {
+        'operation': 'giveaccess',
+        'username': username,
+        'pub_key': pub_key,
+        'add_to_sudoers': add_to_sudoers,
+        'groups': list(groups),
+        'access_expires_at': expires_at.isoformat() if expires_at else None,
+        'created_by': action_by_user,
+        'hosts': _collect_host_plans(host_results),
+    }
+    return _save_plan(plan), plan
+
+def plan_remove_access(ips, username, action_by_user):
+    """
+    Probes all hosts in parallel and stores what a removal would do.
+
+    Returns:
+        A tuple: (plan_id, plan).
+    """
+    host_results = run_on_hosts(
+        lambda ip: plan_removal_on_server(ip, username, action_by_user, raise_transient=True),
+        ips, action_by_user
+    )
+    plan = {
+        'operation': 'removeaccess',
+        'username': username,
+        'created_by': action_by_user,
+        'hosts': _collect_host_plans(host_results),
+    }
+    return _save_plan(plan), plan
+
+def get_plan(plan_id):
+    """Returns a stored plan, or None if it does not exist or has expired."""
+    return load_job(PLAN_KIND, plan_id)
+
+def summarize_plan(plan_id, plan):
+    """Returns the client-facing view of a plan (without the raw shell commands)."""
+    hosts = {}
+    for ip, host in plan['hosts'].items():
+        if host['success']:
+            hosts[ip] = {'success': True, 'user_exists': host['user_exists'], 'actions': host['actions'],
+                         'attempts': host['attempts']}
+        else:
+            hosts[ip] = {'success': False, 'message': host['message'], 'attempts': host['attempts']}
+    return {
+        'plan_id': plan_id,
+        'operation': plan['operation'],
+        'username': plan['username'],
+        'expires_in': max(int(plan['expires_at'] - time.time()), 0),
+        'access_expires_at': plan.get('access_expires_at'),
+        'hosts': hosts,
+    }
+
+def apply_plan(plan_id, action_by_user):
+    """
+    Applies a stored plan, running only its mutating commands.
+
+    A plan can be applied once, by the operator who created it. Hosts whose probe
+    failed are reported as failures and are not touched.
+
+    Returns:
+        dict: ip -> (success, message, attempts).
+
+    Raises:
+        PlanError: If the plan is unknown, expired or belongs to another operator.
+    """
+    plan = load_job(PLAN_KIND, plan_id)
+    if plan is None:
+        raise PlanError(f"Plan '{plan_id}' not found or expired. Create a new plan.", 404)
+    if plan['created_by'] != action_by_user:
+        raise PlanError(f"Plan '{plan_id}' was created by another operator.", 403)
+    plan = claim_job(PLAN_KIND, plan_id)
+    if plan is None:
+        raise PlanError(f"Plan '{plan_id}' has already been applied or has expired.", 409)
+
+    username = plan['username']
+    results = {}
+    runnable = []
+    for ip, host in plan['hosts'].items():
+        if host['success']:
+            runnable.append(ip)
+        else:
+            results[ip] = (False, f"Not applied, probe failed: {host['message']}", 0)
+
+    if plan['operation'] == 'giveaccess':
+        def task(ip):
+            host = plan['hosts'][ip]
+            return apply_user_plan(ip, username, host['commands'], host['user_exists'], action_by_user,
+                                   plan['pub_key'], plan['add_to_sudoers'], host.get('state'),
+                                   raise_transient=True)
+    else:
+        def task(ip):
+            return apply_removal_plan(ip, username, plan['hosts'][ip]['user_exists'], action_by_user,
+                                      raise_transient=True)
+
+    logger.info("Applying %s plan %s for user '%s' on %s hosts (by '%s').", plan['operation'], plan_id, username, len(runnable), action_by_user)
+    results.update(run_on_hosts(task, runnable, action_by_user))
+    if plan['operation'] == 'giveaccess':
+        expires_at = datetime.fromisoformat(plan['access_expires_at']) if plan.get('access_expires_at') else None
+        set_access_expiry(username, [ip for ip in runnable if results[ip][0]], expires_at, action_by_user)
+        if plan.get('groups') and expires_at is None:
+            if all(result[0] for result in results.values()):
+                record_assignments(plan['groups'], username, plan['pub_key'], plan['add_to_sudoers'], action_by_user)
+            else:
+                # The sync would take the failed hosts as granted; grant the groups again instead
+                logger.warning("Not recording group assignment of user '%s' from plan %s, it failed on some hosts.", username, plan_id)
+    else:
+        remove_assignments_for_hosts(username, [ip for ip in runnable if results[ip][0]], action_by_user)
+    return results
@@ -0,0 +1,229 @@
+"""
+Sparse timestamp -> byte offset index over the append-only user_records.csv file.
+
+Records are appended in the order they happen, so every RECORD_INDEX_STRIDE-th row
+is written to a side file as "timestamp,offset,row". A time-range read bisects the
+index and seeks straight to the block containing the range start, instead of
+parsing the whole file. Timestamps are naive local time and go back by up to
+MAX_CLOCK_STEP_BACK when DST ends, so the seek starts that much earlier.
+"""
+import os
+import bisect
+import logging
+import threading
+from datetime import datetime, timedelta
+from utils.env import EnvSettings
+
+logger = logging.getLogger(__name__)
+
+env = EnvSettings(
+    RECORD_INDEX_STRIDE=(1000, int),
+)
+
+# Largest backward step of the local clock between two appended rows (end of DST)
+MAX_CLOCK_STEP_BACK = timedelta(hours=1)
+
+# index_file -> (mtime_ns, size, entries, timestamps), so each process reparses the index only when it changes
+_index_cache = {}
+
+def get_index_path(data_file):
+    return f"{data_file}.idx"
+
+def _parse_timestamp(value):
+    try:
+        return datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+
+def _timestamp_of_line(line):
+    """Returns the raw Timestamp column of a CSV data line (always the first column)."""
+    return line.split(b',', 1)[0].decode('utf-8').strip().strip('"')
+
+def _append_entry(index_file, timestamp, offset, row):
+    with open(index_file, 'a') as f:
+        f.write(f"{timestamp},{offset},{row}\n")
+
+def rebuild_index(data_file):
+    """
+    Rebuilds the index by scanning data_file once.
+
+    Args:
+        data_file: Path to the records CSV file.
+
+    Returns:
+        int: The number of index entries written.
+    """
+    index_file = get_index_path(data_file)
+    # Unique per writer, so concurrent rebuilds never clobber each other's temp file
+    temp_file = f"{index_file}.{os.getpid()}.{threading.get_ident()}.temp"
+    entries = 0
+    if not os.path.exists(data_file):
+        logger.warning("Cannot build index, %s does not exist.", data_file)
+        return entries
+
+    with open(data_file, 'rb') as infile, open(temp_file, 'w') as outfile:
+        infile.readline()  # header
+        offset = infile.tell()
+        row = 0
+        for line in iter(infile.readline, b''):
+            if line.strip():
+                if row % env.RECORD_INDEX_STRIDE == 0:
+                    outfile.write(f"{_timestamp_of_line(line)},{offset},{row}\n")
+                    entries += 1
+                row += 1
+            offset += len(line)
+    os.replace(temp_file, index_file)
+    _index_cache.pop(index_file, None)
+    logger.info("Rebuilt record index %s with %s entries.", index_file, entries)
+    return entries
+
+def ensure_index(data_file):
+    """Builds the index if it is missing or no longer matches data_file."""
+    index_file = get_index_path(data_file)
+    if not os.path.exists(index_file):
+        logger.info("Record index %s missing, rebuilding.", index_file)
+        rebuild_index(data_file)
+        return
+    entries = load_index(data_file)
+    if entries and not _entry_matches(data_file, entries[-1]):
+        logger.warning("Record index %s is stale, rebuilding.", index_file)
+        rebuild_index(data_file)
+
+def load_index(data_file):
+    """
+    Loads the index entries for data_file.
+
+    Returns:
+        list: (datetime, offset, row) tuples in file order. Empty if there is no index.
+    """
+    return _load(data_file)[0]
+
+def _load(data_file):
+    """
+    Returns (entries, timestamps) of the index. timestamps holds the running maximum
+    of the entry timestamps, which stays sorted when the clock went back, ready for
+    bisecting.
+    """
+    index_file = get_index_path(data_file)
+    try:
+        stat = os.stat(index_file)
+    except FileNotFoundError:
+        return [], []
+
+    cached = _index_cache.get(index_file)
+    if cached and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+        return cached[2], cached[3]
+
+    entries = []
+    with open(index_file, 'r') as f:
+        for line in f:
+            parts = line.strip().split(',')
+            if len(parts) != 3:
+                continue
+            timestamp = _parse_timestamp(parts[0])
+            if timestamp is None:
+                continue
+            entries.append((timestamp, int(parts[1]), int(parts[2])))
+    timestamps = []
+    for entry in entries:
+        timestamps.append(max(entry[0], timestamps[-1]) if timestamps else entry[0])
+    _index_cache[index_file] = (stat.st_mtime_ns, stat.st_size, entries, timestamps)
+    return entries, timestamps
+
+def _entry_matches(data_file, entry, f=None):
+    """
+    Checks that the row at the entry offset still carries the indexed timestamp.
+
+    Reads from the open binary file f if given (its position is restored), otherwise
+    opens data_file.
+    """
+    timestamp, offset, _ = entry
+    try:
+        if f is None:
+            with open(data_file, 'rb') as f:
+                f.seek(offset)
+                line = f.readline()
+        else:
+            position = f.tell()
+            f.seek(offset)
+            line = f.readline()
+            f.seek(position)
+    except OSError:
+        return False
+    return bool(line) and _parse_timestamp(_timestamp_of_line(line)) == timestamp
+
+def update_index_after_append(data_file, offset, timestamp):
+    """
+    Records a newly appended row in the index if it falls on a stride boundary.
+
+    Must be called after the row has been written, with the byte offset at which it
+    starts, while still holding the record store lock. The row number is derived
+    from the last index entry, so the cost is bounded by one stride of the file no
+    matter how large the file grows.
+
+    Args:
+        data_file: Path to the records CSV file.
+        offset: Byte offset where the new row starts.
+        timestamp: The row's Timestamp value (ISO format string).
+    """
+    index_file = get_index_path(data_file)
+    entries = load_index(data_file)
+    if not entries:
+        # First data row starts right after the header
+        with open(data_file, 'rb') as f:
+            header_end = len(f.readline())
+        if offset == header_end:
+            _append_entry(index_file, timestamp, offset, 0)
+        else:
+            rebuild_index(data_file)
+        return
+
+    _, last_offset, last_row = entries[-1]
+    if offset < last_offset:
+        rebuild_index(data_file)
+        return
+    with open(data_file, 'rb') as f:
+        f.seek(last_offset)
+        rows_since_entry = f.read(offset - last_offset).count(b'\n')
+    row = last_row + rows_since_entry
+    if row % env.RECORD_INDEX_STRIDE == 0:
+        _append_entry(index_file, timestamp, offset, row)
+
+def _same_file(f, data_file):
+    try:
+        return os.fstat(f.fileno()).st_ino == os.stat(data_file).st_ino
+    except OSError:
+        return False
+
+def find_start_offset(data_file, start, f):
+    """
+    Returns the byte offset in the open file f from which rows at or after `start`
+    can be found.
+
+    The index is read by path, so it belongs to whatever data_file is now. If a
+    removal replaced data_file after f was opened, the index does not describe f.
+    In that case, or if no usable index exists, None is returned and callers fall
+    back to a full scan of f. Readers never rebuild the index, it only changes under
+    the record store lock (writers and init_record_store()).
+
+    Args:
+        data_file: Path to the records CSV file.
+        start: The datetime to seek to.
+        f: data_file opened in binary mode.
+    """
+    entries, timestamps = _load(data_file)
+    if not entries or not _same_file(f, data_file):
+        return None
+    entry = _find_block(entries, timestamps, start)
+    if not _entry_matches(data_file, entry, f):
+        if _same_file(f, data_file):
+            logger.warning("Record index for %s is stale, scanning the whole file.", data_file)
+        return None
+    return entry[1]
+
+def _find_block(entries, timestamps, start):
+    # A row at or after `start` can only precede an entry whose timestamp is within
+    # MAX_CLOCK_STEP_BACK of it, and rows equal to the bound may sit at the tail of
+    # the previous block, so step one back.
+    position = max(bisect.bisect_left(timestamps, start - MAX_CLOCK_STEP_BACK) - 1, 0)
+    return entries[position]
@@ -0,0 +1,314 @@
+"""
+Compact, column-oriented in-memory copy of user_records.csv.
+
+Instead of one dict per row, every column is a typed array: timestamps as int64
+microseconds since the epoch, IPv4 addresses packed into uint32, and usernames and
+actors as uint32 codes into interned string tables. That is about 24 bytes per
+record, including a per-user row list used by username lookups.
+
+The snapshot follows the file incrementally: appended bytes are parsed on the next
+query, and a rewritten file (removals replace it) is reloaded from scratch. Each
+worker process keeps one snapshot, see get_snapshot().
+"""
+import io
+import os
+import csv
+import bisect
+import socket
+import struct
+import logging
+import threading
+from array import array
+from datetime import datetime, timedelta
+from jinja2.utils import htmlsafe_json_dumps
+from service import csv_service
+
+logger = logging.getLogger(__name__)
+
+_EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+# Stored for values that do not pack (invalid timestamps, non-IPv4 addresses); the
+# original text is kept in _Columns.raw
+_INVALID_TIMESTAMP = -2 ** 63
+_INVALID_IP = 0xFFFFFFFF
+LOAD_CHUNK_BYTES = 1024 * 1024
+
+def _to_micros(timestamp):
+    if timestamp.tzinfo is not None:
+        # Records are naive local time
+        timestamp = timestamp.astimezone().replace(tzinfo=None)
+    return (timestamp - _EPOCH) // _MICROSECOND
+
+def _pack_ip(ip):
+    try:
+        return struct.unpack('>I', socket.inet_aton(ip))[0] if ip.count('.') == 3 else None
+    except OSError:
+        return None
+
+def _unpack_ip(value):
+    return socket.inet_ntoa(struct.pack('>I', value))
+
+class _Interner:
+    """Maps strings to dense integer codes and back."""
+
+    def __init__(self):
+        self.values = []
+        self.codes = {}
+
+    def code(self, value):
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+class _Columns:
+    """The records of one version of the file. Only ever appended to."""
+
+    def __init__(self):
+        self.timestamps = array('q')
+        self.ips = array('I')
+        self.users = array('I')
+        self.actors = array('I')
+        self.user_names = _Interner()
+        self.actor_names = _Interner()
+        self.user_rows = {}   # user code -> array of row numbers, ascending
+        self.raw = {}         # (column, row) -> original text of values that do not pack
+        self.time_ordered = True
+
+    def append(self, timestamp, ip, username, actor):
+        number = len(self.timestamps)
+        try:
+            micros = _to_micros(datetime.fromisoformat(timestamp))
+        except (TypeError, ValueError):
+            micros = None
+        if micros is None:
+            micros = _INVALID_TIMESTAMP
+            self.raw[(0, number)] = timestamp
+            # A time range can no longer be bisected, and must leave this row out
+            self.time_ordered = False
+        elif self.timestamps and micros < self.timestamps[-1]:
+            self.time_ordered = False
+        packed_ip = _pack_ip(ip)
+        if packed_ip is None or packed_ip == _INVALID_IP:
+            packed_ip = _INVALID_IP
+            self.raw[(1, number)] = ip
+
+        user = self.user_names.code(username)
+        self.timestamps.append(micros)
+        self.ips.append(packed_ip)
+        self.users.append(user)
+        self.actors.append(self.actor_names.code(actor))
+        self.user_rows.setdefault(user, array('I')).append(number)
+
+    def timestamp(self, number):
+        micros = self.timestamps[number]
+        if micros == _INVALID_TIMESTAMP:
+            return self.raw[(0, number)]
+        return (_EPOCH + timedelta(microseconds=micros)).isoformat()
+
+    def ip(self, number):
+        value = self.ips[number]
+        if value == _INVALID_IP:
+            return self.raw[(1, number)]
+        return _unpack_ip(value)
+
+    def record(self, number):
+        return {
+            'Timestamp': self.timestamp(number),
+            'IP Address': self.ip(number),
+            'Username': self.user_names.values[self.users[number]],
+            'Action By': self.actor_names.values[self.actors[number]],
+        }
+
+class RecordSelection:
+    """Rows of a snapshot matching a query. Records are built only while iterating."""
+
+    def __init__(self, columns, rows):
+        self._columns = columns
+        self.rows = rows
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __iter__(self):
+        for number in self.rows:
+            yield self._columns.record(number)
+
+    def ips(self):
+        """Returns the unique IPs of the selected rows."""
+        columns = self._columns
+        packed = {columns.ips[number] for number in self.rows}
+        ips = [_unpack_ip(value) for value in sorted(packed) if value != _INVALID_IP]
+        if _INVALID_IP in packed:
+            ips.extend(sorted({columns.ip(number) for number in self.rows if columns.ips[number] == _INVALID_IP}))
+        return ips
+
+    def to_json(self):
+        """Serializes the rows as an HTML-safe JSON array, one record at a time."""
+        return '[' + ','.join(htmlsafe_json_dumps(self._columns.record(number)) for number in self.rows) + ']'
+
+class RecordSnapshot:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reset(None)
+
+    def _reset(self, path):
+        self.path = path
+        self._inode = None
+        self._generation = None
+        self._offset = 0          # bytes of the file consumed so far
+        self._field_positions = None
+        self._data = _Columns()
+        self.error = None
+
+    def __len__(self):
+        return len(self._data.timestamps)
+
+    def refresh(self):
+        """
+        Parses rows appended since the last call, or reloads if the file was replaced.
+
+        Removals replace the file and bump csv_service.data_file_generation() afterwards.
+        The generation is read before the file and again after parsing; if it moved, the
+        rows just parsed may come from the new file at the old offset, so everything is
+        reloaded.
+        """
+        path = csv_service.DATA_FILE
+        with self._lock:
+            for _ in range(3):
+                generation = csv_service.data_file_generation()
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    self._reset(path)
+                    self.error = f"Error: Log data file ({path}) not found."
+                    return
+                if (path != self.path or generation != self._generation or stat.st_ino != self._inode
+                        or stat.st_size < self._offset):
+                    if self.path is not None:
+                        logger.info("Reloading record snapshot from %s", path)
+                    self._reset(path)
+                    self._inode = stat.st_ino
+                    self._generation = generation
+                if stat.st_size > self._offset:
+                    self._load_from(path, stat.st_size)
+                if csv_service.data_file_generation() == generation:
+                    return
+                self._generation = None
+
+    def _load_from(self, path, size):
+        if self.error:
+            return  # bad header, ignored until the file is replaced
+        before = len(self)
+        with open(path, 'rb') as f:
+            f.seek(self._offset)
+            remaining = size - self._offset
+            pending = b''
+            while remaining > 0:
+                block = f.read(min(LOAD_CHUNK_BYTES, remaining))
+                if not block:
+                    break
+                remaining -= len(block)
+                data = pending + block
+                # A writer may be half way through a row, only take complete lines
+                end = data.rfind(b'\n') + 1
+                pending = data[end:]
+                if end:
+                    self._offset += end
+                    if not self._parse(path, data[:end].decode('utf-8')):
+                        return
+        logger.debug("Record snapshot loaded %s rows, %s in total", len(self) - before, len(self))
+
+    def _parse(self, path, text):
+        """Appends the complete CSV lines in text. Returns False if the header is invalid."""
+        reader = csv.reader(io.StringIO(text, newline=''))
+        if self._field_positions is None:
+            header = next(reader, None)
+            if not header or not all(field in header for field in csv_service.FIELDNAMES):
+                self.error = (f"Error: Log data file ({path}) missing required headers "
+                              f"({', '.join(csv_service.FIELDNAMES)}). Found: {header}")
+                logger.error(self.error)
+                return False
+            self._field_positions = [header.index(field) for field in csv_service.FIELDNAMES]
+
+        ts_col, ip_col, user_col, actor_col = self._field_positions
+        append = self._data.append
+        for row in reader:
+            if not row:
+                continue
+            try:
+                append(row[ts_col], row[ip_col], row[user_col], row[actor_col])
+            except IndexError:
+                logger.warning("Skipping malformed record row: %s", row)
+        return True
+
+    def query(self, username=None, ip=None, action_by=None, start=None, end=None):
+        """
+        Selects the rows matching all given filters, in file order.
+
+        Args:
+            username, ip, action_by: Optional exact values to match.
+            start, end: Optional datetimes; rows at or after start and before end.
+
+        Returns:
+            RecordSelection: The matching rows.
+        """
+        self.refresh()
+        with self._lock:
+            data = self._data
+            count = len(data.timestamps)
+            time_ordered = data.time_ordered
+        timestamps, ips, actors = data.timestamps, data.ips, data.actors
+
+        user_rows = None
+        if username is not None:
+            user_rows = data.user_rows.get(data.user_names.codes.get(username))
+            if user_rows is None:
+                return RecordSelection(data, [])
+        actor_code = None
+        if action_by is not None:
+            actor_code = data.actor_names.codes.get(action_by)
+            if actor_code is None:
+                return RecordSelection(data, [])
+        ip_code = None
+        if ip is not None:
+            ip_code = _pack_ip(ip)
+            if ip_code is None or ip_code == _INVALID_IP:
+                ip_code = _INVALID_IP
+
+        start_micros = _to_micros(start) if start is not None else None
+        end_micros = _to_micros(end) if end is not None else None
+        low, high = 0, count
+        if time_ordered:
+            # Rows are appended in time order, so a time range is a slice
+            if start_micros is not None:
+                low = bisect.bisect_left(timestamps, start_micros, 0, count)
+            if end_micros is not None:
+                high = bisect.bisect_left(timestamps, end_micros, low, count)
+            start_micros = end_micros = None
+
+        if user_rows is not None:
+            rows = user_rows[bisect.bisect_left(user_rows, low):bisect.bisect_left(user_rows, high)]
+        else:
+            rows = range(low, high)
+        if ip_code is not None:
+            rows = [number for number in rows if ips[number] == ip_code]
+            if ip_code == _INVALID_IP:
+                rows = [number for number in rows if data.raw.get((1, number)) == ip]
+        if actor_code is not None:
+            rows = [number for number in rows if actors[number] == actor_code]
+        if start_micros is not None:
+            rows = [number for number in rows
+                    if timestamps[number] != _INVALID_TIMESTAMP and timestamps[number] >= start_micros]
+        if end_micros is not None:
+            rows = [number for number in rows
+                    if timestamps[number] != _INVALID_TIMESTAMP and timestamps[number] < end_micros]
+        return RecordSelection(data, rows)
+
+_snapshot = RecordSnapshot()
+
+def get_snapshot():
+    """Returns this process' snapshot, brought up to date with the file."""
+    _snapshot.refresh()
+    return _snapshot
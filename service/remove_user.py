@@ -1,15 +1,156 @@
+import shlex
 import logging
 from service.csv_service import remove_user_records_from_csv
 from service.ssh_service import SSHClient
+from service.host_state_cache import invalidate
+from service.key_index import remove_account_keys
+from service.retry import check_transient, TransientSSHError
+from utils.env import EnvSettings, env_flag
+
 logger = logging.getLogger(__name__)
 
-def remove_user_from_server(ip, username, action_by_user="System"):
+# Lock the account and kill the user's sessions and processes before userdel
+env = EnvSettings(
+    REMOVAL_KILL_SESSIONS=('true', env_flag),
+)
+
+# Exit statuses of the remote removal script
+_EXIT_USER_ABSENT = 3
+_EXIT_STILL_EXISTS = 5
+
+def probe_user_exists(client, username):
+    """Returns True if the user exists on the connected host."""
+    stdin, stdout, stderr = client.exec_command(f"id -u {username}")
+    return stdout.channel.recv_exit_status() == 0
+
+def build_removal_command(username, kill_sessions=None):
+    """
+    Returns the shell command that removes a user in one round trip.
+
+    The script exits with _EXIT_USER_ABSENT if there is no such user. Otherwise it
+    optionally locks and expires the account (no new password or key logins), ends
+    the user's sessions and kills their processes. Then it runs userdel -r and
+    checks that the user is gone. If the user is still there, the lock and expiry
+    are undone, so a failed removal does not leave a disabled account behind. It
+    prints key=value lines, see parse_removal_output().
+    """
+    if kill_sessions is None:
+        kill_sessions = env.REMOVAL_KILL_SESSIONS
+    script = f"""
+u={shlex.quote(username)}
+id -u "$u" >/dev/null 2>&1 || exit {_EXIT_USER_ABSENT}
+killed=0
+locked=0
+if [ {int(bool(kill_sessions))} = 1 ]; then
+    shadow=$(getent shadow "$u")
+    old_expire=$(printf '%s' "$shadow" | cut -d: -f8)
+    case "$(printf '%s' "$shadow" | cut -d: -f2)" in
+        '!'*) was_locked=1 ;;
+        *) was_locked=0 ;;
+    esac
+    usermod -L -e 1 "$u" >/dev/null 2>&1 && locked=1
+    killed=$(pgrep -u "$u" | wc -l)
+    loginctl terminate-user "$u" >/dev/null 2>&1
+    for attempt in 1 2 3 4 5; do
+        pkill -KILL -u "$u" || break
+        sleep 0.2
+    done
+fi
+echo "killed=$killed"
+output=$(userdel -r "$u" 2>&1)
+echo "userdel_status=$?"
+echo "userdel_output=$(printf '%s' "$output" | tr '\\n' ' ')"
+if id -u "$u" >/dev/null 2>&1; then
+    if [ $locked = 1 ]; then
+        restored=1
+        if [ $was_locked = 0 ]; then
+            usermod -U "$u" >/dev/null 2>&1 || restored=0
+        fi
+        chage -E "${{old_expire:--1}}" "$u" >/dev/null 2>&1 || restored=0
+        echo "restored=$restored"
+    fi
+    exit {_EXIT_STILL_EXISTS}
+fi
+exit 0
+"""
+    return f"sudo sh -c {shlex.quote(script)}"
+
+def parse_removal_output(output):
+    """Returns the key=value lines printed by the removal script as a dict."""
+    result = {}
+    for line in output.splitlines():
+        key, separator, value = line.partition('=')
+        if separator:
+            result[key.strip()] = value.strip()
+    return result
+
+def _delete_user(client, ip, username, action_by_user):
+    """Runs the removal script on a connected host and records the outcome."""
+    logger.info("Removing user '%s' from %s (Action by: %s, kill sessions: %s).", username, ip, action_by_user, env.REMOVAL_KILL_SESSIONS)
+    invalidate(ip, username)
+    stdin, stdout, stderr = client.exec_command(build_removal_command(username))
+    exit_status = stdout.channel.recv_exit_status()
+    # Again after the change, for probes that ran while the script did
+    invalidate(ip, username)
+    result = parse_removal_output(stdout.read().decode('utf-8'))
+
+    if exit_status == _EXIT_USER_ABSENT:
+        return _handle_missing_user(ip, username, action_by_user)
+
+    userdel_output = result.get('userdel_output', '')
+    if exit_status == _EXIT_STILL_EXISTS:
+        # Without REMOVAL_KILL_SESSIONS userdel refuses users that are logged in
+        if "currently logged in" in userdel_output or "currently used by process" in userdel_output or "process is running" in userdel_output:
+            message = f"Warning: Could not remove user '{username}' from {ip} because they are logged in or have active processes. Manual intervention may be required. Error: {userdel_output}"
+        else:
+            message = f"Error: User '{username}' still exists on {ip} after userdel (status {result.get('userdel_status')}): {userdel_output}"
+        killed = int(result.get('killed') or 0)
+        if killed:
+            message += f" {killed} of their processes were killed."
+        if result.get('restored') == '1':
+            message += " The account lock and expiry set before userdel were undone."
+        elif result.get('restored') == '0':
+            message += " The account was left locked and expired, undoing that failed."
+        logger.log(logging.WARNING if message.startswith('Warning') else logging.ERROR, "%s (Action by: %s)", message, action_by_user)
+        return False, message
+    if exit_status != 0:
+        error_message = stderr.read().decode('utf-8').strip()
+        message = f"Error removing user '{username}' from {ip}: {error_message or f'exit status {exit_status}'}"
+        logger.error("%s (Action by: %s)", message, action_by_user)
+        return False, message
+
+    message = f"User '{username}' removed successfully from {ip}."
+    killed = int(result.get('killed') or 0)
+    if killed:
+        message += f" Killed {killed} of their processes."
+    if result.get('userdel_status') not in (None, '0'):
+        # e.g. a missing mail spool; the account itself is gone
+        logger.warning("userdel on %s for '%s' reported: %s", ip, username, userdel_output)
+    logger.info("%s (Action by: %s)", message, action_by_user)
+    # Remove from CSV only after successful confirmation
+    remove_user_records_from_csv(username, ip, action_by_user)
+    remove_account_keys(username, ip)
+    return True, message
+
+def _handle_missing_user(ip, username, action_by_user):
+    invalidate(ip, username)
+    message = f"User '{username}' does not exist on {ip}, skipping removal command."
+    logger.info("%s (Action by: %s)", message, action_by_user)
+    # Remove CSV record even if user doesn't exist on server (cleans up potential inconsistencies)
+    remove_user_records_from_csv(username, ip, action_by_user)
+    remove_account_keys(username, ip)
+    # Considered success as the desired state (user gone) is achieved
+    return True, message
+
+def remove_user_from_server(ip, username, action_by_user="System", raise_transient=False):
     """
     Remove a user from the server at the specified IP address.
 
     Args:
         ip: The IP address of the server.
         username: The username to remove.
+        raise_transient: Raise TransientSSHError instead of returning a failure when
+            the error is worth retrying (see service/retry.py).
 
     Returns:
         A tuple: (success, message), where success is a boolean indicating
@@ -17,56 +158,124 @@ def remove_user_from_server(ip, username, action_by_user="System"):
     """
     client = SSHClient(ip)
     try:
-        logger.info(f"Attempting removal of user '{username}' from {ip}, requested by '{action_by_user}'")
+        logger.info("Attempting removal of user '%s' from %s, requested by '%s'", username, ip, action_by_user)
         success, message = client.connect()
         if not success:
+            check_transient(client.last_error, message, raise_transient)
             return success, message
 
-        # Check if the user exists
-        stdin, stdout, stderr = client.exec_command(f"id -u {username}")
-        user_exists = stdout.channel.recv_exit_status() == 0
-
-        if not user_exists:
-            message = f"User '{username}' does not exist on {ip}, skipping removal command."
-            logger.info(message + f" (Action by: {action_by_user})")
-            # Remove CSV record even if user doesn't exist on server (cleans up potential inconsistencies)
-            remove_user_records_from_csv(username, ip, action_by_user)
-            # Considered success as the desired state (user gone) is achieved
-            return True, message 
-
-        # Attempt user deletion
-        logger.info(f"User '{username}' exists on {ip}. Attempting removal (Action by: {action_by_user}).")
-        stdin, stdout, stderr = client.exec_command(f"sudo userdel -r {username}") # -r removes home dir
-        exit_status = stdout.channel.recv_exit_status()
-
-        if exit_status != 0:
-            error_message = stderr.read().decode('utf-8').strip()
-            # Check for common non-fatal error: userdel: user X is currently logged in
-            if "is currently logged in" in error_message or "process is running" in error_message:
-                message = f"Warning: Could not remove user '{username}' from {ip} because they are logged in or have active processes. Manual intervention may be required. Error: {error_message}"
-                logger.warning(message + f" (Action by: {action_by_user})")
-                # Should we return False here? Maybe. Let's return False as the action wasn't fully completed.
-                return False, message
-            else:
-                message = f"Error removing user '{username}' from {ip}: {error_message}"
-                logger.error(message + f" (Action by: {action_by_user})")
-                return False, message # Return False on unexpected errors
-
-        # recheck
-        stdin_check, stdout_check, stderr_check = client.exec_command(f"id -u {username}")
-        if stdout_check.channel.recv_exit_status() == 0:
-            # This shouldn't happen if userdel succeeded
-            message = f"Error: User '{username}' still exists on {ip} after userdel command."
-            logger.error(message + f" (Action by: {action_by_user})")
-            return False, message
-        else:
-            message = f"User '{username}' removed successfully from {ip}."
-            logger.info(message + f" (Action by: {action_by_user})")
-            # Remove from CSV only after successful confirmation
-            remove_user_records_from_csv(username, ip, action_by_user)
-            return True, message
+        # The removal script checks for the user itself, one round trip in total
+        return _delete_user(client, ip, username, action_by_user)
+    except TransientSSHError:
+        raise
+    except Exception as e:
+        logger.exception("General error removing user %s from %s (ActionBy: %s): %s", username, ip, action_by_user, e)
+        message = f"General error removing user from {ip}: {e}"
+        check_transient(e, message, raise_transient)
+        return False, message
+    finally:
+        client.close()
+
+def remove_users_from_server(ip, usernames, action_by_user="System", raise_transient=False, confirm=None):
+    """
+    Removes several users from one server over a single SSH connection.
+
+    Args:
+        confirm: Optional callable taking a username, called right before that user is
+            removed. Users it returns False for are skipped and reported as (True, message).
+
+    Returns:
+        A tuple: (success, result). If the connection succeeded, result is a dict
+        username -> (success, message) as for remove_user_from_server(); otherwise
+        success is False and result is the error message.
+    """
+    client = SSHClient(ip)
+    try:
+        logger.info("Attempting removal of %s users from %s, requested by '%s'", len(usernames), ip, action_by_user)
+        success, message = client.connect()
+        if not success:
+            check_transient(client.last_error, message, raise_transient)
+            return success, message
+
+        results = {}
+        for username in usernames:
+            if confirm is not None and not confirm(username):
+                logger.info("Skipping removal of user %s from %s, no longer confirmed (ActionBy: %s)", username, ip, action_by_user)
+                results[username] = (True, f"Skipped removal of user {username} from {ip}.")
+                continue
+            try:
+                results[username] = _delete_user(client, ip, username, action_by_user)
+            except Exception as e:
+                transport = client.get_transport()
+                if transport is None or not transport.is_active():
+                    raise  # connection lost, the remaining users cannot be handled either
+                logger.exception("General error removing user %s from %s (ActionBy: %s): %s", username, ip, action_by_user, e)
+                results[username] = (False, f"General error removing user from {ip}: {e}")
+        return True, results
+    except TransientSSHError:
+        raise
+    except Exception as e:
+        logger.exception("General error removing users from %s (ActionBy: %s): %s", ip, action_by_user, e)
+        message = f"General error removing users from {ip}: {e}"
+        check_transient(e, message, raise_transient)
+        return False, message
+    finally:
+        client.close()
+
+def plan_removal_on_server(ip, username, action_by_user="System", raise_transient=False):
+    """
+    Probes a server and returns what a removal would do, without doing it.
+
+    Returns:
+        A tuple: (success, result). On success result is a dict with user_exists and
+        actions; on failure it is the error message.
+    """
+    client = SSHClient(ip)
+    try:
+        success, message = client.connect()
+        if not success:
+            check_transient(client.last_error, message, raise_transient)
+            return success, message
+
+        user_exists = probe_user_exists(client, username)
+        actions = []
+        if user_exists:
+            actions = ['kill_sessions', 'userdel'] if env.REMOVAL_KILL_SESSIONS else ['userdel']
+        logger.info("Planned removal of user '%s' on %s: %s (Action by: %s)", username, ip, actions or 'nothing to do', action_by_user)
+        return True, {'user_exists': user_exists, 'actions': actions}
+    except TransientSSHError:
+        raise
+    except Exception as e:
+        logger.exception("General error planning removal of user %s from %s (ActionBy: %s): %s", username, ip, action_by_user, e)
+        message = f"General error planning removal from {ip}: {e}"
+        check_transient(e, message, raise_transient)
+        return False, message
+    finally:
+        client.close()
+
+def apply_removal_plan(ip, username, user_exists, action_by_user="System", raise_transient=False):
+    """
+    Runs a previously planned removal, skipping the existence probe.
+
+    Returns:
+        A tuple: (success, message), as for remove_user_from_server().
+    """
+    if not user_exists:
+        return _handle_missing_user(ip, username, action_by_user)
+
+    client = SSHClient(ip)
+    try:
+        success, message = client.connect()
+        if not success:
+            check_transient(client.last_error, message, raise_transient)
+            return success, message
+        return _delete_user(client, ip, username, action_by_user)
+    except TransientSSHError:
+        raise
     except Exception as e:
-        logger.exception(f"General error removing user {username} from {ip} (ActionBy: {action_by_user}): {e}")
-        return False, f"General error removing user from {ip}: {e}"
+        logger.exception("General error removing user %s from %s (ActionBy: %s): %s", username, ip, action_by_user, e)
+        message = f"General error removing user from {ip}: {e}"
+        check_transient(e, message, raise_transient)
+        return False, message
     finally:
-        client.close()
\ No newline at end of file
+        client.close()
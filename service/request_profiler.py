@@ -0,0 +1,297 @@
+"""
+Profiles of single portal requests, including their SSH fan-out workers.
+
+A ProfileSession covers one request. The thread handling the request and every
+run_on_hosts() worker running on its behalf (they inherit the session through
+contextvars) are profiled together, in one of two modes:
+
+- cprofile: deterministic cProfile of each thread, merged into one pstats file
+  (python -m pstats <file>, snakeviz, ...). Exact call counts and CPU hot spots,
+  e.g. how often derive_key ran and what it cost. Python 3.12+ allows a single
+  active cProfile per process, which would leave the workers out, so there
+  cprofile requests are profiled in sample mode instead.
+- sample: wall-clock stack samples every PROFILE_SAMPLE_INTERVAL_MS, written as a
+  speedscope file (https://www.speedscope.app). Low overhead, and shows where threads
+  wait (network, scheduler slots, file locks), not only where they compute.
+
+Profiles are written to PROFILE_DIR as <profile id>.pstats or <profile id>.speedscope.json;
+only the newest PROFILE_KEEP are kept. Which requests get profiled is decided by
+portal/profiling.py.
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import cProfile
+import logging
+import pstats
+import threading
+import contextvars
+from contextlib import contextmanager
+from datetime import datetime
+from utils.env import EnvSettings, env_list
+
+logger = logging.getLogger(__name__)
+
+env = EnvSettings(
+    PROFILE_DIR=('logs/profiles', str),
+    PROFILE_KEEP=(200, int),
+    PROFILE_SAMPLE_INTERVAL_MS=(5, float),
+    PROFILE_SETTINGS_FILE=('logs/profiling.json', str),
+    PROFILE_ADMINS=('', env_list),
+    PROFILE_SAMPLE_RATE=(0, float),
+    PROFILE_MODE=('cprofile', str),
+)
+
+PROFILE_MODES = {'cprofile': '.pstats', 'sample': '.speedscope.json'}
+# Python 3.12+ raises ValueError when a second cProfile is enabled in the process
+CPROFILE_PER_THREAD = sys.version_info < (3, 12)
+
+def _default_settings():
+    return {'sample_rate': env.PROFILE_SAMPLE_RATE, 'mode': env.PROFILE_MODE}
+
+_current_session = contextvars.ContextVar('profile_session', default=None)
+
+def is_profile_admin(username):
+    """Returns True if the portal user may request profiles and change the sampling settings."""
+    return username in env.PROFILE_ADMINS
+
+def new_profile_id():
+    return uuid.uuid4().hex
+
+def profile_path(profile_id, mode):
+    return os.path.join(env.PROFILE_DIR, f"{profile_id}{PROFILE_MODES[mode]}")
+
+def find_profile(profile_id):
+    """Returns (path, mode) of a stored profile, or (None, None). profile_id must come from new_profile_id()."""
+    if len(profile_id) != 32 or not all(c in '0123456789abcdef' for c in profile_id):
+        return None, None
+    for mode in PROFILE_MODES:
+        path = profile_path(profile_id, mode)
+        if os.path.exists(path):
+            return path, mode
+    return None, None
+
+_settings_lock = threading.Lock()
+_settings = {'stat': 'unread', 'value': None}  # stat is None once read without a file
+
+def get_settings():
+    """
+    Returns the sampling settings shared by all workers: sample_rate (0 to 1) and mode.
+
+    They are kept in PROFILE_SETTINGS_FILE and re-read when it changes (one stat per
+    call); without the file PROFILE_SAMPLE_RATE and PROFILE_MODE apply.
+    """
+    try:
+        st = os.stat(env.PROFILE_SETTINGS_FILE)
+        stat = (st.st_mtime_ns, st.st_size)
+    except FileNotFoundError:
+        stat = None
+    with _settings_lock:
+        if _settings['stat'] != stat:
+            value = _default_settings()
+            if stat is not None:
+                try:
+                    with open(env.PROFILE_SETTINGS_FILE, 'r') as f:
+                        value.update(json.load(f))
+                except (OSError, ValueError) as e:
+                    logger.error("Could not read %s, using the defaults: %s", env.PROFILE_SETTINGS_FILE, e)
+            _settings.update(stat=stat, value=value)
+        return dict(_settings['value'])
+
+def update_settings(sample_rate, mode, updated_by):
+    """
+    Stores new sampling settings; every worker picks them up on its next request.
+
+    Raises:
+        ValueError: If sample_rate is not between 0 and 1 or mode is unknown.
+    """
+    sample_rate = float(sample_rate)
+    if not 0 <= sample_rate <= 1:
+        raise ValueError("sample_rate must be between 0 and 1")
+    if mode not in PROFILE_MODES:
+        raise ValueError(f"mode must be one of {', '.join(PROFILE_MODES)}")
+    settings = {'sample_rate': sample_rate, 'mode': mode, 'updated_by': updated_by,
+                'updated_at': datetime.now().isoformat(timespec='seconds')}
+    os.makedirs(os.path.dirname(env.PROFILE_SETTINGS_FILE) or '.', exist_ok=True)
+    tmp_path = f"{env.PROFILE_SETTINGS_FILE}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(settings, f)
+    os.replace(tmp_path, env.PROFILE_SETTINGS_FILE)
+    logger.info("'%s' set request profiling to %s for %.1f%% of requests", updated_by, mode, sample_rate * 100)
+    return settings
+
+def _prune():
+    """Deletes all but the newest PROFILE_KEEP profiles."""
+    try:
+        entries = [entry for entry in os.scandir(env.PROFILE_DIR) if entry.name.endswith(tuple(PROFILE_MODES.values()))]
+    except FileNotFoundError:
+        return
+    if len(entries) <= env.PROFILE_KEEP:
+        return
+    entries.sort(key=lambda entry: entry.stat().st_mtime, reverse=True)
+    for entry in entries[env.PROFILE_KEEP:]:
+        try:
+            os.remove(entry.path)
+        except FileNotFoundError:
+            pass
+
+class ProfileSession:
+    """Collects the profile of one request across the threads working for it."""
+
+    def __init__(self, mode, label, profile_id=None):
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"Unknown profile mode '{mode}'")
+        if mode == 'cprofile' and not CPROFILE_PER_THREAD:
+            mode = 'sample'
+        self.profile_id = profile_id or new_profile_id()
+        self.mode = mode
+        self.label = label
+        self._lock = threading.Lock()
+        self._finished = False
+        self._started = time.perf_counter()
+        self._profiles = []     # cprofile: finished per-thread profilers
+        self._threads = {}      # sample: thread id -> number of open begin_thread() calls
+        self._names = {}        # sample: thread id -> thread name
+        self._samples = {}      # sample: thread id -> ([stack], [weight])
+        self._frames = {}       # sample: (function, file, line) -> frame index
+        self._stop = threading.Event()
+        self._sampler = None
+        if mode == 'sample':
+            self._sampler = threading.Thread(target=self._sample_loop, name=f'profiler-{self.profile_id[:8]}', daemon=True)
+            self._sampler.start()
+
+    def begin_thread(self):
+        """Starts profiling the calling thread. Pass the returned token to end_thread()."""
+        with self._lock:
+            if self._finished:
+                return None
+            if self.mode == 'sample':
+                thread_id = threading.get_ident()
+                self._threads[thread_id] = self._threads.get(thread_id, 0) + 1
+                self._names.setdefault(thread_id, threading.current_thread().name)
+                return thread_id
+        profiler = cProfile.Profile()
+        profiler.enable()
+        return profiler
+
+    def end_thread(self, token):
+        """Stops profiling the thread that called begin_thread()."""
+        if token is None:
+            return
+        if self.mode == 'sample':
+            with self._lock:
+                self._threads[token] -= 1
+                if not self._threads[token]:
+                    del self._threads[token]
+            return
+        token.disable()
+        with self._lock:
+            self._profiles.append(token)
+
+    @contextmanager
+    def thread(self):
+        token = self.begin_thread()
+        try:
+            yield
+        finally:
+            self.end_thread(token)
+
+    def _sample_loop(self):
+        interval = env.PROFILE_SAMPLE_INTERVAL_MS / 1000
+        last = time.perf_counter()
+        while not self._stop.wait(interval):
+            now = time.perf_counter()
+            frames = sys._current_frames()
+            with self._lock:
+                for thread_id in self._threads:
+                    frame = frames.get(thread_id)
+                    stack = []
+                    while frame is not None:
+                        code = frame.f_code
+                        key = (code.co_name, code.co_filename, code.co_firstlineno)
+                        stack.append(self._frames.setdefault(key, len(self._frames)))
+                        frame = frame.f_back
+                    stack.reverse()
+                    samples, weights = self._samples.setdefault(thread_id, ([], []))
+                    samples.append(stack)
+                    weights.append(now - last)
+            last = now
+
+    def _speedscope(self, duration):
+        frames = [{'name': name, 'file': filename, 'line': line} for (name, filename, line) in self._frames]
+        profiles = []
+        for thread_id, (samples, weights) in self._samples.items():
+            profiles.append({
+                'type': 'sampled',
+                'name': self._names.get(thread_id, str(thread_id)),
+                'unit': 'seconds',
+                'startValue': 0,
+                'endValue': sum(weights),
+                'samples': samples,
+                'weights': weights,
+            })
+        return {
+            '$schema': 'https://www.speedscope.app/file-format-schema.json',
+            'name': f"{self.label} ({duration:.3f}s)",
+            'exporter': 'portal request profiler',
+            'activeProfileIndex': 0,
+            'shared': {'frames': frames},
+            'profiles': profiles,
+        }
+
+    def finish(self):
+        """
+        Stops profiling and writes the profile.
+
+        Threads still inside begin_thread() at this point are left out.
+
+        Returns:
+            str: The path of the profile, or None if nothing was recorded.
+        """
+        duration = time.perf_counter() - self._started
+        with self._lock:
+            if self._finished:
+                return None
+            self._finished = True
+        if self._sampler is not None:
+            self._stop.set()
+            self._sampler.join()
+
+        os.makedirs(env.PROFILE_DIR, exist_ok=True)
+        path = profile_path(self.profile_id, self.mode)
+        with self._lock:
+            if self.mode == 'sample':
+                if not self._samples:
+                    return None
+                with open(path, 'w') as f:
+                    json.dump(self._speedscope(duration), f)
+            else:
+                if not self._profiles:
+                    return None
+                pstats.Stats(*self._profiles).dump_stats(path)
+        _prune()
+        logger.info("Profiled %s (%s, %.3fs): %s", self.label, self.mode, duration, path)
+        return path
+
+def current_session():
+    """Returns the ProfileSession of the current context, or None."""
+    return _current_session.get()
+
+def activate(session):
+    """Makes session the current one, so workers started from this context join it. Returns a reset token."""
+    return _current_session.set(session)
+
+def deactivate(token):
+    _current_session.reset(token)
+
+@contextmanager
+def profile_worker():
+    """Profiles the calling worker thread if its context belongs to a profiled request."""
+    session = _current_session.get()
+    if session is None:
+        yield
+        return
+    with session.thread():
+        yield
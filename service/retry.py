@@ -0,0 +1,103 @@
+"""
+Retry policy for per-host SSH work.
+
+Host tasks called with raise_transient=True raise TransientSSHError for failures
+that are worth another attempt (timeouts, refused/reset connections, SSH protocol
+errors). Authentication failures, host key mismatches and failing remote commands
+are permanent and are returned as normal (False, message) results.
+
+A retry runs the whole host task again. Direct grants and removals probe the host
+again before changing it. Plan applies replay their stored commands without probing,
+so those commands are idempotent (see create_user.plan_user_changes()). A change that
+landed before the failure is therefore not applied twice. Attempts back off
+exponentially with full jitter and stop once the per-host or per-request time budget
+would be exceeded.
+"""
+import time
+import errno
+import random
+import socket
+import logging
+import paramiko
+from utils.env import EnvSettings
+
+from service.known_hosts import UnknownHostKeyError
+
+logger = logging.getLogger(__name__)
+
+env = EnvSettings(
+    SSH_RETRY_ATTEMPTS=(3, int),
+    SSH_RETRY_BASE_DELAY=(0.5, float),
+    SSH_RETRY_MAX_DELAY=(5, float),
+    SSH_HOST_BUDGET_SECONDS=(60, float),
+    SSH_REQUEST_BUDGET_SECONDS=(180, float),
+)
+
+_PERMANENT_ERRORS = (paramiko.AuthenticationException, paramiko.BadHostKeyException, UnknownHostKeyError)
+_TRANSIENT_ERRORS = (socket.timeout, TimeoutError, ConnectionError, EOFError, paramiko.SSHException)
+# Other OSErrors (permissions, missing files, ...) do not go away by trying again
+_TRANSIENT_ERRNOS = (errno.EHOSTUNREACH, errno.ENETUNREACH, errno.ENETDOWN)
+
+class TransientSSHError(Exception):
+    """A host task failed in a way that may succeed on another attempt."""
+
+def is_transient(error):
+    """Returns True if the exception is worth retrying."""
+    if error is None or isinstance(error, _PERMANENT_ERRORS):
+        return False
+    if isinstance(error, _TRANSIENT_ERRORS):
+        return True
+    return isinstance(error, OSError) and error.errno in _TRANSIENT_ERRNOS
+
+def check_transient(error, message, raise_transient):
+    """Raises TransientSSHError(message) if retries are enabled and the error is transient."""
+    if raise_transient and is_transient(error):
+        raise TransientSSHError(message) from error
+
+def backoff_delay(attempt, base_delay=None, max_delay=None):
+    """Full-jitter exponential backoff for the given retry number (1 for the first retry)."""
+    base_delay = env.SSH_RETRY_BASE_DELAY if base_delay is None else base_delay
+    max_delay = env.SSH_RETRY_MAX_DELAY if max_delay is None else max_delay
+    return random.uniform(0, min(max_delay, base_delay * (2 ** (attempt - 1))))
+
+def request_deadline():
+    """Returns the monotonic deadline for a request starting now."""
+    return time.monotonic() + env.SSH_REQUEST_BUDGET_SECONDS
+
+def run_with_retry(attempt_task, ip, deadline, max_attempts=None):
+    """
+    Runs attempt_task() until it returns, fails permanently, or runs out of attempts or time.
+
+    Args:
+        attempt_task: Callable taking the remaining budget in seconds and returning
+            (success, message). Raises TransientSSHError to ask for a retry.
+        ip: The target host, for logging.
+        deadline: Monotonic request deadline; the per-host budget is capped by it.
+        max_attempts: Maximum number of attempts, SSH_RETRY_ATTEMPTS by default.
+
+    Returns:
+        A tuple: (success, message, attempts).
+    """
+    if max_attempts is None:
+        max_attempts = env.SSH_RETRY_ATTEMPTS
+    host_deadline = min(deadline, time.monotonic() + env.SSH_HOST_BUDGET_SECONDS)
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            success, message = attempt_task(host_deadline - time.monotonic())
+            return success, message, attempt
+        except TransientSSHError as e:
+            message = str(e)
+
+        if attempt >= max_attempts:
+            logger.error("Giving up on %s after %s attempts: %s", ip, attempt, message)
+            return False, f"{message} (gave up after {attempt} attempts)", attempt
+
+        delay = backoff_delay(attempt)
+        if time.monotonic() + delay >= host_deadline:
+            logger.error("Time budget exhausted for %s after %s attempts: %s", ip, attempt, message)
+            return False, f"{message} (time budget exhausted after {attempt} attempts)", attempt
+
+        logger.warning("Transient failure on %s (attempt %s/%s), retrying in %.2fs: %s", ip, attempt, max_attempts, delay, message)
+        time.sleep(delay)
@@ -0,0 +1,238 @@
+"""
+Key rotation: replace one authorized key of a user with another on all their hosts.
+
+Each host gets a single remote command that rewrites authorized_keys into a temp file
+next to it (old key dropped, new key appended) and renames it over the original, so
+the swap is atomic and the account, home directory and groups are left alone.
+
+Rotations run in parallel and are stored as jobs for ROTATION_TTL_SECONDS, so the
+hosts that failed can be retried later with resume_rotation().
+"""
+import shlex
+import logging
+import paramiko
+from service.csv_service import get_all_servers_for_user
+from service.ssh_service import SSHClient
+from service.fanout import run_on_hosts
+from service.host_state_cache import invalidate
+from service.key_index import record_key, remove_account_keys
+from service.job_store import save_job, load_job, claim_job, purge_expired_jobs
+from service.retry import check_transient, TransientSSHError
+from utils.env import EnvSettings
+from utils.ssh_keys import parse_public_key
+
+logger = logging.getLogger(__name__)
+
+env = EnvSettings(
+    ROTATION_TTL_SECONDS=(86400, int),
+)
+ROTATION_KIND = 'rotations'
+
+# Exit statuses of the remote rotation script
+_EXIT_NO_AUTH_KEYS = 3
+_EXIT_ALREADY_ROTATED = 4
+_EXIT_OLD_KEY_MISSING = 5
+
+class RotationError(Exception):
+    """Raised when a rotation cannot be started or resumed. status_code is the HTTP status to report."""
+
+    def __init__(self, message, status_code):
+        super().__init__(message)
+        self.status_code = status_code
+
+def build_rotation_command(username, new_pub_key, old_key=None, old_fingerprint=None):
+    """
+    Returns the shell command that swaps the key in one write.
+
+    The old key is matched on its "type base64" part, or, when only a fingerprint is
+    known, by fingerprinting each line with ssh-keygen on the host. Lines with
+    options in front of the key are matched too.
+    """
+    auth_keys = f"/home/{username}/.ssh/authorized_keys"
+    if old_key is not None:
+        match_old = 'case "$line" in *"$old"*) true ;; *) false ;; esac'
+        old = old_key
+    else:
+        match_old = '[ "$(printf \'%s\\n\' "$line" | ssh-keygen -lf - 2>/dev/null | awk \'{print $2}\')" = "$old" ]'
+        old = old_fingerprint
+    new_key = parse_public_key(new_pub_key)
+    script = f"""
+f={shlex.quote(auth_keys)}
+old={shlex.quote(old)}
+new={shlex.quote(new_key.normalized)}
+new_line={shlex.quote(new_pub_key.strip())}
+[ -f "$f" ] || exit {_EXIT_NO_AUTH_KEYS}
+tmp=$(mktemp "$f.rotate.XXXXXX") || exit 1
+found=0
+have_new=0
+while IFS= read -r line || [ -n "$line" ]; do
+    if {match_old}; then found=1; continue; fi
+    case "$line" in *"$new"*) have_new=1 ;; esac
+    printf '%s\\n' "$line" >> "$tmp"
+done < "$f"
+if [ "$found" = 0 ]; then
+    rm -f "$tmp"
+    [ "$have_new" = 1 ] && exit {_EXIT_ALREADY_ROTATED}
+    exit {_EXIT_OLD_KEY_MISSING}
+fi
+[ "$have_new" = 1 ] || printf '%s\\n' "$new_line" >> "$tmp"
+chown {shlex.quote(f'{username}:{username}')} "$tmp" && chmod 600 "$tmp" && mv -f "$tmp" "$f" || {{ rm -f "$tmp"; exit 1; }}
+"""
+    return f"sudo sh -c {shlex.quote(script)}"
+
+def rotate_key_on_server(ip, username, new_pub_key, old_key=None, old_fingerprint=None,
+                         action_by_user="System", raise_transient=False):
+    """
+    Replaces a user's old key with new_pub_key in authorized_keys on one host.
+
+    Hosts where the old key is already gone and the new one present count as rotated,
+    so a rotation can be re-run safely.
+
+    Args:
+        old_key: The old key in "type base64" form, or None if only old_fingerprint is known.
+        old_fingerprint: SHA256 fingerprint of the old key.
+        raise_transient: Raise TransientSSHError instead of returning a failure when
+            the error is worth retrying (see service/retry.py).
+
+    Returns:
+        A tuple: (success, message).
+    """
+    client = SSHClient(ip)
+    try:
+        success, message = client.connect()
+        if not success:
+            check_transient(client.last_error, message, raise_transient)
+            return success, message
+
+        logger.debug("Rotating key of user '%s' on %s (Action by: %s)", username, ip, action_by_user)
+        invalidate(ip, username)
+        stdin, stdout, stderr = client.exec_command(build_rotation_command(username, new_pub_key, old_key, old_fingerprint))
+        exit_status = stdout.channel.recv_exit_status()
+        invalidate(ip, username)
+
+        if exit_status in (0, _EXIT_ALREADY_ROTATED):
+            if old_fingerprint:
+                remove_account_keys(username, ip, old_fingerprint)
+            record_key(new_pub_key, username, ip)
+            if exit_status == 0:
+                message = f"Key of user '{username}' rotated on {ip}."
+            else:
+                message = f"Key of user '{username}' was already rotated on {ip}."
+            logger.info("%s (Action by: %s)", message, action_by_user)
+            return True, message
+        if exit_status == _EXIT_NO_AUTH_KEYS:
+            message = f"User '{username}' has no authorized_keys on {ip}."
+        elif exit_status == _EXIT_OLD_KEY_MISSING:
+            message = f"Old key of user '{username}' not found on {ip}, nothing changed."
+        else:
+            error_message = stderr.read().decode('utf-8').strip()
+            message = f"Error rotating key of user '{username}' on {ip}: {error_message or f'exit status {exit_status}'}"
+        logger.error("%s (Action by: %s)", message, action_by_user)
+        return False, message
+
+    except TransientSSHError:
+        raise
+    except paramiko.SSHException as e:
+        logger.exception("SSH connection error for %s (User: %s, ActionBy: %s): %s", ip, username, action_by_user, e)
+        message = f"SSH error connecting to {ip}: {e}"
+        check_transient(e, message, raise_transient)
+        return False, message
+    except Exception as e:
+        logger.exception("General error rotating key of %s on %s (ActionBy: %s): %s", username, ip, action_by_user, e)
+        message = f"General error rotating key on {ip}: {e}"
+        check_transient(e, message, raise_transient)
+        return False, message
+    finally:
+        client.close()
+
+def _run_rotation(rotation, ips, action_by_user):
+    old_key = rotation['old_key']
+    results = run_on_hosts(
+        lambda ip: rotate_key_on_server(ip, rotation['username'], rotation['new_pub_key'], old_key,
+                                        rotation['old_fingerprint'], action_by_user, raise_transient=True),
+        ips, action_by_user
+    )
+    for ip, (success, message, attempts) in results.items():
+        rotation['hosts'][ip] = {'success': success, 'message': message, 'attempts': attempts}
+    return results
+
+def start_rotation(username, new_pub_key, action_by_user, old_pub_key=None, old_fingerprint=None):
+    """
+    Rotates a user's key on every host the user is recorded on.
+
+    Give the old key either as a key line (old_pub_key) or as its fingerprint.
+
+    Returns:
+        A tuple: (rotation_id, results) with results as ip -> (success, message, attempts).
+
+    Raises:
+        RotationError: If the user has no recorded hosts or the keys are the same.
+    """
+    old_key = None
+    if old_pub_key:
+        parsed = parse_public_key(old_pub_key)
+        old_key, old_fingerprint = parsed.normalized, parsed.fingerprint
+    if old_fingerprint == parse_public_key(new_pub_key).fingerprint:
+        raise RotationError("The new key is the same as the old key.", 400)
+
+    ips = sorted(get_all_servers_for_user(username))
+    if not ips:
+        raise RotationError(f"No servers recorded for user '{username}'.", 404)
+
+    rotation = {
+        'username': username,
+        'new_pub_key': new_pub_key,
+        'old_key': old_key,
+        'old_fingerprint': old_fingerprint,
+        'created_by': action_by_user,
+        'hosts': {},
+    }
+    logger.info("Rotating key %s of user '%s' on %s hosts (by '%s').", old_fingerprint, username, len(ips), action_by_user)
+    results = _run_rotation(rotation, ips, action_by_user)
+    purge_expired_jobs(ROTATION_KIND)
+    rotation_id = save_job(ROTATION_KIND, rotation, ttl=env.ROTATION_TTL_SECONDS)
+    return rotation_id, results
+
+def get_rotation(rotation_id):
+    """Returns a stored rotation, or None if it does not exist or has expired."""
+    return load_job(ROTATION_KIND, rotation_id)
+
+def summarize_rotation(rotation_id, rotation):
+    """Returns the client-facing view of a rotation."""
+    failed = [ip for ip, host in rotation['hosts'].items() if not host['success']]
+    return {
+        'rotation_id': rotation_id,
+        'username': rotation['username'],
+        'old_fingerprint': rotation['old_fingerprint'],
+        'new_fingerprint': parse_public_key(rotation['new_pub_key']).fingerprint,
+        'hosts': rotation['hosts'],
+        'failed_hosts': sorted(failed),
+    }
+
+def resume_rotation(rotation_id, action_by_user):
+    """
+    Retries a stored rotation on the hosts that failed.
+
+    Returns:
+        dict: ip -> (success, message, attempts) for the retried hosts.
+
+    Raises:
+        RotationError: If the rotation is unknown, expired, being resumed elsewhere
+            or belongs to another operator.
+    """
+    rotation = load_job(ROTATION_KIND, rotation_id)
+    if rotation is None:
+        raise RotationError(f"Rotation '{rotation_id}' not found or expired.", 404)
+    if rotation['created_by'] != action_by_user:
+        raise RotationError(f"Rotation '{rotation_id}' was started by another operator.", 403)
+    # Take the job while the hosts run, so two resumes cannot race
+    rotation = claim_job(ROTATION_KIND, rotation_id)
+    if rotation is None:
+        raise RotationError(f"Rotation '{rotation_id}' is already being resumed.", 409)
+
+    try:
+        ips = sorted(ip for ip, host in rotation['hosts'].items() if not host['success'])
+        logger.info("Resuming rotation %s for user '%s' on %s hosts (by '%s').", rotation_id, rotation['username'], len(ips), action_by_user)
+        return _run_rotation(rotation, ips, action_by_user)
+    finally:
+        save_job(ROTATION_KIND, rotation, job_id=rotation_id)
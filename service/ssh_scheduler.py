@@ -0,0 +1,180 @@
+"""
+Process-wide admission control for outbound SSH sessions.
+
+Every SSH operation takes a slot from the scheduler before connecting. Slots are
+capped globally (SSH_MAX_CONCURRENT) and per subnet (SSH_MAX_PER_SUBNET, subnets of
+size /SSH_SUBNET_PREFIX), which keeps us under the bastion's and hosts' MaxStartups.
+Waiting requests are queued per operator and served round-robin, so one operator's
+huge grant cannot starve another operator's small interactive request.
+"""
+import time
+import ipaddress
+import threading
+import logging
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from utils.env import EnvSettings
+
+logger = logging.getLogger(__name__)
+
+env = EnvSettings(
+    SSH_MAX_CONCURRENT=(32, int),
+    SSH_MAX_PER_SUBNET=(8, int),
+    SSH_SUBNET_PREFIX=(24, int),
+)
+
+class _Ticket:
+    __slots__ = ('operator', 'ip', 'subnet', 'enqueued_at', 'granted')
+
+    def __init__(self, operator, ip, subnet):
+        self.operator = operator
+        self.ip = ip
+        self.subnet = subnet
+        self.enqueued_at = time.monotonic()
+        self.granted = threading.Event()
+
+class _WaitStats:
+    __slots__ = ('count', 'total', 'max', 'last')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.last = 0.0
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.last = seconds
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'avg_ms': round(self.total / self.count * 1000, 2) if self.count else 0.0,
+            'max_ms': round(self.max * 1000, 2),
+            'last_ms': round(self.last * 1000, 2),
+        }
+
+class SSHScheduler:
+    def __init__(self, max_concurrent=None, max_per_subnet=None, subnet_prefix=None):
+        self.max_concurrent = env.SSH_MAX_CONCURRENT if max_concurrent is None else max_concurrent
+        self.max_per_subnet = env.SSH_MAX_PER_SUBNET if max_per_subnet is None else max_per_subnet
+        self.subnet_prefix = env.SSH_SUBNET_PREFIX if subnet_prefix is None else subnet_prefix
+        self._lock = threading.Lock()
+        self._active = 0
+        self._active_by_subnet = {}
+        # operator -> deque of waiting tickets; order of keys is the round-robin order
+        self._queues = OrderedDict()
+        self._wait_stats = _WaitStats()
+        self._wait_stats_by_operator = {}
+
+    def _subnet_of(self, ip):
+        try:
+            return str(ipaddress.ip_network(f"{ip}/{self.subnet_prefix}", strict=False))
+        except ValueError:
+            return ip
+
+    @contextmanager
+    def slot(self, operator, ip, timeout=None):
+        """
+        Holds one SSH slot for `ip` on behalf of `operator` for the duration of the block.
+
+        Args:
+            operator: The portal user the work is done for (current_user.id).
+            ip: The target host, used for the per-subnet cap.
+            timeout: Optional maximum seconds to wait in the queue.
+
+        Raises:
+            TimeoutError: If no slot was granted within `timeout`.
+        """
+        ticket = self._acquire(operator, ip, timeout)
+        try:
+            yield
+        finally:
+            self._release(ticket)
+
+    def _acquire(self, operator, ip, timeout):
+        ticket = _Ticket(operator, ip, self._subnet_of(ip))
+        with self._lock:
+            self._queues.setdefault(operator, deque()).append(ticket)
+            self._dispatch()
+
+        if not ticket.granted.wait(timeout):
+            with self._lock:
+                if not ticket.granted.is_set():
+                    queue = self._queues.get(operator)
+                    if queue is not None:
+                        queue.remove(ticket)
+                        if not queue:
+                            del self._queues[operator]
+                    raise TimeoutError(f"Timed out after {timeout}s waiting for an SSH slot for {ip}")
+
+        waited = time.monotonic() - ticket.enqueued_at
+        with self._lock:
+            self._wait_stats.add(waited)
+            self._wait_stats_by_operator.setdefault(operator, _WaitStats()).add(waited)
+        if waited > 1:
+            logger.info("SSH operation for %s by '%s' waited %.2fs for a slot.", ip, operator, waited)
+        return ticket
+
+    def _release(self, ticket):
+        with self._lock:
+            self._active -= 1
+            remaining = self._active_by_subnet[ticket.subnet] - 1
+            if remaining:
+                self._active_by_subnet[ticket.subnet] = remaining
+            else:
+                del self._active_by_subnet[ticket.subnet]
+            self._dispatch()
+
+    def _dispatch(self):
+        """Grants free slots round-robin across operators. Caller must hold self._lock."""
+        while self._active < self.max_concurrent and self._queues:
+            granted = False
+            for operator in list(self._queues):
+                queue = self._queues[operator]
+                # First ticket of this operator whose subnet still has room
+                ticket = next((t for t in queue if self._active_by_subnet.get(t.subnet, 0) < self.max_per_subnet), None)
+                if ticket is None:
+                    continue
+                queue.remove(ticket)
+                if queue:
+                    self._queues.move_to_end(operator)
+                else:
+                    del self._queues[operator]
+                self._active += 1
+                self._active_by_subnet[ticket.subnet] = self._active_by_subnet.get(ticket.subnet, 0) + 1
+                ticket.granted.set()
+                granted = True
+                break
+            if not granted:
+                # Everything still queued is blocked by per-subnet limits
+                return
+
+    def stats(self):
+        """Returns a snapshot of current load, queue depth and wait times."""
+        with self._lock:
+            return {
+                'max_concurrent': self.max_concurrent,
+                'max_per_subnet': self.max_per_subnet,
+                'subnet_prefix': self.subnet_prefix,
+                'active': self._active,
+                'active_by_subnet': dict(self._active_by_subnet),
+                'queued': sum(len(queue) for queue in self._queues.values()),
+                'queued_by_operator': {operator: len(queue) for operator, queue in self._queues.items()},
+                'wait': self._wait_stats.as_dict(),
+                'wait_by_operator': {operator: stats.as_dict() for operator, stats in self._wait_stats_by_operator.items()},
+            }
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+def get_scheduler():
+    """Returns the process-wide SSH scheduler, creating it on first use."""
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = SSHScheduler()
+    return _scheduler
@@ -1,7 +1,6 @@
 import io
 import paramiko
 import os
-from dotenv import load_dotenv
 import logging
 import socket
 
@@ -10,79 +9,211 @@ import socket
 # sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from service.crypt_service import decrypt_file
-load_dotenv()
+from service.known_hosts import get_known_hosts, RegistryHostKeyPolicy
+from service.bastion import get_bastion_for, get_tunnel
+from service.transport_profiles import get_profile, get_profile_name_for, open_socket, connect_options
 
 logger = logging.getLogger(__name__)
 
+def load_private_key(pem_file_path, crypt_password):
+    """
+    Decrypts the encrypted PEM file and loads it as a paramiko RSA key.
+
+    Args:
+        pem_file_path: Path to the PEM file encrypted with crypt_service.encrypt_file().
+        crypt_password: Password used to encrypt the PEM file.
+
+    Returns:
+        paramiko.RSAKey: The unlocked private key.
+
+    Raises:
+        ValueError: If the decrypted data is empty or not valid UTF-8 PEM text.
+    """
+    private_key_bytes = decrypt_file(pem_file_path, crypt_password)
+    if not private_key_bytes:
+        raise ValueError(f"Decryption of {pem_file_path} returned empty data.")
+
+    try:
+        decrypted_key_string = private_key_bytes.decode('utf-8')
+    except UnicodeDecodeError:
+        logger.error("Failed to decode decrypted key from %s as UTF-8. Is it a valid PEM key?", pem_file_path)
+        raise ValueError(f"Decrypted key from {pem_file_path} is not valid UTF-8 text.")
+
+    key_file_obj = io.StringIO(decrypted_key_string)
+    return paramiko.RSAKey(file_obj=key_file_obj)
+
 class SSHClient(paramiko.SSHClient):
-    def __init__(self, ip, *args, **kwargs):
+    def __init__(self, ip, *args, port=22, use_bastion=True, profile=None, **kwargs):
         super().__init__(*args, **kwargs)
-        self.set_missing_host_key_policy(paramiko.WarningPolicy())
+        known_hosts = get_known_hosts()
+        self.set_missing_host_key_policy(RegistryHostKeyPolicy(known_hosts))
         self._admin_username = os.getenv('ADMIN_USERNAME', "ubuntu")
         self._admin_password = os.getenv('ADMIN_PASSWORD', None)
         self._pem_file_path = os.getenv('PEM_FILE_PATH')
         self._crypt_password = os.getenv('CRYPT_PASSWORD', None)
+        self._key_agent_socket = os.getenv('KEY_AGENT_SOCKET')
         self.ip = ip
-        self.set_missing_host_key_policy(paramiko.WarningPolicy())
+        self.port = port
+        # The exception behind the last failed connect(), used to decide whether to retry
+        self.last_error = None
+        # Hosts of a group behind a bastion are reached through its shared tunnel (service/bastion.py)
+        bastion = get_bastion_for(ip) if use_bastion else None
+        self._tunnel = get_tunnel(*bastion) if bastion else None
+        self._tunnel_channels = []
+        self._pending_sock = None
+        # Timeouts, algorithms and socket options of the host's group (service/transport_profiles.py)
+        self.profile_name = profile or get_profile_name_for(ip)
+        self._profile = get_profile(self.profile_name)
+        self._connect_options = connect_options(self._profile)
+        # Only this host's keys: a known host is verified before auth, a changed key fails fast
+        known_hosts.seed(self, ip)
+
+    def _open_sock(self):
+        channel = self._tunnel.open_channel(self.ip, self.port)
+        self._tunnel_channels.append(channel)
+        return channel
+
+    def _take_sock(self):
+        """Returns a fresh channel through the bastion, or a direct TCP connection, to use as socket."""
+        if self._tunnel is None:
+            return open_socket(self.ip, self.port, self._profile)
+        sock, self._pending_sock = self._pending_sock, None
+        return sock if sock is not None else self._open_sock()
+
+    def close(self):
+        super().close()
+        for channel in self._tunnel_channels:
+            channel.close()
+            self._tunnel.release()
+        self._tunnel_channels = []
 
     def connect(self) -> tuple[bool, str]:
+        self.last_error = None
+        transport = self.get_transport()
+        if transport is not None and transport.is_active():
+            # Already connected, e.g. a warm connection (service/warm_pool.py)
+            return True, f"Connected to {self.ip} as {self._admin_username}"
+        if self._tunnel is not None:
+            try:
+                # Fail here, not as an authentication error, when the bastion is unreachable
+                self._pending_sock = self._open_sock()
+            except Exception as e:
+                self.last_error = e
+                message = f"Unable to connect to {self.ip} through bastion {self._tunnel.host}: {e}"
+                logger.warning(message)
+                return False, message
         if self._admin_password:
             try:
-                logger.info(f"Attempting password authentication to {self.ip} as {self._admin_username}")
-                super().connect(self.ip, username=self._admin_username, password=self._admin_password, timeout=5)
+                logger.info("Attempting password authentication to %s as %s", self.ip, self._admin_username)
+                super().connect(self.ip, self.port, username=self._admin_username, password=self._admin_password,
+                                sock=self._take_sock(), **self._connect_options)
                 return True, f"Connected to {self.ip} as {self._admin_username}"
-            except paramiko.AuthenticationException:
-                logger.warning(f"Password authentication failed for {self.ip}. Trying key-based authentication...")
+            except paramiko.BadHostKeyException as e:
+                self.last_error = e
+                message = f"Host key verification failed for {self.ip}: {e}"
+                logger.error(message)
+                return False, message
+            except paramiko.AuthenticationException as e:
+                self.last_error = e
+                logger.warning("Password authentication failed for %s. Trying key-based authentication...", self.ip)
             except TimeoutError as e:
+                self.last_error = e
                 message = f"Unable to connect to {self.ip}: {e}"
                 logger.warning(message)
                 return False, message
             except (socket.error, Exception) as e:
-                logger.exception(f"Error during password authentication for {self.ip}: {e}")
+                self.last_error = e
+                logger.exception("Error during password authentication for %s: %s", self.ip, e)
                 return False, str(e)
-        
-        if self._pem_file_path and os.path.exists(self._pem_file_path):
-            try:
-                logger.info(f"Attempting key-based authentication to {self.ip} as {self._admin_username} using {self._pem_file_path}")
 
-                private_key_bytes = decrypt_file(self._pem_file_path, self._crypt_password)
-                if not private_key_bytes:
-                    message = f"Decryption of {self._encrypted_pem_path} returned empty data."
-                    logger.error(message)
-                    return False, message
+        if self._key_agent_socket:
+            return self._connect_with_agent()
 
+        if self._pem_file_path and os.path.exists(self._pem_file_path):
+            try:
+                logger.info("Attempting key-based authentication to %s as %s using %s", self.ip, self._admin_username, self._pem_file_path)
                 try:
-                    decrypted_key_string = private_key_bytes.decode('utf-8')
-                except UnicodeDecodeError:
-                    logger.error(f"Failed to decode decrypted key from {self._encrypted_pem_path} as UTF-8. Is it a valid PEM key?")
-                    return False, f"Decrypted key from {self._encrypted_pem_path} is not valid UTF-8 text."
-                
-                key_file_obj = io.StringIO(decrypted_key_string)
-                private_key = paramiko.RSAKey(file_obj=key_file_obj)
-
-                super().connect(self.ip, username=self._admin_username, pkey=private_key, timeout=5)
+                    private_key = load_private_key(self._pem_file_path, self._crypt_password)
+                except ValueError as e:
+                    logger.error(str(e))
+                    return False, str(e)
+
+                super().connect(self.ip, self.port, username=self._admin_username, pkey=private_key,
+                                sock=self._take_sock(), **self._connect_options)
                 return True, f"Connected to {self.ip} as {self._admin_username}"
-            except paramiko.AuthenticationException:
+            except paramiko.BadHostKeyException as e:
+                self.last_error = e
+                message = f"Host key verification failed for {self.ip}: {e}"
+                logger.error(message)
+                return False, message
+            except paramiko.AuthenticationException as e:
+                self.last_error = e
                 message = f"Key-based/Password authentication failed for {self.ip}."
                 logger.error(message)
                 return False, message
             except TimeoutError as e:
+                self.last_error = e
                 message = f"Unable to connect to {self.ip}: {e}"
                 logger.warning(message)
                 return False, message
             except (socket.error, Exception) as e:
-                logger.exception(f"Error during key-based authentication for {self.ip}: {e}")
+                self.last_error = e
+                logger.exception("Error during key-based authentication for %s: %s", self.ip, e)
                 return False, str(e)
-            
+
         elif self._pem_file_path:
-            logger.error(f"PEM file not found at specified path {self._pem_file_path}")
+            logger.error("PEM file not found at specified path %s", self._pem_file_path)
             return False, "PEM file not found"
         else:
-            logger.error(f"Neither the admin password nor the PEM file was found")
+            logger.error("Neither the admin password nor the PEM file was found")
             return False, "Authentication details not provided"
 
+    def _connect_with_agent(self) -> tuple[bool, str]:
+        """Authenticates with the key held by the local key agent (see service/key_agent.py)."""
+        # Imported here to avoid a circular import: key_agent reuses load_private_key().
+        from service.key_agent import KeyAgentClient
+
+        agent = None
+        try:
+            logger.info("Attempting agent-based authentication to %s as %s using %s", self.ip, self._admin_username, self._key_agent_socket)
+            agent = KeyAgentClient(self._key_agent_socket)
+            keys = agent.get_keys()
+            if not keys:
+                message = f"Key agent at {self._key_agent_socket} holds no keys."
+                logger.error(message)
+                return False, message
+
+            super().connect(self.ip, self.port, username=self._admin_username, pkey=keys[0],
+                            allow_agent=False, look_for_keys=False, sock=self._take_sock(), **self._connect_options)
+            return True, f"Connected to {self.ip} as {self._admin_username}"
+        except paramiko.BadHostKeyException as e:
+            self.last_error = e
+            message = f"Host key verification failed for {self.ip}: {e}"
+            logger.error(message)
+            return False, message
+        except paramiko.AuthenticationException as e:
+            self.last_error = e
+            message = f"Agent-based authentication failed for {self.ip}."
+            logger.error(message)
+            return False, message
+        except TimeoutError as e:
+            self.last_error = e
+            message = f"Unable to connect to {self.ip}: {e}"
+            logger.warning(message)
+            return False, message
+        except (socket.error, Exception) as e:
+            self.last_error = e
+            logger.exception("Error during agent-based authentication for %s: %s", self.ip, e)
+            return False, str(e)
+        finally:
+            # Signing only happens during the handshake, the agent connection is not needed afterwards.
+            if agent is not None:
+                agent.close()
+
 
 if __name__ == "__main__":
+    from utils.env import load_env
+    load_env()
     # Example usage
     ssh_client = SSHClient("127.0.0.1")
     success, message = ssh_client.connect()
@@ -102,4 +233,3 @@ if __name__ == "__main__":
 
 
 
-    
\ No newline at end of file
@@ -0,0 +1,122 @@
+"""
+Per-group SSH transport tuning.
+
+Profiles are defined in config/transport_profiles.py. TRANSPORT_PROFILES_FILE assigns
+them to groups, one "<group> <profile>" per line; hosts in no listed group use
+SSH_TRANSPORT_PROFILE. SSHClient applies the selected profile to its socket (TCP
+options), to paramiko's connect() (timeouts, compression) and to the Transport it
+creates (algorithm order, window sizes, keepalive).
+"""
+import socket
+import logging
+import threading
+import paramiko
+from config.transport_profiles import TRANSPORT_PROFILES
+from utils.env import EnvSettings
+from utils.group_ip_provider import get_ips_from_group, group_files_stat
+
+logger = logging.getLogger(__name__)
+
+env = EnvSettings(
+    TRANSPORT_PROFILES_FILE=('assets/transport_profiles.txt', str),
+    SSH_TRANSPORT_PROFILE=('default', str),
+)
+GROUPS_DIR = "assets/groups"
+
+def get_profile(name):
+    """
+    Returns the profile settings of the given name.
+
+    Raises:
+        KeyError: If there is no such profile.
+    """
+    try:
+        return TRANSPORT_PROFILES[name]
+    except KeyError:
+        raise KeyError(f"Unknown transport profile '{name}', expected one of {', '.join(TRANSPORT_PROFILES)}") from None
+
+def _read_profiles_file():
+    """Returns {group: profile name} from TRANSPORT_PROFILES_FILE."""
+    profiles = {}
+    try:
+        with open(env.TRANSPORT_PROFILES_FILE, 'r') as f:
+            for line_number, line in enumerate(f, 1):
+                line = line.split('#', 1)[0].strip()
+                if not line:
+                    continue
+                parts = line.split()
+                if len(parts) != 2 or parts[1] not in TRANSPORT_PROFILES:
+                    logger.error("Ignoring line %s of %s: expected '<group> <profile>' with one of %s", line_number, env.TRANSPORT_PROFILES_FILE, ', '.join(TRANSPORT_PROFILES))
+                    continue
+                profiles[parts[0]] = parts[1]
+    except FileNotFoundError:
+        pass
+    return profiles
+
+_selection_lock = threading.Lock()
+_selection = {'stat': None, 'by_ip': {}}
+
+def get_profile_name_for(ip):
+    """
+    Returns the name of the transport profile to use for ip.
+
+    A host in several groups with different profiles uses the first group in
+    alphabetical order.
+    """
+    stat = group_files_stat([env.TRANSPORT_PROFILES_FILE], GROUPS_DIR)
+    with _selection_lock:
+        if _selection['stat'] != stat:
+            by_ip = {}
+            for group, name in sorted(_read_profiles_file().items()):
+                for group_ip in get_ips_from_group(group, GROUPS_DIR):
+                    if by_ip.setdefault(group_ip, name) != name:
+                        logger.warning("%s is in several groups with different transport profiles, using %s", group_ip, by_ip[group_ip])
+            _selection.update(stat=stat, by_ip=by_ip)
+        name = _selection['by_ip'].get(ip, env.SSH_TRANSPORT_PROFILE)
+    if name not in TRANSPORT_PROFILES:
+        logger.error("Unknown SSH_TRANSPORT_PROFILE '%s', using 'default'", name)
+        return 'default'
+    return name
+
+def open_socket(ip, port, profile):
+    """Opens the TCP connection to ip:port with the profile's socket options."""
+    sock = socket.create_connection((ip, port), timeout=profile.get('connect_timeout'))
+    if profile.get('tcp_nodelay'):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    if profile.get('tcp_keepalive'):
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    return sock
+
+def _preferred_first(preferred, available):
+    """Returns available reordered with the supported entries of preferred first."""
+    first = [name for name in preferred if name in available]
+    return tuple(first + [name for name in available if name not in first])
+
+def transport_factory(profile):
+    """Returns a paramiko transport_factory applying the profile's transport settings."""
+    def factory(sock, disabled_algorithms=None):
+        kwargs = {'disabled_algorithms': disabled_algorithms}
+        if 'window_size' in profile:
+            kwargs['default_window_size'] = profile['window_size']
+        if 'max_packet_size' in profile:
+            kwargs['default_max_packet_size'] = profile['max_packet_size']
+        transport = paramiko.Transport(sock, **kwargs)
+        options = transport.get_security_options()
+        for setting in ('ciphers', 'kex', 'digests'):
+            if profile.get(setting):
+                setattr(options, setting, _preferred_first(profile[setting], getattr(options, setting)))
+        if profile.get('keepalive_interval'):
+            transport.set_keepalive(profile['keepalive_interval'])
+        return transport
+    return factory
+
+def connect_options(profile):
+    """Returns the paramiko SSHClient.connect() keyword arguments of a profile."""
+    return {
+        'timeout': profile.get('connect_timeout'),
+        'banner_timeout': profile.get('banner_timeout'),
+        'auth_timeout': profile.get('auth_timeout'),
+        'channel_timeout': profile.get('channel_timeout'),
+        'compress': profile.get('compress', False),
+        'transport_factory': transport_factory(profile),
+    }
@@ -0,0 +1,174 @@
+"""
+Speculative SSH connections for the give access form.
+
+While an operator is still filling in the form, the selected groups and IPs are
+sent to the warm-up API, which connects and authenticates to those hosts in the
+background. The grant (or its plan) then picks up the open connection with
+checkout_client() instead of doing the handshake itself.
+
+Warm connections are per process, used at most once, and closed when unused for
+SSH_WARMUP_TTL_SECONDS. At most SSH_WARMUP_MAX_CONNECTIONS are open or being
+opened at a time, and each handshake takes a regular SSH scheduler slot, so
+warm-ups cannot crowd out real work. With several gunicorn workers the warm-up
+request and the grant are usually served by different workers, so
+gunicorn.conf.py sets SSH_WARMUP_MAX_CONNECTIONS to 0 (off) there unless it is
+configured explicitly.
+"""
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from service.ssh_scheduler import get_scheduler
+from service.ssh_service import SSHClient
+from utils.env import EnvSettings
+
+logger = logging.getLogger(__name__)
+
+env = EnvSettings(
+    SSH_WARMUP_TTL_SECONDS=(60, float),
+    SSH_WARMUP_MAX_CONNECTIONS=(64, int),
+    SSH_WARMUP_WORKERS=(8, int),
+)
+# Warm-ups give up rather than queue behind real work for long
+SSH_WARMUP_SLOT_WAIT_SECONDS = 2
+
+def _is_live(client):
+    transport = client.get_transport()
+    return transport is not None and transport.is_active()
+
+class WarmPool:
+    def __init__(self, ttl=None, max_connections=None):
+        self.ttl = env.SSH_WARMUP_TTL_SECONDS if ttl is None else ttl
+        self.max_connections = env.SSH_WARMUP_MAX_CONNECTIONS if max_connections is None else max_connections
+        self._lock = threading.Lock()
+        self._clients = {}      # ip -> (client, monotonic expiry)
+        self._connecting = set()
+        self._executor = None
+        self._reaper = None
+        self._hits = 0
+        self._misses = 0
+
+    def warm_up(self, ips, operator):
+        """
+        Starts connecting to the hosts that have no warm connection yet.
+
+        Returns:
+            dict: started, already_warm and skipped (over the cap) host counts.
+        """
+        counts = {'started': 0, 'already_warm': 0, 'skipped': 0}
+        if self.max_connections <= 0:
+            counts['skipped'] = len(ips)
+            return counts
+        self._reap()
+        expires_at = time.monotonic() + self.ttl
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=env.SSH_WARMUP_WORKERS, thread_name_prefix='ssh-warmup')
+            for ip in ips:
+                if ip in self._clients:
+                    # Still wanted, keep it for another TTL
+                    self._clients[ip] = (self._clients[ip][0], expires_at)
+                    counts['already_warm'] += 1
+                elif ip in self._connecting:
+                    counts['already_warm'] += 1
+                elif len(self._clients) + len(self._connecting) >= self.max_connections:
+                    counts['skipped'] += 1
+                else:
+                    self._connecting.add(ip)
+                    self._executor.submit(self._connect, ip, operator)
+                    counts['started'] += 1
+        if counts['started']:
+            logger.info("Warming up SSH connections to %s hosts for '%s' (%s already warm, %s over the cap)", counts['started'], operator, counts['already_warm'], counts['skipped'])
+        return counts
+
+    def _connect(self, ip, operator):
+        client = None
+        try:
+            with get_scheduler().slot(operator, ip, timeout=SSH_WARMUP_SLOT_WAIT_SECONDS):
+                client = SSHClient(ip)
+                success, message = client.connect()
+            if not success:
+                logger.debug("Warm-up connection to %s failed: %s", ip, message)
+                client.close()
+                client = None
+        except TimeoutError:
+            logger.debug("No SSH slot free to warm up %s, skipping", ip)
+        except Exception as e:
+            logger.warning("Warm-up connection to %s failed: %s", ip, e)
+            if client is not None:
+                client.close()
+            client = None
+        finally:
+            with self._lock:
+                self._connecting.discard(ip)
+                if client is not None:
+                    self._clients[ip] = (client, time.monotonic() + self.ttl)
+                    if self._reaper is None:
+                        self._reaper = threading.Thread(target=self._reap_until_empty, name='ssh-warmup-reaper', daemon=True)
+                        self._reaper.start()
+
+    def take(self, ip):
+        """Removes and returns the warm, still connected client for ip, or None."""
+        with self._lock:
+            client, expires_at = self._clients.pop(ip, (None, None))
+        if client is not None and (expires_at <= time.monotonic() or not _is_live(client)):
+            client.close()
+            client = None
+        with self._lock:
+            if client is None:
+                self._misses += 1
+            else:
+                self._hits += 1
+        return client
+
+    def _reap(self):
+        """Closes the expired connections. Returns the seconds until the next expiry, or None if empty."""
+        now = time.monotonic()
+        with self._lock:
+            expired = [ip for ip, (client, expires_at) in self._clients.items() if expires_at <= now]
+            clients = [self._clients.pop(ip)[0] for ip in expired]
+            next_expiry = min((expires_at for client, expires_at in self._clients.values()), default=None)
+        for client in clients:
+            client.close()
+        if clients:
+            logger.debug("Closed %s unused warm SSH connections", len(clients))
+        return None if next_expiry is None else max(next_expiry - now, 0)
+
+    def _reap_until_empty(self):
+        while True:
+            wait = self._reap()
+            with self._lock:
+                if wait is None and not self._connecting:
+                    self._reaper = None
+                    return
+            time.sleep(wait if wait is not None else self.ttl)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'warm': len(self._clients),
+                'connecting': len(self._connecting),
+                'max_connections': self.max_connections,
+                'ttl_seconds': self.ttl,
+                'hits': self._hits,
+                'misses': self._misses,
+            }
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_warm_pool():
+    """Returns the process-wide warm connection pool, creating it on first use."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = WarmPool()
+    return _pool
+
+def checkout_client(ip):
+    """
+    Returns an SSHClient for ip: a warm, already connected one if the pool has it,
+    otherwise a new one. Either way call connect() (a no-op on warm clients) and close().
+    """
+    return get_warm_pool().take(ip) or SSHClient(ip)
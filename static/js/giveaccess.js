@@ -47,6 +47,22 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     };
 
+    // --- Connection Warm-up ---
+    // Tell the server which hosts are targeted while the rest of the form is filled in,
+    // so it can open the SSH connections ahead of the submit. Best effort, errors are ignored.
+    let warmUpTimer = null;
+    const scheduleWarmUp = () => {
+        clearTimeout(warmUpTimer);
+        warmUpTimer = setTimeout(() => {
+            if (!groupHiddenInput.value && !ipHiddenInput.value) return;
+            fetch(form.dataset.warmupUrl, {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ groups: groupHiddenInput.value, ips: ipHiddenInput.value }),
+            }).catch(() => {});
+        }, 400);
+    };
+
     // --- Tag Creation/Deletion ---
     const createTagElement = (text, displayList, valueSet, hiddenInput) => {
         const tag = document.createElement('li');
@@ -116,6 +132,7 @@ document.addEventListener('DOMContentLoaded', () => {
             selectedGroups.add(group);
             createTagElement(group, groupTagsDisplay, selectedGroups, groupHiddenInput);
             updateHiddenInput(groupHiddenInput, selectedGroups);
+            scheduleWarmUp();
         }
         groupInputField.value = ''; // Clear input field
         hideSuggestions();
@@ -149,6 +166,7 @@ document.addEventListener('DOMContentLoaded', () => {
              selectedIPs.add(ip.trim());
              createTagElement(ip.trim(), ipTagsDisplay, selectedIPs, ipHiddenInput);
              updateHiddenInput(ipHiddenInput, selectedIPs);
+             scheduleWarmUp();
         }
         ipInputField.value = ''; // Clear input
     };
@@ -166,27 +184,90 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     });
 
-    // --- Form Submission Logic ---
-    form.addEventListener('submit', async (event) => {
-        event.preventDefault(); // Stop default form submission
-        clearFeedback();
-        resultsDetailsDiv.style.display = 'none';
-        resultsListUl.innerHTML = ''; // Clear previous results
-        toggleLoading(true);
+    // --- Payload / Results Helpers ---
+    // datetime-local values have no zone, send them with the browser's UTC offset
+    const withLocalOffset = (value) => {
+        if (!value) return '';
+        const date = new Date(value);
+        const offset = -date.getTimezoneOffset();
+        const pad = (n) => String(Math.floor(Math.abs(n))).padStart(2, '0');
+        const sign = offset >= 0 ? '+' : '-';
+        return `${value.length === 16 ? `${value}:00` : value}${sign}${pad(offset / 60)}:${pad(offset % 60)}`;
+    };
 
-        // Collect data
+    const collectFormData = () => {
         const formData = new FormData(form);
-        const data = {
+        return {
             username: formData.get('username'),
             groups: groupHiddenInput.value, // Get from hidden input
             ips: ipHiddenInput.value,       // Get from hidden input
             pub_key: formData.get('pub_key'),
-            add_to_sudoers: formData.get('add_to_sudoers') === 'true' // Checkbox value
+            add_to_sudoers: formData.get('add_to_sudoers') === 'true', // Checkbox value
+            expires_at: withLocalOffset(formData.get('expires_at'))
         };
+    };
 
+    const isFormComplete = (data) => {
         // Basic Frontend Validation (Optional - supplements backend)
         if (!data.username || !data.pub_key || (!data.groups && !data.ips)) {
              showFeedback('Please fill in Username, Public Key, and at least one Group or IP.', 'error');
+             return false;
+        }
+        return true;
+    };
+
+    const renderResults = (results) => {
+        if (results && typeof results === 'object' && Object.keys(results).length > 0) {
+            resultsListUl.innerHTML = ''; // Clear any previous results first
+            resultsDetailsDiv.style.display = 'block'; // Show the container
+
+            // Loop through the results object (IP is key, res is value object)
+            Object.entries(results).forEach(([ip, res]) => {
+                const li = document.createElement('li'); // Create a list item for each IP
+
+                // Determine CSS class based on success status
+                const statusClass = res.success ? 'status-success' : 'status-failure';
+
+                // Get the message, provide a default if empty
+                const messageText = res.message || (res.success ? 'Operation successful' : 'Operation failed');
+
+                // Construct the HTML for the list item using defined CSS classes
+                li.innerHTML = `
+                    <span class="ip-address">${ip}:</span>
+                    <span class="${statusClass}"></span>
+                    <span class="message">${messageText}${res.attempts > 1 ? ` (${res.attempts} attempts)` : ''}</span>
+                `; // Uses spans for specific styling
+
+                resultsListUl.appendChild(li); // Add the new list item to the UL
+            });
+        } else {
+             resultsDetailsDiv.style.display = 'none'; // Hide if no results data
+        }
+    };
+
+    // --- Plan Preview ---
+    setupPlanPreview({
+        previewBtn: document.getElementById('preview-btn'),
+        getPayload: () => {
+            const data = collectFormData();
+            return isFormComplete(data) ? data : null;
+        },
+        showFeedback,
+        clearFeedback,
+        renderResults,
+    });
+
+    // --- Form Submission Logic ---
+    form.addEventListener('submit', async (event) => {
+        event.preventDefault(); // Stop default form submission
+        clearFeedback();
+        resultsDetailsDiv.style.display = 'none';
+        resultsListUl.innerHTML = ''; // Clear previous results
+        toggleLoading(true);
+
+        // Collect data
+        const data = collectFormData();
+        if (!isFormComplete(data)) {
              toggleLoading(false);
              return;
         }
@@ -210,32 +291,7 @@ document.addEventListener('DOMContentLoaded', () => {
                 showFeedback(result.message || 'Request processed successfully.', result.all_success ? 'success' : 'info');
 
                 // *** Display detailed results if available ***
-                if (result.results && typeof result.results === 'object' && Object.keys(result.results).length > 0) {
-                    resultsListUl.innerHTML = ''; // Clear any previous results first
-                    resultsDetailsDiv.style.display = 'block'; // Show the container
-
-                    // Loop through the results object (IP is key, res is value object)
-                    Object.entries(result.results).forEach(([ip, res]) => {
-                        const li = document.createElement('li'); // Create a list item for each IP
-
-                        // Determine CSS class based on success status
-                        const statusClass = res.success ? 'status-success' : 'status-failure';
-
-                        // Get the message, provide a default if empty
-                        const messageText = res.message || (res.success ? 'Operation successful' : 'Operation failed');
-
-                        // Construct the HTML for the list item using defined CSS classes
-                        li.innerHTML = `
-                            <span class="ip-address">${ip}:</span>
-                            <span class="${statusClass}"></span>
-                            <span class="message">${messageText}</span>
-                        `; // Uses spans for specific styling
-
-                        resultsListUl.appendChild(li); // Add the new list item to the UL
-                    });
-                } else {
-                     resultsDetailsDiv.style.display = 'none'; // Hide if no results data
-                }
+                renderResults(result.results);
 
                 // Optional: Clear form only on *full* success (if desired)
                 // if(result.all_success){
@@ -0,0 +1,104 @@
+// Shared "Preview Changes" / "Apply Plan" handling for the give and remove access pages.
+// The preview button's data-plan-url points at the plan endpoint; the returned plan id
+// is then applied via /accesspoint/plans/<plan_id>/apply.
+const ACTION_LABELS = {
+    create_user: 'create user',
+    create_ssh_dir: 'create .ssh directory',
+    create_authorized_keys: 'create authorized_keys',
+    add_key: 'add public key',
+    add_sudo: 'add to sudo group',
+    remove_sudo: 'remove from sudo group',
+    kill_sessions: 'lock account and kill sessions',
+    userdel: 'delete user (userdel -r)',
+};
+
+const setupPlanPreview = ({ previewBtn, getPayload, showFeedback, clearFeedback, renderResults }) => {
+    const planDetailsDiv = document.getElementById('plan-details');
+    const planListUl = document.getElementById('plan-list');
+    const applyBtn = document.getElementById('apply-plan-btn');
+    let currentPlanId = null;
+
+    const setLoading = (button, isLoading) => {
+        button.disabled = isLoading;
+        button.querySelector('.spinner').style.display = isLoading ? 'inline-block' : 'none';
+    };
+
+    const renderPlan = (plan) => {
+        planListUl.innerHTML = '';
+        Object.entries(plan.hosts).forEach(([ip, host]) => {
+            const li = document.createElement('li');
+            let text;
+            if (!host.success) {
+                text = `probe failed: ${host.message}`;
+            } else if (host.actions.length === 0) {
+                text = 'no changes';
+            } else {
+                text = host.actions.map(action => ACTION_LABELS[action] || action).join(', ');
+            }
+            li.innerHTML = `
+                <span class="ip-address">${ip}:</span>
+                <span class="${host.success ? 'status-success' : 'status-failure'}"></span>
+                <span class="message"></span>
+            `;
+            li.querySelector('.message').textContent = text;
+            planListUl.appendChild(li);
+        });
+        planDetailsDiv.style.display = 'block';
+    };
+
+    previewBtn.addEventListener('click', async () => {
+        const payload = getPayload();
+        if (!payload) {
+            return;
+        }
+        clearFeedback();
+        planDetailsDiv.style.display = 'none';
+        setLoading(previewBtn, true);
+        try {
+            const response = await fetch(previewBtn.dataset.planUrl, {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify(payload),
+            });
+            const result = await response.json();
+            if (response.ok) {
+                currentPlanId = result.plan_id;
+                renderPlan(result);
+                showFeedback(`Plan ready. It expires in ${result.expires_in} seconds.`, 'info');
+                planDetailsDiv.style.display = 'block';
+            } else {
+                showFeedback(`Error: ${result.error || response.statusText || 'Unknown error'}`, 'error');
+            }
+        } catch (error) {
+            console.error('Fetch Error (Plan):', error);
+            showFeedback(`Network or client-side error: ${error.message}`, 'error');
+        } finally {
+            setLoading(previewBtn, false);
+        }
+    });
+
+    applyBtn.addEventListener('click', async () => {
+        if (!currentPlanId) {
+            return;
+        }
+        clearFeedback();
+        setLoading(applyBtn, true);
+        try {
+            const response = await fetch(`/accesspoint/plans/${currentPlanId}/apply`, { method: 'POST' });
+            const result = await response.json();
+            planDetailsDiv.style.display = 'none';
+            currentPlanId = null;
+            if (response.ok) {
+                showFeedback(result.message || 'Plan applied.', result.all_success ? 'success' : 'info');
+                renderResults(result.results);
+            } else {
+                showFeedback(`Error: ${result.error || response.statusText || 'Unknown error'}`, 'error');
+            }
+        } catch (error) {
+            console.error('Fetch Error (Apply Plan):', error);
+            showFeedback(`Network or client-side error: ${error.message}`, 'error');
+        } finally {
+            setLoading(applyBtn, false);
+        }
+    });
+};
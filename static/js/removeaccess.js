@@ -158,6 +158,46 @@ document.addEventListener('DOMContentLoaded', () => {
      });
 
 
+    const getSelectedIps = () => {
+        const selectedIpCheckboxes = ipListUl.querySelectorAll('input[type="checkbox"]:checked');
+        return Array.from(selectedIpCheckboxes).map(cb => cb.value);
+    };
+
+    const renderResults = (results) => {
+        if (results && typeof results === 'object') {
+            resultsListUl.innerHTML = ''; // Clear just before populating
+            resultsDetailsDiv.style.display = 'block';
+            Object.entries(results).forEach(([ip, res]) => {
+                const li = document.createElement('li');
+                const statusClass = res.success ? 'status-success' : 'status-failure';
+                const messageText = res.message || (res.success ? 'Success' : 'Failure');
+                li.innerHTML = `
+                    <span class="ip-address">${ip}:</span>
+                    <span class="${statusClass}"></span>
+                    <span class="message">${messageText}${res.attempts > 1 ? ` (${res.attempts} attempts)` : ''}</span>
+                `;
+                resultsListUl.appendChild(li);
+            });
+        }
+    };
+
+    // --- Plan Preview ---
+    setupPlanPreview({
+        previewBtn: document.getElementById('preview-removal-btn'),
+        getPayload: () => {
+            const username = usernameInput.value.trim();
+            const ipsToRemove = getSelectedIps();
+            if (!username || ipsToRemove.length === 0) {
+                showFeedback('Please select at least one IP address to remove access from.', 'error');
+                return null;
+            }
+            return { username: username, ips: ipsToRemove };
+        },
+        showFeedback,
+        clearFeedback,
+        renderResults,
+    });
+
     // --- Event Listener: Form Submission (Remove Access) ---
     removeAccessForm.addEventListener('submit', async (event) => {
         event.preventDefault(); 
@@ -166,8 +206,7 @@ document.addEventListener('DOMContentLoaded', () => {
         resultsListUl.innerHTML = ''; // Clear previous results
 
         const username = usernameInput.value.trim(); // Get username again
-        const selectedIpCheckboxes = ipListUl.querySelectorAll('input[type="checkbox"]:checked');
-        const ipsToRemove = Array.from(selectedIpCheckboxes).map(cb => cb.value);
+        const ipsToRemove = getSelectedIps();
 
         if (!username) { 
              showFeedback('Username is missing.', 'error');
@@ -201,21 +240,7 @@ document.addEventListener('DOMContentLoaded', () => {
                  showFeedback(result.message || 'Removal request processed.', result.all_success ? 'success' : 'info');
 
                 // Display detailed results (reuse logic from giveaccess.js)
-                if (result.results && typeof result.results === 'object') {
-                    resultsListUl.innerHTML = ''; // Clear just before populating
-                    resultsDetailsDiv.style.display = 'block';
-                    Object.entries(result.results).forEach(([ip, res]) => {
-                        const li = document.createElement('li');
-                        const statusClass = res.success ? 'status-success' : 'status-failure';
-                        const messageText = res.message || (res.success ? 'Success' : 'Failure');
-                        li.innerHTML = `
-                            <span class="ip-address">${ip}:</span>
-                            <span class="${statusClass}"></span>
-                            <span class="message">${messageText}</span>
-                        `;
-                        resultsListUl.appendChild(li);
-                    });
-                }
+                renderResults(result.results);
 
                  // Optionally reset form fields or hide the IP list after successful submission
                  // resetToInitialState(); // Call this to go back to step 1
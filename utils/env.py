@@ -0,0 +1,47 @@
+import os
+from dotenv import load_dotenv
+
+_loaded = False
+
+def load_env():
+    """
+    Loads the .env file into os.environ, once per process.
+
+    Only entry points call this (create_app(), wsgi.py and the command line tools),
+    before anything reads a setting; modules read their settings through EnvSettings.
+    """
+    global _loaded
+    if not _loaded:
+        load_dotenv()
+        _loaded = True
+
+def env_flag(value):
+    """Parses a boolean setting ('1', 'true' and 'yes' mean True)."""
+    return value.lower() in ('1', 'true', 'yes')
+
+def env_list(value):
+    """Parses a comma separated setting into a set of non-empty names."""
+    return {name.strip() for name in value.split(',') if name.strip()}
+
+class EnvSettings:
+    """
+    Settings of a module, read from os.environ when they are used instead of at import.
+
+    Declared as NAME=(default, type) or NAME=(default, type, 'ENV_VAR') when the
+    variable has another name, and used as env.NAME. Every access reads the
+    environment, so values set by load_env() in the entry point apply no matter
+    when the module was imported. Assigning env.NAME overrides the setting, which
+    benchmarks use.
+    """
+
+    def __init__(self, **specs):
+        self._specs = specs
+
+    def __getattr__(self, name):
+        if name.startswith('_') or name not in self._specs:
+            raise AttributeError(name)
+        default, convert, *env_name = self._specs[name]
+        value = os.getenv(env_name[0] if env_name else name, default)
+        if value is None or convert is None:
+            return value
+        return convert(value)
@@ -0,0 +1,27 @@
+import fcntl
+import logging
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+@contextmanager
+def file_lock(lock_path, shared=False, blocking=True):
+    """
+    Holds an advisory fcntl lock on lock_path for the duration of the block.
+
+    The lock is taken on a dedicated lock file (never on the data file itself, which
+    may be replaced via os.replace) and excludes other processes as well as other
+    threads of the same process, since each call opens its own file description.
+
+    Args:
+        lock_path: Path of the lock file, created if missing.
+        shared: Take a shared (reader) lock instead of an exclusive one.
+        blocking: If False, raise BlockingIOError instead of waiting for the lock.
+    """
+    with open(lock_path, 'a') as lock_file:
+        flags = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+        fcntl.flock(lock_file.fileno(), flags if blocking else flags | fcntl.LOCK_NB)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
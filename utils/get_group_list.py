@@ -17,5 +17,5 @@ def get_group_list(base_path="assets/groups"):
         groups = [f.split('.')[0] for f in os.listdir(base_path) if f.endswith('.txt')]
         return groups
     except FileNotFoundError:
-        logger.warning(f"Group directory not found: {base_path}")
+        logger.warning("Group directory not found: %s", base_path)
         return []
\ No newline at end of file
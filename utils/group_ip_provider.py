@@ -1,5 +1,6 @@
 from utils.validators import validate_ip
 import logging
+import os
 
 logger = logging.getLogger(__name__)
 
@@ -22,5 +23,24 @@ def get_ips_from_group(group, base_path="assets/groups"):
             ips = [line.strip() for line in file if validate_ip(line.strip())]
             return ips
     except FileNotFoundError:
-        logger.warning(f"Group file not found: {filename}")
-        return []
\ No newline at end of file
+        logger.warning("Group file not found: %s", filename)
+        return []
+def group_files_stat(extra_paths=(), base_path="assets/groups"):
+    """
+    Returns the mtimes of extra_paths and of all group files, to notice edits of any of them.
+
+    Callers that map group members to settings (bastions, transport profiles) compare
+    it with the value of their last build.
+    """
+    paths = list(extra_paths)
+    try:
+        paths.extend(os.path.join(base_path, name) for name in sorted(os.listdir(base_path)))
+    except FileNotFoundError:
+        pass
+    stat = []
+    for path in paths:
+        try:
+            stat.append((path, os.stat(path).st_mtime_ns))
+        except FileNotFoundError:
+            continue
+    return tuple(stat)
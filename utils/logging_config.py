@@ -0,0 +1,176 @@
+"""
+Non-blocking logging pipeline.
+
+Request and SSH worker threads only put records on a queue. A single listener thread
+formats them and does the I/O: JSON lines to LOG_FILE and plain text to stderr.
+LOG_FILE is shared by all gunicorn workers, so it is reopened when an external
+logrotate moves it (WatchedFileHandler). Size-based rotation in the process
+(LOG_MAX_BYTES) is only safe when a single process writes the file. Records carry
+host/user/operator/operation fields taken from log_context(), and repetitive
+INFO/DEBUG messages are rate limited per call site.
+"""
+import os
+import sys
+import json
+import time
+import queue
+import atexit
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler, WatchedFileHandler
+from utils.env import EnvSettings
+
+env = EnvSettings(
+    LOG_FILE=('logs/app.log', str),
+    LOG_LEVEL=('INFO', str.upper),
+    # 0 (the default) leaves rotation to logrotate; > 0 rotates in the process, single process only
+    LOG_MAX_BYTES=(0, int),
+    LOG_BACKUP_COUNT=(5, int),
+    LOG_QUEUE_SIZE=(10000, int),
+    # Max INFO/DEBUG records per call site per LOG_RATE_LIMIT_WINDOW seconds, 0 disables
+    LOG_RATE_LIMIT=(20, int),
+    LOG_RATE_LIMIT_WINDOW=(10, float),
+)
+
+CONTEXT_FIELDS = ('host', 'user', 'operator', 'operation')
+_log_context = contextvars.ContextVar('log_context', default={})
+
+_listener = None
+_configure_lock = threading.Lock()
+
+@contextmanager
+def log_context(**fields):
+    """
+    Adds fields (host, user, operator, operation) to every record logged in the block.
+
+    Use contextvars.copy_context().run to carry the context into worker threads.
+    """
+    token = _log_context.set({**_log_context.get(), **fields})
+    try:
+        yield
+    finally:
+        _log_context.reset(token)
+
+class ContextFilter(logging.Filter):
+    """Copies the current log_context() fields onto the record (producer side, no I/O)."""
+
+    def filter(self, record):
+        for name, value in _log_context.get().items():
+            if not hasattr(record, name):
+                setattr(record, name, value)
+        return True
+
+class RateLimitFilter(logging.Filter):
+    """
+    Lets through at most `limit` records per call site and window for levels below
+    WARNING. The first record after a suppressed burst carries a `suppressed` count.
+    """
+
+    def __init__(self, limit=None, window=None):
+        super().__init__()
+        self.limit = env.LOG_RATE_LIMIT if limit is None else limit
+        self.window = env.LOG_RATE_LIMIT_WINDOW if window is None else window
+        self._lock = threading.Lock()
+        self._sites = {}  # (pathname, lineno) -> [window_start, count, suppressed]
+
+    def filter(self, record):
+        if self.limit <= 0 or record.levelno >= logging.WARNING:
+            return True
+        now = time.monotonic()
+        site = (record.pathname, record.lineno)
+        with self._lock:
+            state = self._sites.get(site)
+            if state is None or now - state[0] >= self.window:
+                suppressed = state[2] if state else 0
+                self._sites[site] = [now, 1, 0]
+                if suppressed:
+                    record.suppressed = suppressed
+                return True
+            if state[1] < self.limit:
+                state[1] += 1
+                return True
+            state[2] += 1
+            return False
+
+class DeferredQueueHandler(QueueHandler):
+    """
+    Enqueues records as-is and never blocks. Unlike QueueHandler, message formatting is
+    left to the listener thread; when the queue is full the record is dropped and
+    counted instead of stalling the request.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+        self._dropped_lock = threading.Lock()
+
+    def prepare(self, record):
+        if self.dropped:
+            with self._dropped_lock:
+                dropped, self.dropped = self.dropped, 0
+            if dropped:
+                record.dropped = dropped
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._dropped_lock:
+                self.dropped += 1
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message, context fields, exception."""
+
+    def format(self, record):
+        entry = {
+            'ts': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for name in CONTEXT_FIELDS + ('suppressed', 'dropped'):
+            value = getattr(record, name, None)
+            if value is not None:
+                entry[name] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+def configure_logging():
+    """
+    Installs the queue based pipeline on the root logger. Safe to call more than once;
+    the listener is stopped (and the queue drained) at interpreter exit.
+    """
+    global _listener
+    with _configure_lock:
+        if _listener is not None:
+            return
+        log_dir = os.path.dirname(env.LOG_FILE)
+        if log_dir:
+            os.makedirs(log_dir, exist_ok=True)
+
+        if env.LOG_MAX_BYTES > 0:
+            file_handler = RotatingFileHandler(env.LOG_FILE, maxBytes=env.LOG_MAX_BYTES, backupCount=env.LOG_BACKUP_COUNT)
+        else:
+            file_handler = WatchedFileHandler(env.LOG_FILE)
+        file_handler.setFormatter(JsonFormatter())
+        stream_handler = logging.StreamHandler(sys.stderr)
+        stream_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+
+        log_queue = queue.Queue(maxsize=env.LOG_QUEUE_SIZE)
+        queue_handler = DeferredQueueHandler(log_queue)
+        queue_handler.addFilter(ContextFilter())
+        queue_handler.addFilter(RateLimitFilter())
+
+        root = logging.getLogger()
+        root.setLevel(env.LOG_LEVEL)
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(queue_handler)
+
+        _listener = QueueListener(log_queue, file_handler, stream_handler, respect_handler_level=True)
+        _listener.start()
+        atexit.register(_listener.stop)
@@ -0,0 +1,108 @@
+import base64
+import hashlib
+import struct
+from typing import NamedTuple
+
+SUPPORTED_KEY_TYPES = (
+    'ssh-rsa',
+    'ssh-dss',
+    'ssh-ed25519',
+    'ecdsa-sha2-nistp256',
+    'ecdsa-sha2-nistp384',
+    'ecdsa-sha2-nistp521',
+)
+ECDSA_BITS = {'nistp256': 256, 'nistp384': 384, 'nistp521': 521}
+
+class PublicKey(NamedTuple):
+    key_type: str
+    key_data: str     # base64 blob as in the authorized_keys line
+    comment: str
+    fingerprint: str  # OpenSSH style "SHA256:..."
+    bits: int
+
+    @property
+    def normalized(self):
+        """The key without its comment, as "type base64"."""
+        return f"{self.key_type} {self.key_data}"
+
+def _read_string(blob, offset):
+    if offset + 4 > len(blob):
+        raise ValueError("Truncated key data")
+    (length,) = struct.unpack(">I", blob[offset:offset + 4])
+    start = offset + 4
+    end = start + length
+    if end > len(blob):
+        raise ValueError("Truncated key data")
+    return blob[start:end], end
+
+def _mpint_bits(value):
+    return int.from_bytes(value, 'big').bit_length()
+
+def _key_bits(key_type, blob, offset):
+    if key_type == 'ssh-rsa':
+        _exponent, offset = _read_string(blob, offset)
+        modulus, offset = _read_string(blob, offset)
+        return _mpint_bits(modulus)
+    if key_type == 'ssh-dss':
+        p, offset = _read_string(blob, offset)
+        return _mpint_bits(p)
+    if key_type == 'ssh-ed25519':
+        key, offset = _read_string(blob, offset)
+        if len(key) != 32:
+            raise ValueError("Invalid ed25519 key length")
+        return 256
+    curve, offset = _read_string(blob, offset)
+    curve = curve.decode('ascii', 'replace')
+    if key_type != f"ecdsa-sha2-{curve}" or curve not in ECDSA_BITS:
+        raise ValueError(f"ECDSA curve {curve} does not match key type {key_type}")
+    _point, offset = _read_string(blob, offset)
+    return ECDSA_BITS[curve]
+
+def fingerprint_of_blob(blob: bytes) -> str:
+    """Returns the OpenSSH SHA256 fingerprint of a decoded key blob."""
+    digest = base64.b64encode(hashlib.sha256(blob).digest()).decode('ascii').rstrip('=')
+    return f"SHA256:{digest}"
+
+def parse_public_key(pub_key: str) -> PublicKey:
+    """
+    Parses an OpenSSH public key line ("type base64 [comment]").
+
+    Decodes the base64 blob, checks that the type inside the blob matches the declared
+    type and computes the SHA256 fingerprint and key size.
+
+    Args:
+        pub_key: The public key line.
+
+    Returns:
+        PublicKey: The parsed key.
+
+    Raises:
+        ValueError: If the key is malformed or of an unsupported type.
+    """
+    parts = (pub_key or '').strip().split(None, 2)
+    if len(parts) < 2:
+        raise ValueError("Public key must have the form '<type> <base64> [comment]'")
+    key_type, key_data = parts[0], parts[1]
+    comment = parts[2] if len(parts) > 2 else ''
+    if key_type not in SUPPORTED_KEY_TYPES:
+        raise ValueError(f"Unsupported key type: {key_type}")
+    try:
+        blob = base64.b64decode(key_data, validate=True)
+    except ValueError:
+        raise ValueError("Public key data is not valid base64")
+
+    blob_type, offset = _read_string(blob, 0)
+    if blob_type.decode('ascii', 'replace') != key_type:
+        raise ValueError(f"Key data is of type {blob_type.decode('ascii', 'replace')}, not {key_type}")
+    bits = _key_bits(key_type, blob, offset)
+    return PublicKey(key_type, key_data, comment, fingerprint_of_blob(blob), bits)
+
+def is_fingerprint(value: str) -> bool:
+    """True if value looks like an OpenSSH SHA256 fingerprint."""
+    if not value or not value.startswith('SHA256:'):
+        return False
+    digest = value[len('SHA256:'):]
+    try:
+        return len(base64.b64decode(digest + '=' * (-len(digest) % 4), validate=True)) == 32
+    except ValueError:
+        return False
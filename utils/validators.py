@@ -1,5 +1,5 @@
 import re
-from typing import List
+from utils.ssh_keys import parse_public_key
 
 def validate_ip(ip_address: str) -> bool:
     """
@@ -42,23 +42,20 @@ def validate_username(username: str) -> bool:
 
 def validate_pub_key(pub_key: str) -> bool:
     """
-    Performs a basic validation of an SSH public key format by checking its starting prefix.
+    Validates an SSH public key line.
 
-    This check is *not* exhaustive. It only verifies if the key string begins
-    with a known identifier for common key types (RSA, DSS, ECDSA, Ed25519).
-    It does not validate the Base64 encoding or the key's cryptographic integrity.
+    The key must be of a supported type (RSA, DSS, ECDSA, Ed25519), its base64 data
+    must decode, and the type encoded inside the key data must match the declared
+    type. See utils.ssh_keys.parse_public_key().
 
     Args:
         pub_key: The SSH public key string to validate.
 
     Returns:
-        True if the key starts with a recognized SSH key type prefix, False otherwise.
+        True if the key parses, False otherwise.
     """
-    SUPPORTED_KEY_PREFIXES: List[str] = [
-        r"^ssh-rsa AAAAB3NzaC1yc2E",      # RSA key prefix
-        r"^ssh-dss AAAAB3NzaC1kc3M",      # DSS key prefix (less common now)
-        r"^ecdsa-sha2-nistp\d{3} AAAAE2VjZHNhLXNoYTItbmlzdHA", # ECDSA key prefixes (nistp256, 384, 521)
-        r"^ssh-ed25519 AAAAC3NzaC1lZDI1NTE5", # Ed25519 key prefix
-    ]
-
-    return any(re.match(pattern, pub_key) for pattern in SUPPORTED_KEY_PREFIXES)
+    try:
+        parse_public_key(pub_key)
+    except ValueError:
+        return False
+    return True